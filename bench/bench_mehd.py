@@ -0,0 +1,319 @@
+# bench/bench_mehd.py
+# Benchmark offline di download, salvataggio, lettura e controllo dei dati (nessuna richiesta di rete).
+# Ogni scenario gira in un processo separato per misurare il picco di memoria (RSS) in modo isolato.
+#
+# python bench/bench_mehd.py [--rows 2000000] [--days 30] [--latency-ms 20] [--storage file dataset]
+#                            [--scenarios download-serial load ...] [--output bench.json]
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pyarrow as pa
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bench.fake_exchange import FakeExchange, FakeAsyncExchange, generate_candles, TIMEFRAME_MS
+
+try:
+    import resource
+except ImportError:  # Windows: picco RSS non disponibile
+    resource = None
+
+SCENARIOS = [
+    'download-serial',   # mehd.download_ohlcv_data, una coppia
+    'download-async',    # download_pairs_async, più coppie concorrenti
+    'download-sharded',  # backfill_pair_sharded_async, una coppia divisa in finestre
+    'append',            # APPEND di un giorno sopra la fixture da --rows candele
+    'load',              # load_parquet completo + read_range di una settimana
+    'inspect',           # inspect_parquet sulla fixture
+    'check',             # check_raw_parquet: controllo completo, footer e deep
+]
+STORAGE_MODES = ['file', 'dataset']
+PAIR = 'BTC/USDT'
+
+class StageTimer:
+    """Raccoglie le durate di ogni stage sostituendo temporaneamente le funzioni con versioni cronometrate."""
+
+    def __init__(self):
+        self.durations = {}
+
+    def record(self, stage, seconds):
+        self.durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, module, name, stage):
+        original = getattr(module, name)
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        setattr(module, name, timed)
+
+    def summary(self):
+        result = {}
+        for stage, durations in self.durations.items():
+            values = np.asarray(durations) * 1000
+            result[stage] = {
+                'count': len(values),
+                'total_s': round(values.sum() / 1000, 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 2),
+                'p95_ms': round(float(np.percentile(values, 95)), 2),
+                'max_ms': round(float(values.max()), 2),
+            }
+        return result
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo corrente in MB (None se non misurabile)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def directory_size(path):
+    """Byte occupati da tutti i file sotto path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def configure_environment(data_dir, storage_mode, resample):
+    """Punta config e moduli sulla cartella temporanea e sulla modalità di storage dello scenario."""
+    from start import config
+    from utils import file_utils, download_utils, listing_dates, exchange_profiles
+    directories = {key: os.path.join(data_dir, key) for key in ('spot', 'perpetual', 'funding', 'open_interest')}
+    config.DATA_DIRECTORIES.update(directories)
+    for directory in directories.values():
+        os.makedirs(directory, exist_ok=True)
+    file_utils.STORAGE_MODE = storage_mode
+    download_utils.AUTO_RESAMPLE = resample
+    listing_dates.LISTING_CACHE_PATH = os.path.join(data_dir, 'listing_dates.json')
+    exchange_profiles.PROFILES_CACHE_PATH = os.path.join(data_dir, 'exchange_profiles.json')
+
+def instrument(timer, written):
+    """Stage cronometrati (fetch, limiter, segmenti, compattazione, save, resample) e contatore dei byte scritti su disco."""
+    from start import mehd, async_downloader
+    from utils import file_utils, download_utils, rate_limiter, staging
+
+    timer.wrap(mehd, 'fetch_ohlcv', 'fetch')
+    timer.wrap(async_downloader, 'fetch_ohlcv_async', 'fetch')
+    timer.wrap(mehd, 'save_parquet', 'save')
+    timer.wrap(async_downloader, 'save_parquet', 'save')
+    timer.wrap(async_downloader, 'write_parquet_atomic', 'shard_write')
+    timer.wrap(staging, 'write_segment', 'stage_segment')
+    timer.wrap(staging, 'compact_segments', 'compact')
+    timer.wrap(download_utils, 'resample_pair', 'resample')
+    timer.wrap(rate_limiter.TokenBucketRateLimiter, 'acquire', 'limiter_wait')
+    timer.wrap(rate_limiter.TokenBucketRateLimiter, 'acquire_async', 'limiter_wait')
+
+    original_write_table = file_utils.write_table
+
+    @functools.wraps(original_write_table)
+    def counting_write_table(table, path, *args, **kwargs):
+        original_write_table(table, path, *args, **kwargs)
+        written['bytes'] += os.path.getsize(path)
+
+    file_utils.write_table = counting_write_table
+
+def build_fixture(data_dir, storage_mode, rows, gap_ratio, resample):
+    """Scrive una fixture di `rows` candele 1m che termina un giorno fa (spazio per lo scenario append).
+
+    Con resample attivo include anche i timeframe superiori, così l'append misura l'aggiornamento incrementale.
+    """
+    from utils.file_utils import get_data_path, save_parquet
+    from utils.resample_utils import resample_pair
+    configure_environment(data_dir, storage_mode, resample)
+    path = get_data_path('fakeexchange', PAIR, '1m', 'spot')
+    end_ms = (int(time.time() * 1000) // TIMEFRAME_MS - 24 * 60) * TIMEFRAME_MS
+    timestamps, values = generate_candles(end_ms - rows * TIMEFRAME_MS, end_ms, gap_ratio=gap_ratio)
+    table = pa.table({'timestamp_ms': timestamps, 'open': values[:, 0], 'high': values[:, 1],
+                      'low': values[:, 2], 'close': values[:, 3], 'volume': values[:, 4]})
+    with contextlib.redirect_stdout(io.StringIO()):
+        save_parquet(table, path)
+        if resample:
+            resample_pair(path)
+    return path, int(timestamps[0]), int(timestamps[-1])
+
+def run_scenario(scenario, storage_mode, options, fixture_dir, work_dir):
+    """Esegue uno scenario e restituisce le metriche (chiamata nel processo figlio)."""
+    data_dir = os.path.join(work_dir, 'data')
+    if scenario == 'append':
+        shutil.copytree(fixture_dir, data_dir)
+    configure_environment(data_dir, storage_mode, options['resample'])
+
+    from start import mehd, async_downloader
+    from utils import file_utils
+    from utils.check_raw_parquet import check_parquet_file, check_parquet_files
+
+    timer = StageTimer()
+    written = {'bytes': 0}
+    instrument(timer, written)
+
+    exchange = FakeExchange(latency_ms=options['latency_ms'], page_limit=options['page_limit'],
+                            gap_ratio=options['gap_ratio'],
+                            symbols=[f"C{i}/USDT" for i in range(options['pairs'])] + [PAIR])
+
+    async def fake_create_async_exchange(exchange_name, markets=None, currencies=None):
+        return FakeAsyncExchange(latency_ms=options['latency_ms'], page_limit=options['page_limit'],
+                                 gap_ratio=options['gap_ratio'], end_ms=exchange.end_ms)
+    async_downloader.create_async_exchange = fake_create_async_exchange
+
+    path = file_utils.get_data_path(exchange.id, PAIR, '1m', 'spot')
+    fixture_path = path.replace(data_dir, fixture_dir, 1)
+    start_ms = exchange.end_ms - options['days'] * 24 * 60 * TIMEFRAME_MS
+    candles = 0
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scenario == 'download-serial':
+            summary = mehd.download_ohlcv_data(exchange, PAIR, 'spot', path, start_ms, append=False)
+            candles = summary['new_candles'] if summary else 0
+        elif scenario == 'download-async':
+            pairs = [{'symbol': f"C{i}/USDT", 'market_type': 'spot'} for i in range(options['pairs'])]
+            asyncio.run(async_downloader.download_pairs_async(exchange, pairs, start_ms, False, options['pairs'], []))
+            candles = sum(file_utils.get_data_stats(file_utils.get_data_path(exchange.id, p['symbol'], '1m', 'spot'))['rows']
+                          for p in pairs)
+        elif scenario == 'download-sharded':
+            asyncio.run(async_downloader.backfill_pair_sharded_async(exchange, {'symbol': PAIR, 'market_type': 'spot'},
+                                                                     start_ms, False, options['shards'], []))
+            candles = file_utils.get_data_stats(path)['rows']
+        elif scenario == 'append':
+            rows_before = file_utils.get_data_stats(path)['rows']
+            mehd.download_ohlcv_data(exchange, PAIR, 'spot', path, None, append=True)
+            candles = file_utils.get_data_stats(path)['rows'] - rows_before
+        elif scenario == 'load':
+            timer.wrap(file_utils, 'load_parquet', 'load_full')
+            timer.wrap(file_utils, 'read_range', 'read_range_week')
+            candles = len(file_utils.load_parquet(fixture_path))
+            stats = file_utils.get_data_stats(fixture_path)
+            week_start = stats['max_timestamp'] - 7 * 24 * 60 * TIMEFRAME_MS
+            file_utils.DATA_DIRECTORIES['spot'] = os.path.join(fixture_dir, 'spot')
+            file_utils.read_range(exchange.id, PAIR, 'spot', week_start, None, columns=['timestamp_ms', 'close'])
+        elif scenario == 'inspect':
+            timer.wrap(file_utils, 'inspect_parquet', 'inspect')
+            result = file_utils.inspect_parquet(fixture_path)
+            candles = result['summary']['rows'] if result else 0
+        elif scenario == 'check':
+            files = file_utils.list_partitions(fixture_path) if file_utils.is_dataset_path(fixture_path) else [fixture_path]
+            check_started = time.perf_counter()
+            for data_file in files:
+                check_parquet_file(data_file)
+            timer.record('check_full', time.perf_counter() - check_started)
+            for mode in ('fast', 'deep'):
+                check_started = time.perf_counter()
+                check_parquet_files(files, mode=mode, max_workers=1)
+                timer.record(f'check_{mode}', time.perf_counter() - check_started)
+            candles = file_utils.get_data_stats(fixture_path)['rows']
+    elapsed = time.perf_counter() - started
+
+    final_bytes = directory_size(data_dir) if os.path.exists(data_dir) else 0
+    return {
+        'scenario': scenario,
+        'storage': storage_mode,
+        'candles': int(candles),
+        'elapsed_s': round(elapsed, 3),
+        'candles_per_s': round(candles / elapsed) if elapsed > 0 else None,
+        'bytes_written': written['bytes'],
+        'final_bytes': final_bytes,
+        'write_amplification': round(written['bytes'] / final_bytes, 2) if written['bytes'] and final_bytes else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timer.summary(),
+    }
+
+def scenario_process(queue, *args):
+    try:
+        queue.put(run_scenario(*args))
+    except Exception as e:
+        queue.put({'scenario': args[0], 'storage': args[1], 'error': repr(e)})
+
+def run_isolated(context, *args):
+    """Esegue uno scenario in un processo nuovo (spawn) e ne restituisce il risultato."""
+    queue = context.Queue()
+    process = context.Process(target=scenario_process, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def print_report(results):
+    header = f"{'scenario':<18}{'storage':<9}{'candele':>10}{'tempo s':>10}{'candele/s':>12}{'write amp':>11}{'RSS MB':>9}"
+    print(header)
+    print('▬' * len(header))
+    for result in results:
+        if 'error' in result:
+            print(f"{result['scenario']:<18}{result['storage']:<9}  ❌ {result['error']}")
+            continue
+        print(f"{result['scenario']:<18}{result['storage']:<9}{result['candles']:>10}{result['elapsed_s']:>10.2f}"
+              f"{result['candles_per_s'] or 0:>12}{result['write_amplification'] or '-':>11}{result['peak_rss_mb'] or '-':>9}")
+        for stage, stats in result['stages'].items():
+            print(f"    {stage:<16} n={stats['count']:<6} tot={stats['total_s']:.3f}s "
+                  f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms max={stats['max_ms']}ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline di MEHD con exchange simulato")
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--storage', nargs='+', default=STORAGE_MODES, choices=STORAGE_MODES)
+    parser.add_argument('--rows', type=int, default=2_000_000, help="Candele della fixture (load/inspect/check/append)")
+    parser.add_argument('--days', type=int, default=30, help="Giorni di storico per gli scenari di download")
+    parser.add_argument('--pairs', type=int, default=8, help="Coppie per download-async")
+    parser.add_argument('--shards', type=int, default=8, help="Finestre per download-sharded")
+    parser.add_argument('--latency-ms', type=float, default=20, help="Latenza simulata per richiesta")
+    parser.add_argument('--page-limit', type=int, default=1000, help="Candele massime per pagina")
+    parser.add_argument('--gap-ratio', type=float, default=0.001, help="Frazione di candele mancanti")
+    parser.add_argument('--no-resample', action='store_true', help="Disattiva il resample dopo i download")
+    parser.add_argument('--workdir', help="Cartella di lavoro (default: temporanea, rimossa a fine run)")
+    parser.add_argument('--output', help="File JSON con i risultati")
+    args = parser.parse_args(argv)
+
+    options = {'days': args.days, 'pairs': args.pairs, 'shards': args.shards, 'latency_ms': args.latency_ms,
+               'page_limit': args.page_limit, 'gap_ratio': args.gap_ratio, 'resample': not args.no_resample}
+    work_root = args.workdir or tempfile.mkdtemp(prefix='mehd_bench_')
+    context = multiprocessing.get_context('spawn')
+    needs_fixture = {'append', 'load', 'inspect', 'check'} & set(args.scenarios)
+
+    results = []
+    try:
+        for storage_mode in args.storage:
+            fixture_dir = os.path.join(work_root, f"fixture_{storage_mode}")
+            if needs_fixture:
+                print(f"🧱 Fixture {storage_mode}: {args.rows} candele...")
+                started = time.perf_counter()
+                build_fixture(fixture_dir, storage_mode, args.rows, args.gap_ratio, options['resample'])
+                print(f"   scritta in {time.perf_counter() - started:.2f}s ({directory_size(fixture_dir) / 1e6:.1f} MB)")
+
+            for scenario in args.scenarios:
+                print(f"⏱️  {scenario} ({storage_mode})...")
+                work_dir = os.path.join(work_root, f"{scenario}_{storage_mode}")
+                results.append(run_isolated(context, scenario, storage_mode, options, fixture_dir, work_dir))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': options, 'rows': args.rows, 'results': results}, f, indent=2)
+    return 1 if any('error' in result for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
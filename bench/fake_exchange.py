@@ -0,0 +1,92 @@
+# bench/fake_exchange.py
+# Exchange ccxt simulato per benchmark offline: candele sintetiche deterministiche,
+# latenza, dimensione pagina e buchi configurabili. Nessuna richiesta di rete.
+import asyncio
+import time
+import numpy as np
+
+TIMEFRAME_MS = 60_000
+
+def generate_candles(start_ms, end_ms, tf_ms=TIMEFRAME_MS, gap_ratio=0.0, gaps=()):
+    """Candele OHLCV sintetiche in [start_ms, end_ms): stesse candele per gli stessi timestamp a ogni chiamata."""
+    first = -(-start_ms // tf_ms) * tf_ms
+    timestamps = np.arange(first, end_ms, tf_ms, dtype='int64')
+    keep = np.ones(len(timestamps), dtype=bool)
+
+    # Buchi pseudo-casuali ma stabili (hash del timestamp) e intervalli mancanti espliciti
+    if gap_ratio:
+        keep &= (timestamps // tf_ms * 2654435761) % 10_000 >= gap_ratio * 10_000
+    for gap_start, gap_end in gaps:
+        keep &= (timestamps < gap_start) | (timestamps >= gap_end)
+    timestamps = timestamps[keep]
+
+    phase = timestamps / 3.6e6
+    close = 30_000 + 2_000 * np.sin(phase / 24) + 50 * np.sin(phase * 7.3)
+    noise = (timestamps // tf_ms * 40503) % 1000 / 1000
+    open_ = close - 5 + 10 * noise
+    high = np.maximum(open_, close) + 3 * noise
+    low = np.minimum(open_, close) - 3 * (1 - noise)
+    volume = 1 + 20 * noise
+    return timestamps, np.column_stack([open_, high, low, close, volume])
+
+class FakeExchange:
+    """Sottoinsieme dell'API ccxt sincrona usata dal downloader (fetch_ohlcv, load_markets, rateLimit)."""
+
+    def __init__(self, exchange_id='fakeexchange', latency_ms=20, page_limit=1000, rate_limit_ms=1,
+                 end_ms=None, listing_ms=0, gap_ratio=0.0, gaps=(), symbols=('BTC/USDT',)):
+        self.id = exchange_id
+        self.rateLimit = rate_limit_ms
+        self.enableRateLimit = False
+        self.latency = latency_ms / 1000
+        self.page_limit = page_limit
+        self.end_ms = end_ms if end_ms is not None else int(time.time() * 1000) // TIMEFRAME_MS * TIMEFRAME_MS - TIMEFRAME_MS
+        self.listing_ms = listing_ms
+        self.gap_ratio = gap_ratio
+        self.gaps = tuple(gaps)
+        self.symbols = list(symbols)
+        self.markets = {}
+        self.currencies = {}
+        self.has = {'fetchOHLCV': True}
+        self.last_response_headers = {}
+        self.calls = 0
+
+    def load_markets(self, reload=False):
+        self.markets = {
+            symbol: {'symbol': symbol, 'base': symbol.split('/')[0], 'quote': symbol.split('/')[1].split(':')[0],
+                     'type': 'swap' if ':' in symbol else 'spot', 'active': True}
+            for symbol in self.symbols
+        }
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        self.currencies = currencies or {}
+
+    def parse_timeframe(self, timeframe):
+        return TIMEFRAME_MS // 1000
+
+    def build_page(self, since, limit):
+        self.calls += 1
+        limit = min(limit or self.page_limit, self.page_limit)
+        since = max(since or 0, self.listing_ms)
+        # Come gli exchange reali: pagina di `limit` candele a partire dalla prima esistente dopo since
+        timestamps, values = generate_candles(since, min(since + limit * TIMEFRAME_MS * 2, self.end_ms),
+                                              gap_ratio=self.gap_ratio, gaps=self.gaps)
+        timestamps, values = timestamps[:limit], values[:limit]
+        return [[int(ts)] + row for ts, row in zip(timestamps, values.tolist())]
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.build_page(since, limit)
+
+class FakeAsyncExchange(FakeExchange):
+    """Variante per ccxt.async_support (fetch_ohlcv asincrono, close)."""
+
+    async def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.build_page(since, limit)
+
+    async def close(self):
+        pass
@@ -0,0 +1,530 @@
+# start/async_downloader.py
+# Motore di download concorrente basato su ccxt.async_support.
+# Tutte le coppie di un exchange condividono lo stesso rate limiter (utils/rate_limiter.py):
+# il tempo totale dipende dal rate limit reale dell'exchange e non dal numero di coppie selezionate.
+import asyncio
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import ccxt.async_support as ccxt_async
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from utils.date_utils import get_current_timestamp_ms, timestamp_to_datetime
+from utils.file_utils import get_data_path, save_parquet, write_parquet_atomic, list_partitions
+from utils.download_utils import resolve_start_timestamp, build_download_summary, update_resampled
+from utils.ingest_buffer import OHLCVBuffer, BackgroundWriter
+from utils.staging import StagingWriter, recover_staging, has_committed_data
+from utils.retry_utils import call_with_retry_async, FetchError
+from utils.metrics import metrics, describe_path
+from utils.logger import PairProgress
+from utils.listing_dates import find_listing_timestamp_async
+from utils.exchange_profiles import get_ohlcv_limit, get_ohlcv_weight, get_history_start, get_oi_timeframe
+from start.config import (TIMEFRAME, BATCH_SAVE_SIZE, WRITER_QUEUE_SIZE, MAX_CONCURRENT_PAIRS, BACKFILL_SHARDS, MAX_EMPTY_WINDOWS,
+                          FETCH_FUNDING, FETCH_OPEN_INTEREST, FUNDING_TIMEFRAME, OI_TIMEFRAME)
+
+logger = logging.getLogger('MEHD')
+
+# Metriche aggiuntive dei perpetual: scaricate come stage paralleli alle candele della stessa coppia
+METRIC_STAGES = {
+    'funding': {
+        'label': 'Funding rate',
+        'capability': 'fetchFundingRateHistory',
+        'timeframe': FUNDING_TIMEFRAME,
+        'config_key': 'FUNDING_TIMEFRAME',
+        'limit': 100,
+    },
+    'oi': {
+        'label': 'Open interest',
+        'capability': 'fetchOpenInterestHistory',
+        'timeframe': OI_TIMEFRAME,
+        'config_key': 'OI_TIMEFRAME',
+        'limit': 100,
+    },
+}
+
+async def create_async_exchange(exchange_name, markets=None, currencies=None):
+    """Crea l'istanza ccxt async dell'exchange riusando i mercati già caricati se disponibili."""
+    exchange_class = getattr(ccxt_async, exchange_name, None)
+    if exchange_class is None:
+        raise ValueError(f"Exchange '{exchange_name}' non trovato in ccxt.async_support")
+
+    # Il throttling è gestito dal rate limiter condiviso, non da ccxt
+    exchange = exchange_class({'enableRateLimit': False})
+    if markets:
+        exchange.set_markets(markets, currencies)
+    else:
+        await exchange.load_markets()
+    return exchange
+
+async def fetch_ohlcv_async(exchange, pair, tf, since, limit=1000):
+    """Fetch OHLCV asincrono con rate limiter condiviso, retry con backoff e circuit breaker dell'exchange.
+
+    [] significa "nessun dato in questa finestra"; un fetch fallito solleva FetchError.
+    """
+    ohlcv = await call_with_retry_async(exchange, pair, 'ohlcv',
+                                        lambda: exchange.fetch_ohlcv(pair, tf, since=since, limit=limit),
+                                        get_ohlcv_weight(exchange, pair, limit))
+    metrics.inc('mehd_candles_fetched_total', len(ohlcv), exchange=exchange.id, pair=pair)
+    return ohlcv
+
+def get_enabled_metrics():
+    """Metriche perpetual abilitate in config (FETCH_FUNDING, FETCH_OPEN_INTEREST)."""
+    return [data_type for data_type, enabled in (('funding', FETCH_FUNDING), ('oi', FETCH_OPEN_INTEREST)) if enabled]
+
+async def get_listing_timestamp_async(exchange, pair, since):
+    """Prima candela disponibile della coppia (cache o ricerca binaria), None se since ha già dei dati."""
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    return await find_listing_timestamp_async(exchange.id, pair, TIMEFRAME, tf_ms, since,
+                                              lambda probe, limit: fetch_ohlcv_async(exchange, pair, TIMEFRAME, probe, limit))
+
+def blocking_fetch(exchange, pair):
+    """fetch(since, limit) sincrono per il codice eseguito in un thread (la richiesta gira nell'event loop)."""
+    loop = asyncio.get_running_loop()
+    return lambda since, limit: asyncio.run_coroutine_threadsafe(
+        fetch_ohlcv_async(exchange, pair, TIMEFRAME, since, limit), loop).result()
+
+def listing_finder(exchange, pair):
+    """find_listing sincrono per resolve_start_timestamp (eseguito in un thread): la ricerca gira nell'event loop."""
+    loop = asyncio.get_running_loop()
+    return lambda since: asyncio.run_coroutine_threadsafe(get_listing_timestamp_async(exchange, pair, since), loop).result()
+
+async def fetch_metric_page_async(exchange, pair, data_type, since, limit, timeframe=None):
+    """Fetch di una pagina di funding/open interest con lo stesso limiter, retry e circuit breaker delle candele."""
+    timeframe = timeframe or METRIC_STAGES[data_type]['timeframe']
+    if data_type == 'funding':
+        request = lambda: exchange.fetch_funding_rate_history(pair, since=since, limit=limit)
+    else:
+        request = lambda: exchange.fetch_open_interest_history(pair, timeframe, since=since, limit=limit)
+    return await call_with_retry_async(exchange, pair, data_type, request)
+
+def metric_entries_to_table(data_type, entries):
+    """Converte le strutture ccxt (funding/open interest history) nelle colonne dello schema."""
+    timestamps = [entry['timestamp'] for entry in entries]
+    if data_type == 'funding':
+        return pa.table({
+            'timestamp_ms': pa.array(timestamps, type=pa.int64()),
+            'funding_rate': pa.array([entry.get('fundingRate') for entry in entries], type=pa.float64()),
+        })
+    return pa.table({
+        'timestamp_ms': pa.array(timestamps, type=pa.int64()),
+        'open_interest': pa.array([entry.get('openInterestAmount', entry.get('openInterest')) for entry in entries], type=pa.float64()),
+        'open_interest_value': pa.array([entry.get('openInterestValue') for entry in entries], type=pa.float64()),
+    })
+
+async def download_metric_data_async(exchange, pair, data_type, filepath, start_timestamp=None, append=False, timeframe=None):
+    """Stage funding/open interest: append incrementale e ripresa dall'ultimo timestamp salvato."""
+    stage = METRIC_STAGES[data_type]
+    timeframe = timeframe or stage['timeframe']
+    if not exchange.has.get(stage['capability']):
+        logger.warning(f"⚠️ [{pair}] {stage['label']} non supportato per {exchange.id}")
+        return None
+
+    started = time.time()
+    since = await asyncio.to_thread(resolve_start_timestamp, filepath, start_timestamp, append)
+    first_timestamp = None
+    latest_timestamp = get_current_timestamp_ms()
+    entries = []
+    batch_count = 0
+    total_records = 0
+    pages = 0
+
+    try:
+        logger.info(f"📥 [{pair}] Scaricando {stage['label']} (TF: {timeframe})...")
+        while since < latest_timestamp:
+            page = await fetch_metric_page_async(exchange, pair, data_type, since, stage['limit'], timeframe)
+            # Alcuni exchange ignorano since per le pagine più vecchie: tieni solo i record nuovi
+            page = [entry for entry in page if entry.get('timestamp') is not None and entry['timestamp'] >= since]
+            if not page:
+                break
+
+            entries.extend(page)
+            first_timestamp = first_timestamp if first_timestamp is not None else page[0]['timestamp']
+            since = page[-1]['timestamp'] + 1
+            total_records += len(page)
+            batch_count += 1
+            pages += 1
+
+            if batch_count >= BATCH_SAVE_SIZE:
+                await asyncio.to_thread(save_parquet, metric_entries_to_table(data_type, entries), filepath, append)
+                entries = []
+                batch_count = 0
+                append = True  # Dopo il primo salvataggio, usa append
+
+        if entries:
+            await asyncio.to_thread(save_parquet, metric_entries_to_table(data_type, entries), filepath, append)
+
+        if not total_records:
+            logger.info(f"ℹ️ [{pair}] Nessun dato {stage['label']} aggiuntivo disponibile")
+        else:
+            logger.info(f"✅ [{pair}] {stage['label']} salvati: {total_records} record (TF: {timeframe})")
+        return await asyncio.to_thread(build_download_summary, pair, filepath, total_records, pages,
+                                       first_timestamp, since - 1, started)
+
+    except asyncio.CancelledError:
+        # Ctrl-C: i record scaricati dall'ultimo salvataggio vengono salvati prima di uscire, fuori dall'event loop
+        # (un salvataggio interrotto a metà viene ripetuto: il merge per timestamp_ms evita i duplicati)
+        if entries:
+            await asyncio.shield(asyncio.to_thread(save_parquet, metric_entries_to_table(data_type, entries),
+                                                   filepath, append))
+        raise
+    except FetchError as e:
+        error_msg = str(e.cause).lower()
+        if e.terminal and ('timeframe' in error_msg or 'interval' in error_msg):
+            logger.error(f"❌ [{pair}] TIMEFRAME NON SUPPORTATO per {stage['label']} su {exchange.id}: {timeframe}")
+            logger.info(f"💡 Prova a modificare {stage['config_key']} in config.py")
+        else:
+            logger.error(f"❌ [{pair}] Errore scaricamento {stage['label']}: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ [{pair}] Errore scaricamento {stage['label']}: {e}")
+        return None
+
+def build_metric_stages(exchange, pair_info, start_timestamp, append_mode, metric_types=None):
+    """Coroutine degli stage funding/open interest di una coppia (solo perpetual)."""
+    if pair_info['market_type'] != 'perpetual':
+        return []
+    metric_types = get_enabled_metrics() if metric_types is None else metric_types
+    pair = pair_info['symbol']
+    stages = []
+    for data_type in metric_types:
+        # Open interest: timeframe configurato o il più vicino supportato dall'exchange (profilo).
+        # Il funding history non accetta un timeframe: resta quello configurato (usato per il percorso)
+        timeframe = METRIC_STAGES[data_type]['timeframe']
+        if data_type == 'oi':
+            timeframe = get_oi_timeframe(exchange.id, timeframe)
+        filepath = get_data_path(exchange.id, pair, timeframe, 'perpetual', data_type)
+        stages.append(download_metric_data_async(exchange, pair, data_type, filepath, start_timestamp, append_mode, timeframe))
+    return stages
+
+def log_stage_errors(pair, results):
+    """Logga le eccezioni sfuggite agli stage paralleli di una coppia."""
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"❌ [{pair}] Stage fallito: {result}")
+
+async def download_metrics_async(exchange, pair_info, start_timestamp, append_mode, metric_types=None):
+    """Esegue i soli stage funding/open interest di una coppia con un'istanza async dedicata."""
+    async_exchange = await create_async_exchange(exchange.id, exchange.markets, exchange.currencies)
+    try:
+        stages = build_metric_stages(async_exchange, pair_info, start_timestamp, append_mode, metric_types)
+        results = await asyncio.gather(*stages, return_exceptions=True)
+    finally:
+        await async_exchange.close()
+    log_stage_errors(pair_info['symbol'], results)
+    return results
+
+async def download_ohlcv_data_async(exchange, pair, market_type, filepath, start_timestamp=None, append=False):
+    """Scarica dati OHLCV di una coppia in modo asincrono e restituisce il riepilogo del download.
+
+    Come nel downloader sincrono, ogni pagina va in un segmento di staging scritto da un BackgroundWriter
+    (la coroutine continua a scaricare) e la compattazione avviene in un thread separato.
+    """
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    limit = await asyncio.to_thread(get_ohlcv_limit, exchange.id, market_type, tf_ms, blocking_fetch(exchange, pair))
+    started = time.time()
+    buffer = OHLCVBuffer(limit)
+
+    # Recupero dei segmenti di una run interrotta e lettura del manifest sono bloccanti: fuori dall'event loop
+    append = await asyncio.to_thread(recover_staging, filepath, append) > 0 or append
+    since = await asyncio.to_thread(resolve_start_timestamp, filepath, start_timestamp, append,
+                                    listing_finder(exchange, pair), get_history_start(exchange.id, tf_ms))
+    first_timestamp = None
+    incremental = append
+    latest_timestamp = get_current_timestamp_ms()
+    window_ms = limit * tf_ms
+    staging = StagingWriter(filepath, append=append)
+    writer = BackgroundWriter(staging.write, append=append, max_pending=WRITER_QUEUE_SIZE, name=describe_path(filepath))
+    progress = PairProgress(pair, since, latest_timestamp, tf_ms)
+
+    def finish_writes():
+        """Attende i segmenti in coda e compatta quelli rimasti nei dati definitivi."""
+        progress.close()
+        writer.close()
+        staging.close()
+
+    try:
+        total_candles = 0
+        pages = 0
+        logger.info(f"📥 [{pair}] Scaricando dati OHLCV...")
+
+        try:
+            empty_windows = 0
+            while since < latest_timestamp:
+                ohlcv = await fetch_ohlcv_async(exchange, pair, TIMEFRAME, since, limit)
+                if not ohlcv:
+                    # Finestra senza dati (buco dell'exchange): si salta, a meno che non si sia arrivati al presente
+                    if since + window_ms < latest_timestamp and empty_windows < MAX_EMPTY_WINDOWS:
+                        since += window_ms
+                        empty_windows += 1
+                        progress.advance(since)
+                        continue
+                    logger.info(f"✅ [{pair}] Nessun dato aggiuntivo disponibile.")
+                    break
+
+                empty_windows = 0
+                buffer.append_page(ohlcv)
+                first_timestamp = first_timestamp if first_timestamp is not None else ohlcv[0][0]
+                since = ohlcv[-1][0] + 1  # +1 per evitare duplicati
+                total_candles += len(ohlcv)
+                pages += 1
+                progress.advance(since)
+
+                # Segmento di staging (submit attende solo se la coda del writer è piena)
+                await asyncio.to_thread(writer.submit, buffer.take())
+        except asyncio.CancelledError:
+            # Ctrl-C durante asyncio.run: le pagine già scaricate sono nei segmenti, si compattano prima di uscire.
+            # In un thread (l'event loop resta libero per le altre coppie) e protetto da una nuova cancellazione:
+            # asyncio.run attende comunque i thread dell'executor prima di chiudersi
+            logger.warning(f"⏹️ [{pair}] Interruzione: salvataggio di {total_candles} candele già scaricate...")
+            await asyncio.shield(asyncio.to_thread(finish_writes))
+            raise
+
+        logger.info(f"💾 [{pair}] Compattazione finale ({total_candles} candele scaricate)...")
+        await asyncio.to_thread(finish_writes)
+
+        if total_candles:
+            await asyncio.to_thread(update_resampled, filepath, first_timestamp if incremental else None)
+
+        logger.info(f"✅ [{pair}] Download completato - Nuove candele: {total_candles}")
+        return await asyncio.to_thread(build_download_summary, pair, filepath, total_candles, pages,
+                                       first_timestamp, since - 1, started)
+
+    except Exception as e:
+        logger.error(f"❌ [{pair}] Errore durante il download OHLCV: {e}")
+        try:
+            await asyncio.to_thread(finish_writes)  # Le pagine già scaricate vengono comunque salvate
+        except Exception:
+            pass
+        return None
+
+async def download_pair_data_async(exchange, pair_info, start_timestamp, append_mode, semaphore, metric_types=None):
+    """Scarica tutti i dati per una singola coppia rispettando il limite di coppie concorrenti.
+
+    Per i perpetual, funding e open interest girano in parallelo alle candele (stesso rate limiter).
+    Il risultato è il riepilogo delle candele.
+    """
+    pair = pair_info['symbol']
+    market_type = pair_info['market_type']
+
+    async with semaphore:
+        logger.info(f"📊 Processing: {pair} ({market_type.upper()})")
+        candles_path = get_data_path(exchange.id, pair, TIMEFRAME, market_type, 'candles')
+        results = await asyncio.gather(
+            download_ohlcv_data_async(exchange, pair, market_type, candles_path, start_timestamp, append_mode),
+            *build_metric_stages(exchange, pair_info, start_timestamp, append_mode, metric_types),
+            return_exceptions=True,
+        )
+        log_stage_errors(pair, results[1:])
+        if isinstance(results[0], Exception):
+            raise results[0]
+        return results[0]
+
+async def download_pairs_async(exchange, pairs, start_timestamp, append_mode, max_concurrency=MAX_CONCURRENT_PAIRS, metric_types=None):
+    """Scarica più coppie dello stesso exchange in parallelo con un unico budget di richieste."""
+    async_exchange = await create_async_exchange(exchange.id, exchange.markets, exchange.currencies)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    try:
+        tasks = [
+            download_pair_data_async(async_exchange, pair_info, start_timestamp, append_mode, semaphore, metric_types)
+            for pair_info in pairs
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await async_exchange.close()
+
+    for pair_info, result in zip(pairs, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ [{pair_info['symbol']}] Errore durante il download: {result}")
+    return [isinstance(result, dict) for result in results]
+
+def split_time_range(start_timestamp, end_timestamp, max_shards, page_span_ms, tf_ms):
+    """Divide [start, end) in finestre indipendenti allineate al timeframe (almeno una pagina per finestra)."""
+    total_span = end_timestamp - start_timestamp
+    if total_span <= 0:
+        return []
+
+    shard_count = max(1, min(max_shards, -(-total_span // page_span_ms)))
+    shard_span = -(-total_span // shard_count)
+    shard_span = -(-shard_span // tf_ms) * tf_ms  # Allinea al timeframe
+
+    windows = []
+    window_start = start_timestamp
+    while window_start < end_timestamp:
+        window_end = min(window_start + shard_span, end_timestamp)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+async def download_shard_async(exchange, pair, shard_dir, shard_index, window_start, window_end, limit=1000):
+    """Scarica una singola finestra temporale salvando ogni pagina in un file shard (tmp + rename atomico).
+
+    La pagina successiva si chiede solo dopo il salvataggio: un crash perde al massimo la pagina in corso
+    della finestra. A finestra completata viene scritto il marker shard_<n>.done (vedi pending_shard_windows).
+    """
+    buffer = OHLCVBuffer(limit)
+    part_count = 0
+    total_candles = 0
+    since = window_start
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    page_ms = limit * tf_ms
+    empty_windows = 0
+
+    with PairProgress(f"{pair} #{shard_index + 1}", window_start, window_end, tf_ms) as progress:
+        while since < window_end:
+            ohlcv = await fetch_ohlcv_async(exchange, pair, TIMEFRAME, since, limit)
+            # Tieni solo le candele della finestra: alcuni exchange restituiscono dati successivi
+            ohlcv = [candle for candle in ohlcv if since <= candle[0] < window_end]
+            if not ohlcv:
+                # Buco dell'exchange dentro lo shard: si salta una pagina invece di chiudere lo shard
+                if since + page_ms < window_end and empty_windows < MAX_EMPTY_WINDOWS:
+                    since += page_ms
+                    empty_windows += 1
+                    progress.advance(since)
+                    continue
+                break
+
+            empty_windows = 0
+            buffer.append_page(ohlcv)
+            part_path = os.path.join(shard_dir, f"shard_{shard_index:04d}_{part_count:05d}.parquet")
+            # Protetto dalla cancellazione: la pagina scaricata arriva comunque su disco
+            await asyncio.shield(asyncio.to_thread(write_parquet_atomic, buffer.take(), part_path))
+            part_count += 1
+            since = ohlcv[-1][0] + 1
+            total_candles += len(ohlcv)
+            progress.advance(since)
+
+    done_path = os.path.join(shard_dir, f"shard_{shard_index:04d}.done")
+    await asyncio.to_thread(lambda: open(done_path, 'w').close())
+    logger.info(f"🧩 [{pair}] Shard {shard_index + 1} completato: {total_candles} candele "
+                f"({timestamp_to_datetime(window_start)} → {timestamp_to_datetime(window_end)})")
+    return total_candles
+
+def write_shard_plan(shard_dir, windows):
+    """Salva le finestre del backfill: dopo un crash servono a riprendere quelle non completate."""
+    os.makedirs(shard_dir, exist_ok=True)
+    plan_path = os.path.join(shard_dir, 'plan.json')
+    with open(f"{plan_path}.tmp", 'w') as f:
+        json.dump(windows, f)
+    os.replace(f"{plan_path}.tmp", plan_path)
+
+def pending_shard_windows(shard_dir):
+    """Finestre del piano senza marker .done, ciascuna dall'ultima candela salvata nei suoi shard."""
+    try:
+        with open(os.path.join(shard_dir, 'plan.json')) as f:
+            windows = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    pending = []
+    for index, (window_start, window_end) in enumerate(windows):
+        if os.path.exists(os.path.join(shard_dir, f"shard_{index:04d}.done")):
+            continue
+        resume_from = window_start
+        for part in glob.glob(os.path.join(shard_dir, f"shard_{index:04d}_*.parquet")):
+            last = pc.max(pq.read_table(part, columns=['timestamp_ms']).column('timestamp_ms')).as_py()
+            if last is not None:
+                resume_from = max(resume_from, last + 1)
+        if resume_from < window_end:
+            pending.append((resume_from, window_end))
+    return pending
+
+def merge_shards(shard_dir, filepath, append=False):
+    """Unisce gli shard nell'output della coppia in ordine di timestamp (uno shard alla volta)."""
+    merged = 0
+    shard_parts = {}
+    for part in list_partitions(shard_dir):
+        shard_index = os.path.basename(part).split('_')[1]
+        shard_parts.setdefault(shard_index, []).append(part)
+
+    for shard_index in sorted(shard_parts):
+        table = pa.concat_tables([pq.read_table(part) for part in shard_parts[shard_index]], promote_options='permissive')
+        if table.num_rows == 0:
+            continue
+        save_parquet(table, filepath, append=append)
+        append = True  # Dopo il primo salvataggio, usa append
+        merged += table.num_rows
+    return merged
+
+def recover_shards(shard_dir, filepath, append):
+    """Unisce gli shard lasciati da un backfill interrotto (come recover_staging per i segmenti).
+
+    In APPEND, o se i dati definitivi non esistono ancora, gli shard vengono uniti e le finestre non
+    completate vengono restituite per riprenderle da dove si erano fermate; in OVERWRITE di dati esistenti
+    vengono scartati. Restituisce (candele recuperate, finestre da completare).
+    """
+    if not os.path.isdir(shard_dir):
+        return 0, []
+    merged, pending = 0, []
+    if append or not has_committed_data(filepath):
+        pending = pending_shard_windows(shard_dir)
+        if list_partitions(shard_dir):
+            merged = merge_shards(shard_dir, filepath, append=True)
+            logger.info(f"♻️ Recuperate {merged} candele da shard di un backfill interrotto")
+        if pending:
+            logger.info(f"♻️ {len(pending)} finestre di un backfill interrotto da completare")
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    return merged, pending
+
+async def backfill_pair_sharded_async(exchange, pair_info, start_timestamp, append_mode, max_shards=BACKFILL_SHARDS, metric_types=None):
+    """Backfill di una coppia dividendo [start, now) in finestre scaricate in parallelo (metriche perpetual incluse)."""
+    pair = pair_info['symbol']
+    market_type = pair_info['market_type']
+    filepath = get_data_path(exchange.id, pair, TIMEFRAME, market_type, 'candles')
+
+    async_exchange = await create_async_exchange(exchange.id, exchange.markets, exchange.currencies)
+    shard_dir = f"{filepath.rstrip(os.sep)}_shards"
+
+    try:
+        tf_ms = async_exchange.parse_timeframe(TIMEFRAME) * 1000
+        limit = await asyncio.to_thread(get_ohlcv_limit, async_exchange.id, market_type, tf_ms,
+                                        blocking_fetch(async_exchange, pair))
+        append_mode = await asyncio.to_thread(recover_staging, filepath, append_mode) > 0 or append_mode
+        recovered, pending = await asyncio.to_thread(recover_shards, shard_dir, filepath, append_mode)
+        append_mode = recovered > 0 or append_mode
+        since = await asyncio.to_thread(resolve_start_timestamp, filepath, start_timestamp, append_mode,
+                                        listing_finder(async_exchange, pair), get_history_start(async_exchange.id, tf_ms))
+        # Finestre interrotte prima dell'ultima candela salvata, poi il resto fino ad adesso
+        windows = [(window_start, min(window_end, since)) for window_start, window_end in pending if window_start < since]
+        windows += split_time_range(since, get_current_timestamp_ms(), max_shards, limit * tf_ms, tf_ms)
+        resample_from = min([since] + [window_start for window_start, _ in windows])
+        metric_stages = build_metric_stages(async_exchange, pair_info, start_timestamp, append_mode, metric_types)
+        if not windows:
+            logger.info(f"✅ [{pair}] Nessun dato aggiuntivo da scaricare.")
+            log_stage_errors(pair, await asyncio.gather(*metric_stages, return_exceptions=True))
+            return True
+
+        logger.info(f"🧩 [{pair}] Backfill in {len(windows)} finestre parallele...")
+        await asyncio.to_thread(write_shard_plan, shard_dir, windows)
+
+        tasks = [
+            download_shard_async(async_exchange, pair, shard_dir, index, window_start, window_end, limit)
+            for index, (window_start, window_end) in enumerate(windows)
+        ]
+        results = await asyncio.gather(*tasks, *metric_stages, return_exceptions=True)
+        results, metric_results = results[:len(tasks)], results[len(tasks):]
+        log_stage_errors(pair, metric_results)
+        failed = [result for result in results if isinstance(result, Exception)]
+
+        # Si uniscono anche le finestre completate dopo uno shard fallito: i buchi si recuperano con REPAIR.
+        # Gli shard vengono rimossi solo dopo il merge (se il merge non riesce, la run successiva li recupera)
+        merged = await asyncio.to_thread(merge_shards, shard_dir, filepath, append_mode)
+        await asyncio.to_thread(shutil.rmtree, shard_dir, True)
+        if merged:
+            await asyncio.to_thread(update_resampled, filepath, resample_from if append_mode else None)
+        if failed:
+            logger.error(f"❌ [{pair}] {len(failed)} shard falliti ({failed[0]}): salvate {merged} candele, "
+                         f"usa REPAIR per i buchi rimasti")
+            return False
+        logger.info(f"✅ [{pair}] Backfill completato - Nuove candele: {merged}")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ [{pair}] Errore durante il backfill: {e}")
+        return False
+    finally:
+        await async_exchange.close()
@@ -0,0 +1,167 @@
+# start/batch_runner.py
+# Esecuzione non interattiva (cron / job notturni) a partire da un file di specifica JSON.
+#
+# python start/batch_runner.py --spec jobs.json [--summary summary.json]
+#
+# Esempio di specifica:
+# {
+#     "exchanges": ["binance", "bybit"],       ("all" = tutti i SUPPORTED_EXCHANGES)
+#     "assets": ["BTC", "SOL"],
+#     "quotes": ["USDT"],                      (opzionale, default: tutte)
+#     "market_types": ["spot", "perpetual"],   (opzionale, default: entrambi)
+#     "mode": "append",                        (append | overwrite | repair)
+#     "start_date": "2023-01-01",              (opzionale, default: DEFAULT_START_DATE)
+#     "metrics": ["funding", "oi"]             (opzionale, solo perpetual, default: FETCH_FUNDING/FETCH_OPEN_INTEREST)
+# }
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.date_utils import parse_date
+from utils.file_utils import ensure_directory_exists
+from utils.market_utils import get_available_pairs
+from utils.logger import setup_logger
+from utils.metrics import MetricsExporter
+from start.config import SUPPORTED_EXCHANGES, LOGS_PATH, DATA_DIRECTORIES, DEFAULT_START_DATE, ASYNC_DOWNLOAD, MAX_CONCURRENT_PAIRS
+from start.async_downloader import download_pairs_async, get_enabled_metrics, METRIC_STAGES
+from start import mehd
+
+MODES = ('append', 'overwrite', 'repair')
+MARKET_TYPES = ('spot', 'perpetual')
+
+# Codici di uscita
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_INVALID_SPEC = 2
+
+def load_job_spec(spec_path):
+    """Carica e valida la specifica dei job."""
+    with open(spec_path) as f:
+        return validate_job_spec(json.load(f))
+
+def validate_job_spec(spec):
+    """Valida la specifica (dict) e applica i default."""
+    exchanges = spec.get('exchanges') or []
+    if exchanges in ('all', ['all']):
+        exchanges = spec['exchanges'] = list(SUPPORTED_EXCHANGES)
+    unsupported = [name for name in exchanges if name not in SUPPORTED_EXCHANGES]
+    if not exchanges or unsupported:
+        raise ValueError(f"Exchange non validi: {unsupported or 'nessuno'}. Supportati: {SUPPORTED_EXCHANGES}")
+    if not spec.get('assets'):
+        raise ValueError("Specificare almeno un asset in 'assets'")
+
+    spec.setdefault('quotes', [])
+    spec.setdefault('market_types', list(MARKET_TYPES))
+    spec.setdefault('mode', 'append')
+    spec.setdefault('start_date', DEFAULT_START_DATE)
+    spec.setdefault('metrics', get_enabled_metrics())
+    if spec['mode'] not in MODES:
+        raise ValueError(f"Modalità '{spec['mode']}' non valida. Usa {MODES}")
+    if any(market_type not in MARKET_TYPES for market_type in spec['market_types']):
+        raise ValueError(f"market_types non validi: {spec['market_types']}. Usa {MARKET_TYPES}")
+    if any(data_type not in METRIC_STAGES for data_type in spec['metrics']):
+        raise ValueError(f"metrics non valide: {spec['metrics']}. Usa {list(METRIC_STAGES)}")
+
+    spec['start_timestamp'] = parse_date(spec['start_date'])
+    return spec
+
+def plan_exchange_pairs(exchange, spec):
+    """Risolve la lista di coppie di un exchange applicando i filtri di asset, quote e tipo di mercato."""
+    quotes = {quote.upper() for quote in spec['quotes']}
+    pairs = []
+    for asset in spec['assets']:
+        for pair_info in get_available_pairs(exchange, asset):
+            quote = pair_info['quote_asset'].split(':')[0].upper()
+            if pair_info['market_type'] not in spec['market_types']:
+                continue
+            if quotes and quote not in quotes:
+                continue
+            pairs.append(pair_info)
+    return pairs
+
+def run_exchange_jobs(exchange_name, spec):
+    """Worker di un singolo exchange: pianifica ed esegue tutte le sue coppie (rate limit isolato)."""
+    result = {'exchange': exchange_name, 'pairs': [], 'error': None}
+    try:
+        exchange = mehd.validate_exchange(exchange_name)
+        pairs = plan_exchange_pairs(exchange, spec)
+        mehd.logger.info(f"🗂️ {exchange_name}: {len(pairs)} coppie pianificate")
+
+        mode = spec['mode']
+        append_mode = mode == 'append'
+        # Anche in APPEND: le coppie con dati riprendono dall'ultimo timestamp, quelle nuove partono da start_date
+        start_timestamp = spec['start_timestamp']
+
+        if mode == 'repair':
+            outcomes = [mehd.repair_pair_data(exchange, pair_info) for pair_info in pairs]
+        elif ASYNC_DOWNLOAD and pairs:
+            outcomes = asyncio.run(download_pairs_async(exchange, pairs, start_timestamp, append_mode, MAX_CONCURRENT_PAIRS, spec['metrics']))
+        else:
+            outcomes = [mehd.download_pair_data(exchange, pair_info, start_timestamp, append_mode, spec['metrics']) for pair_info in pairs]
+
+        result['pairs'] = [
+            {'symbol': pair_info['symbol'], 'market_type': pair_info['market_type'], 'success': bool(success)}
+            for pair_info, success in zip(pairs, outcomes)
+        ]
+    except Exception as e:
+        mehd.logger.error(f"❌ {exchange_name}: job interrotto: {e}")
+        result['error'] = str(e)
+    return result
+
+def run_jobs(spec, max_workers=None):
+    """Esegue i job con un worker per exchange e restituisce il riepilogo."""
+    started = time.time()
+    exchanges = spec['exchanges']
+    with ThreadPoolExecutor(max_workers=max_workers or len(exchanges)) as executor:
+        results = list(executor.map(lambda name: run_exchange_jobs(name, spec), exchanges))
+
+    pairs = [pair for result in results for pair in result['pairs']]
+    return {
+        'mode': spec['mode'],
+        'start_date': spec['start_date'],
+        'duration_s': round(time.time() - started, 1),
+        'total_pairs': len(pairs),
+        'ok': sum(1 for pair in pairs if pair['success']),
+        'failed': sum(1 for pair in pairs if not pair['success']),
+        'exchange_errors': sum(1 for result in results if result['error']),
+        'exchanges': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MEHD - download batch non interattivo")
+    parser.add_argument('--spec', required=True, help="File JSON con la specifica dei job")
+    parser.add_argument('--summary', help="File in cui salvare il riepilogo JSON (oltre allo stdout)")
+    parser.add_argument('--workers', type=int, default=None, help="Massimo exchange elaborati in parallelo")
+    args = parser.parse_args(argv)
+
+    for directory in DATA_DIRECTORIES.values():
+        ensure_directory_exists(directory)
+    setup_logger(LOGS_PATH)
+
+    try:
+        spec = load_job_spec(args.spec)
+    except (OSError, ValueError) as e:
+        print(json.dumps({'error': f"Specifica non valida: {e}"}))
+        return EXIT_INVALID_SPEC
+
+    metrics_exporter = MetricsExporter(LOGS_PATH).start()
+    try:
+        summary = run_jobs(spec, args.workers)
+    finally:
+        metrics_exporter.stop()
+    summary_json = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(summary_json)
+    print(summary_json)
+
+    all_ok = summary['failed'] == 0 and summary['exchange_errors'] == 0
+    return EXIT_OK if all_ok else EXIT_PARTIAL
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,17 +5,27 @@ import os
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 DATA_PATH = os.path.join(BASE_DIR, 'data')
 LOGS_PATH = os.path.join(BASE_DIR, 'logs')
+CACHE_PATH = os.path.join(BASE_DIR, 'cache')
 
 # Exchange configuration
 SUPPORTED_EXCHANGES = ['binance', 'bybit', 'kucoin', 'gateio', 'okx']
 DEFAULT_EXCHANGE = 'bybit'
 DEFAULT_ASSET = 'BTC'  # Solo asset, il pair viene dedotto dopo
+MARKETS_CACHE_TTL_HOURS = 24  # Validità della cache locale dei mercati (0 = sempre ricaricare)
 # DEFAULT_MARKET_TYPE = 'spot'      # Default market type Non usato per ora
 
 # Data download configuration
 TIMEFRAME = '1m'        # For OHLCV candles
 BATCH_SAVE_SIZE = 10
+WRITER_QUEUE_SIZE = 2     # Batch in attesa di scrittura nel writer in background (oltre, il fetch attende)
+STAGING_COMPACT_ROWS = 50000  # Ogni pagina va subito in un segmento di staging; compattazione ogni N righe e a fine download
 DEFAULT_START_DATE = '2000-01-01'  # Per evitare problemi con exchange come Bybit
+PROBE_LISTING_DATE = True      # Coppie senza dati: ricerca binaria della prima candela (cache/listing_dates.json)
+LISTING_PROBE_MAX_GAP_DAYS = 1  # Una candela più lontana di così dal since sondato conta come "prima del listing"
+
+# Timeframe superiori derivati dal 1m (utils/resample_utils.py), aggiornati dopo ogni download/repair
+RESAMPLE_TIMEFRAMES = ['5m', '15m', '1h', '4h', '1d']
+AUTO_RESAMPLE = True
 
 # Timeframes for different data types
 FUNDING_TIMEFRAME = '1h'  # Funding rate typically every 8h but for some new pairs can be less
@@ -25,15 +35,63 @@ OI_TIMEFRAME = '4h'       # Open Interest - start with 1h, can be changed
 FETCH_FUNDING = False
 FETCH_OPEN_INTEREST = False
 
+# Storage configuration
+# 'file'    -> un unico file per coppia (data/spot/binance_spot_BTC-USDT_1m.parquet)
+# 'dataset' -> dataset partizionato per coppia (data/spot/binance/BTC-USDT/1m/2024-03.parquet)
+STORAGE_MODE = 'dataset'
+PARTITION_BY = 'month'    # 'month' o 'day' (solo per STORAGE_MODE = 'dataset')
+
+# Profilo Parquet: livello zstd per tier ('hot' = file/partizione corrente riscritta spesso, 'cold' = partizioni chiuse)
+PARQUET_TIERS = {'hot': 3, 'cold': 9}
+PARQUET_ROW_GROUP_SIZES = {'candles': 10_080, 'funding': 4_096, 'oi': 4_096}  # 10080 = 1 settimana di candele 1m
+
 # Technical configuration
 USE_CCXT = True
-# CCXT gestisce automaticamente i rate limits - non serve configurazione
+
+# Rate limiter adattivo (token bucket per exchange, sostituisce il throttler di ccxt e la sleep fissa)
+RATE_LIMIT_CAPACITY = 3           # Peso massimo consumabile in burst
+RATE_LIMIT_MIN_FACTOR = 0.1       # Rate minimo dopo i backoff (frazione del rate nominale)
+RATE_LIMIT_RECOVERY_STEP = 0.05   # Recupero del rate per ogni richiesta riuscita (frazione del nominale)
+RATE_LIMIT_PENALTY_SECONDS = 2.0  # Pausa dopo un 429/DDoSProtection
+
+# Retry dei fetch (utils/retry_utils.py): backoff esponenziale con jitter e circuit breaker per exchange
+RETRY_MAX_ATTEMPTS = 6            # Tentativi sulla stessa pagina (429, errori di rete, 5xx) prima di fallire il download
+RETRY_BASE_DELAY = 1.0            # Attesa massima dopo il primo errore di rete, raddoppiata a ogni tentativo (secondi)
+RETRY_MAX_DELAY = 60.0            # Tetto dell'attesa tra due tentativi (secondi)
+CIRCUIT_BREAKER_THRESHOLD = 10    # Errori consecutivi sull'exchange (tutte le coppie) prima di sospendere le richieste
+CIRCUIT_BREAKER_COOLDOWN = 60.0   # Pausa delle richieste a circuito aperto, poi una richiesta di prova (secondi)
+MAX_EMPTY_WINDOWS = 10            # Pagine vuote consecutive saltate (buchi dell'exchange) prima di considerare finiti i dati
+
+# Profili degli exchange (utils/exchange_profiles.py): pagina OHLCV massima calibrata una volta e salvata in cache
+CALIBRATE_EXCHANGE_PROFILES = True
+
+# Download concorrente (ccxt.async_support) quando si selezionano più coppie
+ASYNC_DOWNLOAD = True
+MAX_CONCURRENT_PAIRS = 8  # Coppie scaricate in parallelo; il budget di richieste resta unico per exchange
+BACKFILL_SHARDS = 8       # Finestre temporali parallele per il backfill di una singola coppia (1 = disattivato)
+
+# Live tail (start/live_tail.py): aggiornamento continuo a ogni chiusura di candela
+LIVE_TAIL_DELAY_SECONDS = 2       # Attesa dopo la chiusura della candela (tempo di pubblicazione dell'exchange)
+LIVE_TAIL_CONCURRENCY = 32        # Coppie interrogate in parallelo in ogni round
+LIVE_TAIL_CATCHUP_PAGES = 5       # Pagine massime per coppia e round (recupero dopo pause o disconnessioni)
+LIVE_TAIL_BOOTSTRAP_CANDLES = 60  # Candele iniziali per le coppie senza storico
+LIVE_TAIL_RESAMPLE_MINUTES = 60   # Ogni quanto compattare i segmenti e propagare le candele ai timeframe superiori (0 = solo a fine tail)
+LIVE_TAIL_COMPACT_SEGMENTS = 30   # Segmenti di staging per coppia oltre i quali si compatta subito (0 = solo al flush)
+
+# Metriche di runtime (utils/metrics.py): esportate in logs/mehd_metrics.json e .prom
+METRICS_ENABLED = True
+METRICS_EXPORT_INTERVAL = 60  # Secondi tra due export durante le run lunghe (0 = solo a fine run)
+
+# Logging (utils/logger.py): file e console scritti da un thread dedicato, i download non attendono l'I/O dei log
+LOG_JSON = False              # True: file di log in JSON lines (logs/YYYY-MM-DD.jsonl) invece che in testo
+PROGRESS_BARS = True          # Barra di avanzamento per coppia durante i download (solo su terminale)
+PROGRESS_MIN_INTERVAL = 0.5   # Secondi minimi tra due aggiornamenti di una barra
 
 # Directory structure
 DATA_DIRECTORIES = {
     'spot': os.path.join(DATA_PATH, 'spot'),
     'perpetual': os.path.join(DATA_PATH, 'perpetual'), 
-    #'funding': os.path.join(DATA_PATH, 'funding'),
-    #'open_interest': os.path.join(DATA_PATH, 'open_interest'),
+    'funding': os.path.join(DATA_PATH, 'funding'),              # Solo STORAGE_MODE = 'file'
+    'open_interest': os.path.join(DATA_PATH, 'open_interest'),  # Solo STORAGE_MODE = 'file'
     'logs': LOGS_PATH
 }
\ No newline at end of file
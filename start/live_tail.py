@@ -0,0 +1,225 @@
+# start/live_tail.py
+# Modalità live-tail: processo continuo che mantiene aggiornate molte coppie a ogni chiusura di candela.
+# Le coppie e i mercati vengono risolti una volta sola; a ogni minuto si scaricano solo le candele
+# appena chiuse (round concorrenti sotto il rate limiter condiviso) e si scrivono come segmenti di staging:
+# costo di scrittura proporzionale alle sole candele nuove, compattazione e resample ogni LIVE_TAIL_RESAMPLE_MINUTES.
+# Una coppia che accumula LIVE_TAIL_COMPACT_SEGMENTS segmenti viene compattata subito, così _staging/ non si riempie
+# di file minuscoli (uno al minuto) e le letture non devono unirli tutti.
+#
+# python start/live_tail.py --exchange binance --assets BTC ETH SOL [--quotes USDT] [--market-types spot]
+# python start/live_tail.py --spec jobs.json     (stessa specifica del batch runner, 'mode' ignorato)
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.date_utils import get_current_timestamp_ms, timestamp_to_datetime
+from utils.file_utils import get_data_path, get_data_stats, list_segments, ensure_directory_exists
+from utils.download_utils import update_resampled
+from utils.ingest_buffer import OHLCVBuffer
+from utils.staging import write_segment, compact_segments, recover_staging
+from utils.metrics import metrics, MetricsExporter
+from utils.exchange_profiles import get_ohlcv_limit
+from utils.logger import setup_logger
+from start.config import (TIMEFRAME, LOGS_PATH, DATA_DIRECTORIES, LIVE_TAIL_DELAY_SECONDS, LIVE_TAIL_CONCURRENCY,
+                          LIVE_TAIL_CATCHUP_PAGES, LIVE_TAIL_BOOTSTRAP_CANDLES, LIVE_TAIL_RESAMPLE_MINUTES,
+                          LIVE_TAIL_COMPACT_SEGMENTS)
+from start.async_downloader import create_async_exchange, fetch_ohlcv_async
+from start.batch_runner import validate_job_spec, plan_exchange_pairs
+from start import mehd
+
+logger = logging.getLogger('MEHD')
+
+class LiveTailer:
+    """Stato in memoria del tail di un exchange: coppie, percorsi e ultimo timestamp salvato per coppia."""
+
+    def __init__(self, exchange, pairs):
+        self.exchange = exchange
+        self.pairs = pairs
+        self.tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+        self.semaphore = asyncio.Semaphore(LIVE_TAIL_CONCURRENCY)
+        self.paths = {}
+        self.limits = {}  # Coppia -> candele per pagina (profilo dell'exchange, nessuna calibrazione nel tail)
+        self.last_timestamps = {}
+        self.resample_since = {}  # Coppia -> primo timestamp non ancora propagato ai timeframe superiori
+        self.segment_counts = {}  # Coppia -> segmenti di staging scritti dall'ultima compattazione
+
+    def bootstrap(self):
+        """Legge una sola volta l'ultimo timestamp di ogni coppia dal manifest (nessun file caricato)."""
+        current_candle = get_current_timestamp_ms() // self.tf_ms * self.tf_ms
+        for pair_info in self.pairs:
+            pair = pair_info['symbol']
+            path = get_data_path(self.exchange.id, pair, TIMEFRAME, pair_info['market_type'], 'candles')
+            recover_staging(path, True)  # Segmenti di un tail interrotto
+            stats = get_data_stats(path)
+            self.paths[pair] = path
+            self.limits[pair] = get_ohlcv_limit(self.exchange.id, pair_info['market_type'])
+            if stats is not None and stats['rows'] and stats['max_timestamp'] is not None:
+                self.last_timestamps[pair] = stats['max_timestamp']
+            else:
+                # Coppia senza storico: il tail parte dalle ultime candele (il backfill resta compito di mehd)
+                self.last_timestamps[pair] = current_candle - (LIVE_TAIL_BOOTSTRAP_CANDLES + 1) * self.tf_ms
+
+    async def tail_pair(self, pair, round_started_ms):
+        """Scarica le candele chiuse successive all'ultima salvata e le scrive in un segmento (restituisce le candele nuove)."""
+        limit = self.limits[pair]
+        async with self.semaphore:
+            buffer = OHLCVBuffer(limit)
+            since = self.last_timestamps[pair] + 1
+            first_timestamp = None
+            for _ in range(LIVE_TAIL_CATCHUP_PAGES):
+                ohlcv = await fetch_ohlcv_async(self.exchange, pair, TIMEFRAME, since, limit)
+                # Solo candele chiuse: la candela in corso verrebbe riscritta al round successivo
+                closed = [candle for candle in ohlcv if candle[0] >= since and candle[0] + self.tf_ms <= round_started_ms]
+                if not closed:
+                    break
+                buffer.append_page(closed)
+                first_timestamp = first_timestamp if first_timestamp is not None else closed[0][0]
+                since = closed[-1][0] + 1
+                if len(ohlcv) < limit:
+                    break  # Raggiunta la candela più recente
+
+        if not len(buffer):
+            return 0
+
+        count = len(buffer)
+        await asyncio.to_thread(write_segment, buffer.take(), self.paths[pair])
+        self.last_timestamps[pair] = since - 1
+        self.resample_since[pair] = min(self.resample_since.get(pair, first_timestamp), first_timestamp)
+        self.segment_counts[pair] = self.segment_counts.get(pair, 0) + 1
+        if LIVE_TAIL_COMPACT_SEGMENTS and self.segment_counts[pair] >= LIVE_TAIL_COMPACT_SEGMENTS:
+            await self.compact(pair)  # Il resample resta al flush: resample_since non cambia
+
+        # Freschezza: ritardo tra la chiusura dell'ultima candela e la sua scrittura su disco
+        freshness = (get_current_timestamp_ms() - (since - 1 + self.tf_ms)) / 1000
+        metrics.observe('mehd_live_tail_freshness_seconds', freshness, exchange=self.exchange.id)
+        return count
+
+    async def run_round(self):
+        """Un round su tutte le coppie; restituisce (coppie aggiornate, candele nuove)."""
+        round_started_ms = get_current_timestamp_ms()
+        with metrics.timed('mehd_live_tail_round_seconds', exchange=self.exchange.id):
+            results = await asyncio.gather(
+                *(self.tail_pair(pair_info['symbol'], round_started_ms) for pair_info in self.pairs),
+                return_exceptions=True,
+            )
+
+        updated, candles = 0, 0
+        for pair_info, result in zip(self.pairs, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ [{pair_info['symbol']}] Errore nel tail: {result}")
+            elif result:
+                updated += 1
+                candles += result
+        metrics.inc('mehd_live_tail_candles_total', candles, exchange=self.exchange.id)
+        return updated, candles
+
+    async def compact(self, pair):
+        """Compatta i segmenti di staging di una coppia nei dati definitivi."""
+        path = self.paths[pair]
+        self.segment_counts[pair] = 0
+        await asyncio.to_thread(lambda: compact_segments(path, list_segments(path)))
+
+    async def flush(self):
+        """Compatta i segmenti accumulati dall'ultimo flush e li propaga ai timeframe superiori."""
+        pending, self.resample_since = self.resample_since, {}
+        for pair, since in pending.items():
+            await self.compact(pair)
+            await asyncio.to_thread(update_resampled, self.paths[pair], since)
+
+    async def run(self, max_rounds=None):
+        """Loop principale: si sveglia LIVE_TAIL_DELAY_SECONDS dopo ogni chiusura di candela."""
+        await asyncio.to_thread(self.bootstrap)
+        logger.info(f"📡 [{self.exchange.id}] Live tail di {len(self.pairs)} coppie ({TIMEFRAME})")
+        rounds = 0
+        flush_every_ms = LIVE_TAIL_RESAMPLE_MINUTES * 60_000
+        last_flush = get_current_timestamp_ms()
+
+        while True:
+            started = time.time()
+            updated, candles = await self.run_round()
+            rounds += 1
+            elapsed = time.time() - started
+            if candles:
+                newest = max(self.last_timestamps.values())
+                logger.info(f"📡 [{self.exchange.id}] Round {rounds}: {updated}/{len(self.pairs)} coppie, "
+                            f"{candles} candele (fino a {timestamp_to_datetime(newest)}) in {elapsed:.2f}s")
+
+            if max_rounds is not None and rounds >= max_rounds:
+                break
+
+            now_ms = get_current_timestamp_ms()
+            if flush_every_ms and now_ms - last_flush >= flush_every_ms:
+                await self.flush()
+                last_flush = now_ms
+
+            # Prossimo risveglio: chiusura della candela successiva + margine per la pubblicazione sull'exchange
+            next_close = (get_current_timestamp_ms() // self.tf_ms + 1) * self.tf_ms
+            await asyncio.sleep(max(0.0, (next_close - get_current_timestamp_ms()) / 1000 + LIVE_TAIL_DELAY_SECONDS))
+
+        await self.flush()
+
+async def tail_exchange(exchange_name, spec, max_rounds=None):
+    """Risolve le coppie di un exchange (una volta) ed esegue il live tail."""
+    exchange = await asyncio.to_thread(mehd.validate_exchange, exchange_name)
+    pairs = await asyncio.to_thread(plan_exchange_pairs, exchange, spec)
+    if not pairs:
+        logger.warning(f"⚠️ [{exchange_name}] Nessuna coppia da seguire")
+        return
+
+    async_exchange = await create_async_exchange(exchange.id, exchange.markets, exchange.currencies)
+    try:
+        await LiveTailer(async_exchange, pairs).run(max_rounds)
+    finally:
+        await async_exchange.close()
+
+async def run_live_tail(spec, max_rounds=None):
+    """Un tail per exchange nello stesso event loop (rate limiter separati per exchange)."""
+    results = await asyncio.gather(
+        *(tail_exchange(exchange_name, spec, max_rounds) for exchange_name in spec['exchanges']),
+        return_exceptions=True,
+    )
+    for exchange_name, result in zip(spec['exchanges'], results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ [{exchange_name}] Live tail interrotto: {result}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MEHD - live tail continuo delle candele")
+    parser.add_argument('--spec', help="File JSON con la specifica (come il batch runner)")
+    parser.add_argument('--exchange', nargs='+', help="Exchange da seguire")
+    parser.add_argument('--assets', nargs='+', help="Asset da seguire (es. BTC ETH)")
+    parser.add_argument('--quotes', nargs='+', default=[], help="Quote ammesse (default: tutte)")
+    parser.add_argument('--market-types', nargs='+', default=['spot', 'perpetual'], help="spot e/o perpetual")
+    parser.add_argument('--rounds', type=int, default=None, help="Numero di round (default: infiniti)")
+    args = parser.parse_args(argv)
+
+    for directory in DATA_DIRECTORIES.values():
+        ensure_directory_exists(directory)
+    setup_logger(LOGS_PATH)
+
+    try:
+        if args.spec:
+            with open(args.spec) as f:
+                spec = validate_job_spec(json.load(f))
+        else:
+            spec = validate_job_spec({'exchanges': args.exchange or [], 'assets': args.assets or [],
+                                      'quotes': args.quotes, 'market_types': args.market_types})
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Specifica non valida: {e}")
+        return 2
+
+    metrics_exporter = MetricsExporter(LOGS_PATH).start()
+    try:
+        asyncio.run(run_live_tail(spec, args.rounds))
+    except KeyboardInterrupt:
+        logger.info("\n⏹️ Live tail interrotto dall'utente")
+    finally:
+        metrics_exporter.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
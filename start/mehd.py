@@ -1,9 +1,11 @@
 # start/mehd.py
 import ccxt
-import pandas as pd
+import asyncio
+import logging
 import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from colorama import init, Fore, Style
 
 # Inizializza colorama
@@ -12,10 +14,25 @@ init(autoreset=True)
 # Import da utils e config
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from utils.date_utils import parse_date, get_current_timestamp_ms, timestamp_to_datetime
-from utils.file_utils import get_parquet_filename, check_file_exists, load_parquet, save_parquet, ensure_directory_exists, inspect_parquet
+from utils.file_utils import get_data_path, get_data_stats, get_confirmed_gaps, add_confirmed_gaps, load_timestamps, find_missing_ranges, save_parquet, ensure_directory_exists, inspect_parquet
 from utils.market_utils import detect_market_type, get_available_pairs, format_volume_display
-from utils.logger import setup_logger
-from start.config import SUPPORTED_EXCHANGES, DEFAULT_EXCHANGE, DEFAULT_ASSET, TIMEFRAME, DATA_PATH, LOGS_PATH, FETCH_FUNDING, FETCH_OPEN_INTEREST, DATA_DIRECTORIES, DEFAULT_START_DATE, FUNDING_TIMEFRAME, OI_TIMEFRAME
+from utils.download_utils import resolve_start_timestamp, build_download_summary, update_resampled
+from utils.ingest_buffer import OHLCVBuffer, BackgroundWriter
+from utils.staging import StagingWriter, recover_staging
+from utils.retry_utils import call_with_retry, FetchError
+from utils.markets_cache import load_markets_cached, ensure_symbol_loaded
+from utils.listing_dates import find_listing_timestamp
+from utils.exchange_profiles import get_ohlcv_limit, get_ohlcv_weight, get_history_start
+from utils.logger import setup_logger, PairProgress
+from utils.metrics import metrics, MetricsExporter, describe_path
+from start.config import SUPPORTED_EXCHANGES, DEFAULT_EXCHANGE, DEFAULT_ASSET, TIMEFRAME, LOGS_PATH, DATA_DIRECTORIES, DEFAULT_START_DATE, BATCH_SAVE_SIZE, WRITER_QUEUE_SIZE, ASYNC_DOWNLOAD, MAX_CONCURRENT_PAIRS, BACKFILL_SHARDS, MAX_EMPTY_WINDOWS
+from start.async_downloader import download_pairs_async, backfill_pair_sharded_async, download_metrics_async, get_enabled_metrics, METRIC_STAGES
+
+# Logger condiviso (configurato in main tramite setup_logger)
+logger = logging.getLogger('MEHD')
+
+# Scelta dell'exchange che scarica l'asset da tutti i SUPPORTED_EXCHANGES
+EXCHANGE_ALL = 'all'
 
 def validate_exchange(exchange_name):
     """Valida se l'exchange è supportato e raggiungibile."""
@@ -27,7 +44,7 @@ def validate_exchange(exchange_name):
             raise ValueError(f"Exchange '{exchange_name}' non trovato in CCXT")
         exchange = exchange_class()
         logger.info(f"Connessione a {exchange_name} in corso...")
-        markets = exchange.load_markets()
+        markets = load_markets_cached(exchange)
         if markets is None:
             raise ValueError(f"Impossibile caricare i mercati per {exchange_name}: risposta None")
         logger.info(f"✅ Mercati caricati per {exchange_name}, trovati {len(markets)} mercati")
@@ -36,294 +53,379 @@ def validate_exchange(exchange_name):
         logger.error(f"Errore dettagliato nella connessione a {exchange_name}: {str(e)}")
         raise ValueError(f"Errore nella connessione all'exchange {exchange_name}: {str(e)}")
 
-def get_oldest_timestamp(exchange, pair, market_type='spot'):
-    """Ottiene il timestamp più vecchio disponibile per il pair."""
-    try:
-        # Prova a ottenere le candele più vecchie disponibili
-        ohlcv = exchange.fetch_ohlcv(pair, TIMEFRAME, since=0, limit=1)
-        if ohlcv:
-            return ohlcv[0][0]
-    except Exception as e:
-        logger.warning(f"Impossibile determinare timestamp più vecchio: {e}")
-    
-    # Default: usa la data di default dal config
-    return parse_date(DEFAULT_START_DATE)
+def get_page_limit(exchange, pair, market_type):
+    """Candele per pagina dal profilo dell'exchange (calibrato con poche richieste al primo uso)."""
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    return get_ohlcv_limit(exchange.id, market_type, tf_ms,
+                           lambda since, limit: fetch_ohlcv(exchange, pair, TIMEFRAME, since, limit))
+
+def get_listing_timestamp(exchange, pair, since):
+    """Prima candela disponibile della coppia (cache o ricerca binaria), None se since ha già dei dati."""
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    return find_listing_timestamp(exchange.id, pair, TIMEFRAME, tf_ms, since,
+                                  lambda probe, limit: fetch_ohlcv(exchange, pair, TIMEFRAME, probe, limit))
 
 def fetch_ohlcv(exchange, pair, tf, since, limit=1000):
-    """Fetch OHLCV con gestione rate limits."""
-    try:
-        return exchange.fetch_ohlcv(pair, tf, since=since, limit=limit)
-    except ccxt.NetworkError as e:
-        logger.error(f"Errore di rete durante il fetch: {e}")
-        time.sleep(5)
-        return []
-    except ccxt.ExchangeError as e:
-        logger.error(f"Errore exchange durante il fetch: {e}")
-        return []
-    except Exception as e:
-        logger.error(f"Errore imprevisto durante il fetch: {e}")
-        return []
+    """Fetch OHLCV con rate limiter adattivo, retry con backoff e circuit breaker dell'exchange.
+
+    [] significa "nessun dato in questa finestra"; un fetch fallito solleva FetchError.
+    """
+    ohlcv = call_with_retry(exchange, pair, 'ohlcv',
+                            lambda: exchange.fetch_ohlcv(pair, tf, since=since, limit=limit),
+                            get_ohlcv_weight(exchange, pair, limit))
+    metrics.inc('mehd_candles_fetched_total', len(ohlcv), exchange=exchange.id, pair=pair)
+    return ohlcv
 
 def download_ohlcv_data(exchange, pair, market_type, filepath, start_timestamp=None, append=False):
-    """Scarica dati OHLCV e salva in Parquet."""
-    data = []
-    limit = 1000
-    batch_save_size = 10
-    batch_count = 0
+    """Scarica dati OHLCV, li salva in Parquet e restituisce un riepilogo del download.
+
+    Pipeline: questo thread scarica e converte le pagine, un BackgroundWriter scrive ogni pagina in un
+    segmento di staging (un crash perde solo le pagine non ancora scritte, al massimo WRITER_QUEUE_SIZE + 2)
+    e la compattazione nei dati definitivi avviene in un thread separato ogni STAGING_COMPACT_ROWS righe e a fine download.
+    """
+    limit = get_page_limit(exchange, pair, market_type)
+    started = time.time()
+    
+    # Buffer colonnare di una pagina: ogni pagina diventa subito un segmento
+    buffer = OHLCVBuffer(limit)
+    
+    # Segmenti di una run interrotta: compattati prima di calcolare da dove riprendere (la run prosegue in append)
+    append = recover_staging(filepath, append) > 0 or append
     
     # Gestisci append in base all'esistenza del file
-    if append and os.path.exists(filepath):
-        existing_df = load_parquet(filepath)
-        if not existing_df.empty:
-            # Prendi l'ultimo timestamp dal file esistente
-            last_timestamp = existing_df['timestamp_ms'].max()
-            since = last_timestamp + 1  # Continua dal successivo
-            logger.info(f"🔄 Continuando da {timestamp_to_datetime(last_timestamp)}")
-        else:
-            # File esiste ma è vuoto, usa start_timestamp se fornito, altrimenti DEFAULT_START_DATE
-            since = start_timestamp if start_timestamp else parse_date(DEFAULT_START_DATE)
-            logger.info(f"🔄 File esistente vuoto, partendo da {timestamp_to_datetime(since)}")
-    else:
-        # Modalità overwrite o file non esistente
-        # Usa start_timestamp se fornito, altrimenti DEFAULT_START_DATE
-        since = start_timestamp if start_timestamp else parse_date(DEFAULT_START_DATE)
-        logger.info(f"🔄 Partendo da {timestamp_to_datetime(since)}")
+    since = resolve_start_timestamp(filepath, start_timestamp, append,
+                                    lambda start: get_listing_timestamp(exchange, pair, start),
+                                    get_history_start(exchange.id, exchange.parse_timeframe(TIMEFRAME) * 1000))
+    first_timestamp = None
+    incremental = append
     
     latest_timestamp = get_current_timestamp_ms()
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
+    window_ms = limit * tf_ms
+    staging = StagingWriter(filepath, append=append)
+    writer = BackgroundWriter(staging.write, append=append, max_pending=WRITER_QUEUE_SIZE, name=describe_path(filepath))
+    progress = PairProgress(pair, since, latest_timestamp, tf_ms)
+    
+    def finish_writes():
+        """Attende i segmenti in coda e compatta quelli rimasti nei dati definitivi."""
+        progress.close()
+        writer.close()
+        staging.close()
     
     try:
         total_candles = 0
+        pages = 0
         logger.info(f"📥 Scaricando dati OHLCV per {pair}...")
         
-        while since < latest_timestamp:
-            ohlcv = fetch_ohlcv(exchange, pair, TIMEFRAME, since, limit)
-            if not ohlcv:
-                logger.info("✅ Nessun dato aggiuntivo disponibile.")
-                break
-            
-            data.extend(ohlcv)
-            since = ohlcv[-1][0] + 1  # +1 per evitare duplicati
-            total_candles += len(ohlcv)
-            batch_count += 1
-            
-            # Rate limiting rispettoso
-            time.sleep(exchange.rateLimit / 1000)
-            
-            # Salva in batch per robustezza
-            if batch_count >= batch_save_size:
-                logger.info(f"💾 Salvataggio intermedio di {len(data)} candele (totale: {total_candles})...")
-                df_batch = create_ohlcv_dataframe(data)
-                save_parquet(df_batch, filepath, append=append)
-                data = []
-                batch_count = 0
-                append = True  # Dopo il primo salvataggio, usa append
+        try:
+            empty_windows = 0
+            while since < latest_timestamp:
+                ohlcv = fetch_ohlcv(exchange, pair, TIMEFRAME, since, limit)
+                if not ohlcv:
+                    # Finestra senza dati (buco dell'exchange): si salta, a meno che non si sia arrivati al presente
+                    if since + window_ms < latest_timestamp and empty_windows < MAX_EMPTY_WINDOWS:
+                        since += window_ms
+                        empty_windows += 1
+                        progress.advance(since)
+                        continue
+                    logger.info("✅ Nessun dato aggiuntivo disponibile.")
+                    break
+                
+                empty_windows = 0
+                buffer.append_page(ohlcv)
+                first_timestamp = first_timestamp if first_timestamp is not None else ohlcv[0][0]
+                since = ohlcv[-1][0] + 1  # +1 per evitare duplicati
+                total_candles += len(ohlcv)
+                pages += 1
+                progress.advance(since)
+                
+                # Segmento di staging in background: il fetch prosegue durante la scrittura
+                writer.submit(buffer.take())
+        except KeyboardInterrupt:
+            # Ctrl-C: le pagine già scaricate sono nei segmenti, si compattano prima di uscire
+            logger.warning(f"⏹️ Interruzione: salvataggio di {total_candles} candele già scaricate...")
+            finish_writes()
+            if total_candles:
+                update_resampled(filepath, first_timestamp if incremental else None)
+            raise
         
-        # Salva l'ultimo batch
-        if data:
-            logger.info(f"💾 Salvataggio finale di {len(data)} candele (totale: {total_candles})...")
-            df_final = create_ohlcv_dataframe(data)
-            save_parquet(df_final, filepath, append=append)
+        logger.info(f"💾 Compattazione finale ({total_candles} candele scaricate)...")
+        finish_writes()
         
-        # Carica e restituisci il DataFrame completo
-        if os.path.exists(filepath):
-            df = load_parquet(filepath)
-            logger.info(f"✅ Dati caricati da {os.path.basename(filepath)} - Totale candele: {len(df)}")
-            return df
+        # Timeframe superiori: solo i bucket toccati in APPEND, ricostruzione completa in OVERWRITE
+        if total_candles:
+            update_resampled(filepath, first_timestamp if incremental else None)
+        
+        # Riepilogo leggero dal manifest (senza ricaricare il file completo)
+        summary = build_download_summary(pair, filepath, total_candles, pages, first_timestamp, since - 1, started)
+        if summary is not None:
+            logger.info(f"✅ Dati salvati in {os.path.basename(filepath)} - Totale candele: {summary['total_rows']}")
+            return summary
         else:
             logger.warning("❌ File non trovato dopo salvataggio.")
             return None
     
     except Exception as e:
         logger.error(f"❌ Errore durante il download OHLCV: {e}")
+        try:
+            finish_writes()  # Le pagine già scaricate vengono comunque salvate
+        except Exception:
+            pass
         return None
 
-def create_ohlcv_dataframe(data):
-    """Crea DataFrame dalle candele OHLCV."""
-    if not data:
-        return pd.DataFrame()
-    
-    # Colonne base OHLCV
-    columns = ['timestamp_ms', 'open', 'high', 'low', 'close', 'volume']
-    df = pd.DataFrame(data, columns=columns[:len(data[0])])
+def repair_ohlcv_gaps(exchange, pair, filepath, market_type='spot'):
+    """Ripara i buchi nello storico scaricando solo gli intervalli mancanti."""
+    limit = get_page_limit(exchange, pair, market_type)
+    tf_ms = exchange.parse_timeframe(TIMEFRAME) * 1000
     
-    # Aggiungi trades_count se disponibile
-    if len(data[0]) > 6:
-        df['trades_count'] = [row[6] for row in data]
+    # Indice vettorizzato degli intervalli mancanti (solo la colonna timestamp_ms viene letta)
+    timestamps = load_timestamps(filepath)
+    if len(timestamps) == 0:
+        logger.warning(f"⚠️ Nessun dato da riparare per {pair}")
+        return None
     
-    return df
-
-# def download_funding_data(exchange, pair, filepath, start_timestamp=None, append=False):
-#     """Scarica dati di funding rate per perpetual."""
+    starts, ends = find_missing_ranges(timestamps, tf_ms)
+    confirmed = get_confirmed_gaps(filepath)
+    ranges = [(start, end) for start, end in zip(starts.tolist(), ends.tolist()) if (start, end) not in confirmed]
+    if not ranges:
+        logger.info(f"✅ Nessun gap da riparare per {pair}")
+        return get_data_stats(filepath)
     
-#     funding_timeframe = FUNDING_TIMEFRAME  # Usa il timeframe dal config
+    missing = sum((end - start) // tf_ms for start, end in ranges)
+    logger.info(f"🩹 {pair}: {len(ranges)} gap da riparare ({missing} candele mancanti)")
     
-#     logger.info(f"📥 Scaricando funding rate per {pair} (TF: {funding_timeframe})...")
+    buffer = OHLCVBuffer(limit * BATCH_SAVE_SIZE)
+    new_confirmed = []
+    batch_count = 0
+    repaired = 0
     
-#     data = []
-#     since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')
-#     latest_timestamp = get_current_timestamp_ms()
-
-#     if append and os.path.exists(filepath):
-#         existing_df = load_parquet(filepath)
-#         if not existing_df.empty:
-#             last_timestamp = existing_df['timestamp_ms'].max()
-#             since = last_timestamp + 1
-#             logger.info(f"🔄 Funding: continuando da {timestamp_to_datetime(last_timestamp)}")
-#         else:
-#             since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')
-#     else:
-#         since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')    
-    
-#     try:
-#         total_records = 0
-#         while since < latest_timestamp:
-#             try:
-#                 funding_data = exchange.fetch_funding_rate_history(pair, since=since, limit=100)
-#                 if not funding_data:
-#                     break
-                
-#                 for entry in funding_data:
-#                     standardized_entry = {
-#                         'timestamp_ms': entry['timestamp'],
-#                         'funding_rate': entry['fundingRate'],
-#                         'datetime': entry['datetime']
-#                     }
-#                     data.append(standardized_entry)
-                
-#                 since = funding_data[-1]['timestamp'] + 1
-#                 total_records += len(funding_data)
-#                 time.sleep(exchange.rateLimit / 1000)
-                
-#             except Exception as e:
-#                 error_msg = str(e).lower()
-                
-#                 # Controlla se è un errore di timeframe (se applicabile)
-#                 if 'timeframe' in error_msg or 'interval' in error_msg:
-#                     logger.error(f"❌ TIMEFRAME NON SUPPORTATO per funding su {exchange.id}: {funding_timeframe}")
-#                     logger.info(f"💡 Prova a modificare FUNDING_TIMEFRAME in config.py")
-#                     break
-#                 elif 'not supported' in error_msg:
-#                     logger.warning(f"⚠️ Funding rate non supportato per {exchange.id}")
-#                     break
-#                 elif 'end of data' in error_msg or 'no data' in error_msg:
-#                     break
-#                 else:
-#                     logger.warning(f"⚠️ Errore funding API: {e}")
-#                     time.sleep(5)
+    for start, end in ranges:
+        since = start
+        range_data = []
+        answered = False
+        while since < end:
+            try:
+                ohlcv = fetch_ohlcv(exchange, pair, TIMEFRAME, since, limit)
+            except FetchError as e:
+                # Intervallo non confermato: verrà richiesto di nuovo al prossimo repair
+                logger.warning(f"⚠️ {pair}: gap da {timestamp_to_datetime(start)} non riparato: {e}")
+                answered = False
+                break
+            # Pagina non vuota = l'exchange ha risposto (anche se con candele fuori intervallo)
+            answered = bool(ohlcv)
+            candles = [candle for candle in ohlcv if since <= candle[0] < end]
+            if not candles:
+                break
+            range_data.extend(candles)
+            since = candles[-1][0] + 1
+            batch_count += 1
         
-#         if data:
-#             df = pd.DataFrame(data)
-#             save_parquet(df, filepath, append=append)
-#             logger.info(f"✅ Funding rate salvati: {len(df)} record (TF: {funding_timeframe})")
-#             return df
-#         else:
-#             logger.info("ℹ️ Nessun dato funding disponibile")
-            
-#     except Exception as e:
-#         logger.error(f"❌ Errore scaricamento funding: {e}")
+        if answered:
+            # Ciò che manca ancora non esiste sull'exchange: non richiederlo ai prossimi repair
+            present = [start - tf_ms] + [candle[0] for candle in range_data] + [end]
+            still_missing = find_missing_ranges(present, tf_ms)
+            new_confirmed.extend(zip(*still_missing))
+        
+        buffer.append_page(range_data)
+        repaired += len(range_data)
+        
+        # Merge solo delle partizioni toccate dai gap (in modalità dataset)
+        if batch_count >= BATCH_SAVE_SIZE and len(buffer):
+            save_parquet(buffer.take(), filepath, append=True)
+            batch_count = 0
+    
+    if len(buffer):
+        save_parquet(buffer.take(), filepath, append=True)
+    add_confirmed_gaps(filepath, new_confirmed)
+    if repaired:
+        update_resampled(filepath, ranges[0][0])
     
-#     return None
+    logger.info(f"✅ {pair}: recuperate {repaired}/{missing} candele, {len(new_confirmed)} intervalli assenti sull'exchange")
+    return get_data_stats(filepath)
 
-# def download_oi_data(exchange, pair, filepath, start_timestamp=None, append=False):
-#     """Scarica dati di open interest per perpetual."""
+def download_pair_data(exchange, pair_info, start_timestamp, append_mode, metric_types=None):
+    """Scarica tutti i dati per una singola coppia (per i perpetual anche funding/open interest in parallelo)."""
+    pair = pair_info['symbol']
+    market_type = pair_info['market_type']
     
-#     oi_timeframe = OI_TIMEFRAME  # Usa il timeframe dal config
+    logger.info(f"\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
+    logger.info(f"📊 Processing: {pair} ({market_type.upper()})")
     
-#     logger.info(f"📥 Scaricando open interest per {pair} (TF: {oi_timeframe})...")
+    if not ensure_symbol_loaded(exchange, pair):
+        logger.error(f"❌ {pair} non disponibile su {exchange.id}")
+        return False
     
-#     data = []
-#     since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')
-#     latest_timestamp = get_current_timestamp_ms()
-
-#     if append and os.path.exists(filepath):
-#         existing_df = load_parquet(filepath)
-#         if not existing_df.empty:
-#             last_timestamp = existing_df['timestamp_ms'].max()
-#             since = last_timestamp + 1
-#             logger.info(f"🔄 Funding: continuando da {timestamp_to_datetime(last_timestamp)}")
-#         else:
-#             since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')
-#     else:
-#         since = start_timestamp if start_timestamp else get_oldest_timestamp(exchange, pair, 'perpetual')    
-    
-#     try:
-#         total_records = 0
-#         while since < latest_timestamp:
-#             try:
-#                 oi_data = exchange.fetch_open_interest_history(pair, oi_timeframe, since=since, limit=100)
-#                 if not oi_data:
-#                     break
-                
-#                 for entry in oi_data:
-#                     standardized_entry = {
-#                         'timestamp_ms': entry['timestamp'],
-#                         'open_interest': entry['openInterest'],
-#                         'datetime': entry['datetime']
-#                     }
-#                     data.append(standardized_entry)
-                
-#                 since = oi_data[-1]['timestamp'] + 1
-#                 total_records += len(oi_data)
-#                 time.sleep(exchange.rateLimit / 1000)
-                
-#             except Exception as e:
-#                 error_msg = str(e).lower()
-                
-#                 # Controlla se è un errore di timeframe
-#                 if 'timeframe' in error_msg or 'interval' in error_msg:
-#                     logger.error(f"❌ TIMEFRAME NON SUPPORTATO per OI su {exchange.id}: {oi_timeframe}")
-#                     logger.info(f"💡 Prova a modificare OI_TIMEFRAME in config.py (es. '5m', '15m', '1h')")
-#                     break
-#                 elif 'not supported' in error_msg:
-#                     logger.warning(f"⚠️ Open Interest non supportato per {exchange.id}")
-#                     break
-#                 elif 'end of data' in error_msg or 'no data' in error_msg:
-#                     break
-#                 else:
-#                     logger.warning(f"⚠️ Errore OI API: {e}")
-#                     time.sleep(5)
+    # Funding/open interest (solo perpetual) in un thread con event loop proprio, mentre si scaricano le candele
+    executor = ThreadPoolExecutor(max_workers=1)
+    metrics_future = cancel_metrics = None
+    try:
+        if market_type == 'perpetual' and (get_enabled_metrics() if metric_types is None else metric_types):
+            metrics_future, cancel_metrics = start_metrics_loop(
+                executor, download_metrics_async(exchange, pair_info, start_timestamp, append_mode, metric_types))
         
-#         if data:
-#             df = pd.DataFrame(data)
-#             save_parquet(df, filepath, append=append)
-#             logger.info(f"✅ Open interest salvati: {len(df)} record (TF: {oi_timeframe})")
-#             return df
-#         else:
-#             logger.info("ℹ️ Nessun dato open interest disponibile")
-            
-#     except Exception as e:
-#         logger.error(f"❌ Errore scaricamento open interest: {e}")
+        # Download candele OHLCV
+        candles_path = get_data_path(exchange.id, pair, TIMEFRAME, market_type, 'candles')
+        candles_summary = download_ohlcv_data(exchange, pair, market_type, candles_path, start_timestamp, append_mode)
+        
+        if metrics_future is not None:
+            try:
+                metrics_future.result()
+            except Exception as e:
+                logger.error(f"❌ Errore durante il download delle metriche di {pair}: {e}")
+    except KeyboardInterrupt:
+        # Ctrl-C: cancella gli stage funding/OI (salvano il buffer in uscita) invece di attendere la loro fine
+        if cancel_metrics is not None:
+            cancel_metrics()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
-#     return None
+    return candles_summary is not None
+
+def start_metrics_loop(executor, coroutine):
+    """Esegue la coroutine in un event loop proprio nel thread dell'executor.
+
+    Restituisce il future e una funzione che cancella i task del loop da un altro thread.
+    """
+    loop = asyncio.new_event_loop()
+
+    def run():
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
 
-#def download_pair_data(exchange, pair_info, start_timestamp, append_mode, fetch_funding, fetch_oi):    # fetch_funding, fetch_oi non utilizzati
-def download_pair_data(exchange, pair_info, start_timestamp, append_mode):
-    """Scarica tutti i dati per una singola coppia."""
+    def cancel_all():
+        for task in asyncio.all_tasks(loop):
+            task.cancel()
+
+    def cancel():
+        try:
+            loop.call_soon_threadsafe(cancel_all)
+        except RuntimeError:
+            pass  # Loop già chiuso: le metriche sono terminate
+
+    return executor.submit(run), cancel
+
+def repair_pair_data(exchange, pair_info):
+    """Ripara i gap dei dati esistenti per una singola coppia."""
     pair = pair_info['symbol']
     market_type = pair_info['market_type']
     
     logger.info(f"\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
-    logger.info(f"📊 Processing: {pair} ({market_type.upper()})")
+    logger.info(f"🩹 Repair: {pair} ({market_type.upper()})")
     
-    # Download candele OHLCV
-    candles_filename = get_parquet_filename(exchange.id, pair, TIMEFRAME, market_type, 'candles')
-    candles_path = f"{DATA_DIRECTORIES[market_type]}/{candles_filename}"
+    candles_path = get_data_path(exchange.id, pair, TIMEFRAME, market_type, 'candles')
+    if get_data_stats(candles_path) is None:
+        logger.info(f"• {pair}: NON ESISTE, niente da riparare")
+        return False
     
-    df_candles = download_ohlcv_data(exchange, pair, market_type, candles_path, start_timestamp, append_mode)
+    return repair_ohlcv_gaps(exchange, pair, candles_path, market_type) is not None
+
+def prompt_metrics():
+    """Chiede quali metriche aggiuntive scaricare per i perpetual (default: configurazione)."""
+    metric_types = get_enabled_metrics()
+    logger.info("💡 METRICHE AGGIUNTIVE (solo perpetual):")
+    logger.info("[0] Solo OHLCV | [1] Funding Rate | [2] Open Interest | [3] Tutto")
+    metrics_choice = input(f"{Fore.CYAN}Selezione [0-3] [default: config]: {Style.RESET_ALL}")
     
-    # Per perpetual, scarica metriche aggiuntive // Non usato per ora
-    # if market_type == 'perpetual':
-    #     if fetch_funding:
-    #         funding_filename = get_parquet_filename(exchange.id, pair, TIMEFRAME, market_type, 'funding')
-    #         funding_path = f"{DATA_DIRECTORIES['funding']}/{funding_filename}"
-    #         download_funding_data(exchange, pair, funding_path, start_timestamp, append_mode)
+    if metrics_choice == '0':
+        metric_types = []
+    elif metrics_choice == '1':
+        metric_types = ['funding']
+    elif metrics_choice == '2':
+        metric_types = ['oi']
+    elif metrics_choice == '3':
+        metric_types = ['funding', 'oi']
+    logger.info(f"✅ Metriche: OHLCV{''.join(' + ' + METRIC_STAGES[m]['label'] for m in metric_types)}")
+    return metric_types
+
+def prompt_download_mode():
+    """Chiede la modalità di download; restituisce (append_mode, repair_mode, start_timestamp)."""
+    logger.info("💡 MODALITÀ DOWNLOAD:")
+    logger.info("(1) APPEND - Continua dai file esistenti, nuovi da zero")
+    logger.info("(2) OVERWRITE - Ricomincia tutto da zero")
+    logger.info("(3) REPAIR - Ripara i buchi nei file esistenti")
+    
+    mode_choice = input(f"{Fore.CYAN}Scelta [1-3]: {Style.RESET_ALL}")
+    append_mode = mode_choice == '1'
+    repair_mode = mode_choice == '3'
+    
+    if repair_mode:
+        # REPAIR: scarica solo gli intervalli mancanti nei file esistenti
+        logger.info("✅ Modalità: REPAIR selezionata")
+        logger.info("• File esistenti: scaricati solo i buchi interni, il resto non viene riscritto")
+        start_timestamp = None
+        
+    elif append_mode:
+    # APPEND: usa l'ultimo timestamp dai file esistenti
+        logger.info("✅ Modalità: APPEND selezionata")
+        logger.info("• File esistenti: continuano dall'ultima candela")
+        logger.info("• File nuovi: partono dalla data di default")
         
-    #     if fetch_oi:
-    #         oi_filename = get_parquet_filename(exchange.id, pair, TIMEFRAME, market_type, 'oi')
-    #         oi_path = f"{DATA_DIRECTORIES['open_interest']}/{oi_filename}"
-    #         download_oi_data(exchange, pair, oi_path, start_timestamp, append_mode)
+        # Non chiedere start date per append - usa automaticamente l'ultimo timestamp
+        start_timestamp = None  # Verrà determinato per ogni file nella download_pair_data
+        
+    else:
+        # OVERWRITE: chiedi start date
+        start_date_str = input(f"{Fore.CYAN}📅 Start date (YYYY-MM-DD) [default: {DEFAULT_START_DATE}]: {Style.RESET_ALL}") or DEFAULT_START_DATE
+        start_timestamp = parse_date(start_date_str)
+        
+        logger.info(f"✅ Configurazione confermata:")
+        logger.info(f"• Data inizio: {timestamp_to_datetime(start_timestamp)}")
+        logger.info(f"• Timeframe: {TIMEFRAME}")
+        logger.info(f"• File esistenti: sovrascritti")
+        logger.info(f"• File nuovi: partono dal {timestamp_to_datetime(start_timestamp)}")
+    
+    return append_mode, repair_mode, start_timestamp
+
+def download_all_exchanges(asset):
+    """Scarica un asset da tutti i SUPPORTED_EXCHANGES in parallelo: un worker per exchange con rate limit proprio.
+
+    Il tempo totale è quello dell'exchange più lento invece della somma dei singoli download.
+    """
+    # Import locale: batch_runner importa questo modulo
+    from start.batch_runner import validate_job_spec, run_jobs
+    
+    quotes = input(f"{Fore.CYAN}Quote (es. USDT USDC) [default: tutte]: {Style.RESET_ALL}").split()
+    logger.info("💡 TIPO DI MERCATO:")
+    logger.info("[1] Spot | [2] Perpetual | [3] Entrambi")
+    market_choice = input(f"{Fore.CYAN}Selezione [1-3] [default: 3]: {Style.RESET_ALL}")
+    market_types = {'1': ['spot'], '2': ['perpetual']}.get(market_choice, ['spot', 'perpetual'])
+    
+    metric_types = prompt_metrics() if 'perpetual' in market_types else []
+    append_mode, repair_mode, start_timestamp = prompt_download_mode()
+    mode = 'repair' if repair_mode else 'append' if append_mode else 'overwrite'
     
-    return df_candles is not None
+    spec = validate_job_spec({
+        'exchanges': list(SUPPORTED_EXCHANGES),
+        'assets': [asset],
+        'quotes': quotes,
+        'market_types': market_types,
+        'mode': mode,
+        'metrics': metric_types,
+    })
+    if start_timestamp is not None:
+        spec['start_timestamp'] = start_timestamp
+        spec['start_date'] = str(timestamp_to_datetime(start_timestamp))
+    
+    logger.info(f"🌐 AVVIO DOWNLOAD DI {asset.upper()} SU {len(SUPPORTED_EXCHANGES)} EXCHANGE IN PARALLELO...")
+    summary = run_jobs(spec)
+    
+    logger.info("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
+    for result in summary['exchanges']:
+        if result['error']:
+            logger.error(f"❌ {result['exchange']}: {result['error']}")
+        else:
+            ok = sum(1 for pair in result['pairs'] if pair['success'])
+            logger.info(f"• {result['exchange']}: {ok}/{len(result['pairs'])} coppie")
+    if summary['failed'] == 0 and summary['exchange_errors'] == 0:
+        logger.info("🎉 DOWNLOAD COMPLETATO CON SUCCESSO!")
+    else:
+        logger.warning(f"⚠️ DOWNLOAD PARZIALMENTE COMPLETATO: {summary['ok']}/{summary['total_pairs']} coppie")
+    logger.info(f"⏱️ Durata totale: {summary['duration_s']}s")
+    return summary
 
 def main():
     global logger
@@ -333,13 +435,18 @@ def main():
         ensure_directory_exists(directory)
     
     logger = setup_logger(LOGS_PATH)
+    metrics_exporter = MetricsExporter(LOGS_PATH).start()
     
     logger.info("🚀 Avvio MEHD - Multi-Exchanges Historical Data Downloader")
     logger.info("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
     
     try:
-        # Input exchange
-        exchange_name = input(f"{Fore.CYAN}Exchange ({', '.join(SUPPORTED_EXCHANGES)} [default: {DEFAULT_EXCHANGE}]): {Style.RESET_ALL}") or DEFAULT_EXCHANGE
+        # Input exchange ('all' = tutti gli exchange supportati in parallelo)
+        exchange_name = input(f"{Fore.CYAN}Exchange ({', '.join(SUPPORTED_EXCHANGES)}, {EXCHANGE_ALL} = tutti) [default: {DEFAULT_EXCHANGE}]: {Style.RESET_ALL}") or DEFAULT_EXCHANGE
+        if exchange_name.lower() == EXCHANGE_ALL:
+            asset = input(f"{Fore.CYAN}Asset (es. BTC, ETH, SOL) [default: {DEFAULT_ASSET}]: {Style.RESET_ALL}") or DEFAULT_ASSET
+            download_all_exchanges(asset)
+            return
         exchange = validate_exchange(exchange_name)
         
         # Input asset
@@ -379,24 +486,10 @@ def main():
                 logger.error("❌ Input non valido")
                 return
         
-        # Additional metrics for perpetual // Non usato per ora
-        # fetch_funding = FETCH_FUNDING
-        # fetch_oi = FETCH_OPEN_INTEREST
-        
-        # perpetual_pairs = [p for p in selected_pairs if p['market_type'] == 'perpetual']
-        # if perpetual_pairs:
-        #     logger.info("💡 METRICHE AGGIUNTIVE (solo perpetual):")
-        #     logger.info("[1] Funding Rate | [2] Open Interest | [3] Tutto")
-        #     metrics_choice = input(f"{Fore.CYAN}Selezione [1,2,3]: {Style.RESET_ALL}")
-            
-        #     if metrics_choice == '1':
-        #         fetch_oi = False
-        #     elif metrics_choice == '2':
-        #         fetch_funding = False
-        #     elif metrics_choice == '3':
-        #         pass  # Keep both True
-        #     else:
-        #         logger.info("✅ Metriche default: OHLCV + Funding + Open Interest")
+        # Metriche aggiuntive per i perpetual (scaricate in parallelo alle candele)
+        metric_types = get_enabled_metrics()
+        if any(p['market_type'] == 'perpetual' for p in selected_pairs):
+            metric_types = prompt_metrics()
         
         # Check existing files and choose mode
         logger.info("📁 CHECK FILES ESISTENTI:")
@@ -405,52 +498,40 @@ def main():
             pair = pair_info['symbol']
             market_type = pair_info['market_type']
             
-            candles_path = f"{DATA_DIRECTORIES[market_type]}/{get_parquet_filename(exchange.id, pair, TIMEFRAME, market_type, 'candles')}"
-            if check_file_exists(candles_path):
-                df = load_parquet(candles_path)
-                candle_count = len(df) if not df.empty else 0
+            candles_path = get_data_path(exchange.id, pair, TIMEFRAME, market_type, 'candles')
+            stats = get_data_stats(candles_path)
+            if stats is not None:
+                candle_count = stats['rows']
                 existing_files.append((pair, candle_count))
                 logger.info(f"• {pair}: ESISTE ({candle_count} candele)")
             else:
                 logger.info(f"• {pair}: NON ESISTE")
         
         # Download mode
-        logger.info("💡 MODALITÀ DOWNLOAD:")
-        logger.info("(1) APPEND - Continua dai file esistenti, nuovi da zero")
-        logger.info("(2) OVERWRITE - Ricomincia tutto da zero")
-        
-        mode_choice = input(f"{Fore.CYAN}Scelta [1-2]: {Style.RESET_ALL}")
-        append_mode = mode_choice == '1'
-        
-        if append_mode:
-        # APPEND: usa l'ultimo timestamp dai file esistenti
-            logger.info("✅ Modalità: APPEND selezionata")
-            logger.info("• File esistenti: continuano dall'ultima candela")
-            logger.info("• File nuovi: partono dalla data di default")
-            
-            # Non chiedere start date per append - usa automaticamente l'ultimo timestamp
-            start_timestamp = None  # Verrà determinato per ogni file nella download_pair_data
-            
-        else:
-            # OVERWRITE: chiedi start date
-            start_date_str = input(f"{Fore.CYAN}📅 Start date (YYYY-MM-DD) [default: {DEFAULT_START_DATE}]: {Style.RESET_ALL}") or DEFAULT_START_DATE
-            start_timestamp = parse_date(start_date_str)
-            
-            logger.info(f"✅ Configurazione confermata:")
-            logger.info(f"• Data inizio: {timestamp_to_datetime(start_timestamp)}")
-            logger.info(f"• Timeframe: {TIMEFRAME}")
-            logger.info(f"• File esistenti: sovrascritti")
-            logger.info(f"• File nuovi: partono dal {timestamp_to_datetime(start_timestamp)}")
+        append_mode, repair_mode, start_timestamp = prompt_download_mode()
         
         # Start download
         logger.info("🚦 AVVIO DOWNLOAD...")
         
         success_count = 0
-        for pair_info in selected_pairs:
-            #success = download_pair_data(exchange, pair_info, start_timestamp, append_mode, fetch_funding, fetch_oi)
-            success = download_pair_data(exchange, pair_info, start_timestamp, append_mode)
-            if success:
-                success_count += 1
+        if repair_mode:
+            for pair_info in selected_pairs:
+                if repair_pair_data(exchange, pair_info):
+                    success_count += 1
+        elif ASYNC_DOWNLOAD and len(selected_pairs) > 1:
+            # Più coppie: download concorrente con un unico budget di rate limit per exchange
+            logger.info(f"⚡ Download concorrente di {len(selected_pairs)} coppie (max {MAX_CONCURRENT_PAIRS} in parallelo)")
+            results = asyncio.run(download_pairs_async(exchange, selected_pairs, start_timestamp, append_mode, MAX_CONCURRENT_PAIRS, metric_types))
+            success_count = sum(1 for success in results if success)
+        elif ASYNC_DOWNLOAD and BACKFILL_SHARDS > 1:
+            # Singola coppia: lo storico viene diviso in finestre scaricate in parallelo
+            if asyncio.run(backfill_pair_sharded_async(exchange, selected_pairs[0], start_timestamp, append_mode, BACKFILL_SHARDS, metric_types)):
+                success_count = 1
+        else:
+            for pair_info in selected_pairs:
+                success = download_pair_data(exchange, pair_info, start_timestamp, append_mode, metric_types)
+                if success:
+                    success_count += 1
         
         # Final summary
         logger.info("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
@@ -465,6 +546,10 @@ def main():
         logger.info("\n⏹️ Download interrotto dall'utente")
     except Exception as e:
         logger.error(f"❌ Errore durante l'esecuzione: {e}")
+    finally:
+        metrics_path = metrics_exporter.stop()
+        if metrics_path:
+            logger.info(f"📈 Metriche salvate in {metrics_path}.json / .prom")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
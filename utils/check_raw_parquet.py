@@ -4,11 +4,102 @@
 
 import os
 import pandas as pd
+import pyarrow.parquet as pq
 import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from colorama import init, Fore, Style
 
 init(autoreset=True)
 
+# Sotto questa soglia i check deep/full girano inline: l'avvio dei processi costerebbe più del check stesso
+PROCESS_POOL_MIN_FILES = 8
+
+def read_timestamp_range(metadata, schema):
+    """Min/max di timestamp_ms dalle statistiche dei row group (nessun dato letto)."""
+    if 'timestamp_ms' not in schema.names:
+        return None, None
+    
+    column_idx = schema.get_field_index('timestamp_ms')
+    low, high = None, None
+    for rg in range(metadata.num_row_groups):
+        stats = metadata.row_group(rg).column(column_idx).statistics
+        if stats is None or not stats.has_min_max:
+            return None, None  # Statistiche incomplete: range non affidabile
+        low = stats.min if low is None else min(low, stats.min)
+        high = stats.max if high is None else max(high, stats.max)
+    return low, high
+
+def check_parquet_file_fast(filepath, deep=False):
+    """Controlla un file leggendo solo il footer Parquet; in modalità deep decodifica tutti i row group in streaming."""
+    try:
+        parquet_file = pq.ParquetFile(filepath)
+        metadata = parquet_file.metadata
+        schema = parquet_file.schema_arrow
+        
+        file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
+        columns = list(schema.names)
+        
+        date_range = ""
+        low, high = read_timestamp_range(metadata, schema)
+        if low is not None:
+            date_range = f"{pd.to_datetime(low, unit='ms')} to {pd.to_datetime(high, unit='ms')}"
+        
+        if deep:
+            # Decodifica un row group alla volta: verifica l'integrità senza caricare tutto in memoria
+            decoded_rows = 0
+            for batch in parquet_file.iter_batches():
+                decoded_rows += batch.num_rows
+            if decoded_rows != metadata.num_rows:
+                raise ValueError(f"Righe decodificate ({decoded_rows}) diverse dal footer ({metadata.num_rows})")
+        
+        return {
+            'status': 'OK',
+            'file_size_mb': round(file_size, 2),
+            'row_count': metadata.num_rows,
+            'columns': columns,
+            'date_range': date_range,
+            'error': None
+        }
+        
+    except Exception as e:
+        return {
+            'status': 'ERROR',
+            'file_size_mb': 0,
+            'row_count': 0,
+            'columns': [],
+            'date_range': '',
+            'error': str(e)
+        }
+
+def check_parquet_file_deep(filepath):
+    """Check deep (footer + decodifica in streaming), utilizzabile con il process pool."""
+    return check_parquet_file_fast(filepath, deep=True)
+
+def check_parquet_files(filepaths, mode='fast', max_workers=None):
+    """Controlla più file in parallelo. Restituisce le info nello stesso ordine.
+
+    Il check fast legge solo i footer (I/O, pochi KB per file): thread pool. I check deep/full decodificano
+    i dati (CPU): process pool, ma solo da PROCESS_POOL_MIN_FILES file in su.
+    """
+    check_function = {
+        'fast': check_parquet_file_fast,
+        'deep': check_parquet_file_deep,
+        'full': check_parquet_file,
+    }[mode]
+    
+    if len(filepaths) <= 1:
+        return [check_function(filepath) for filepath in filepaths]
+    
+    if mode == 'fast':
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(check_function, filepaths))
+    
+    if len(filepaths) < PROCESS_POOL_MIN_FILES:
+        return [check_function(filepath) for filepath in filepaths]
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(check_function, filepaths, chunksize=8))
+
 def check_parquet_file(filepath):
     """Controlla un singolo file Parquet e restituisce le informazioni."""
     try:
@@ -59,6 +150,9 @@ def find_parquet_files(base_path='data'):
     pattern = os.path.join(base_path, '**', '*.parquet')
     parquet_files = glob.glob(pattern, recursive=True)
     
+    # I segmenti di staging non ancora compattati non sono file di dati
+    parquet_files = [f for f in parquet_files if f'{os.sep}_staging{os.sep}' not in f]
+    
     return parquet_files
 
 def display_file_info(filepath, info):
@@ -102,8 +196,15 @@ def main():
     print("[1-{n}] Check singolo file")
     print("[a]    Check tutti i file")
     print("[q]    Esci")
+    print("Aggiungi 'd' per il check deep (decodifica completa, es. 'ad' o '3d'), 'f' per la lettura completa con pandas")
+    
+    choice = input(f"\n{Fore.CYAN}Scelta: {Style.RESET_ALL}").lower().strip()
     
-    choice = input(f"\n{Fore.CYAN}Scelta: {Style.RESET_ALL}").lower()
+    # Modalità: fast (solo footer, default), deep (streaming dei row group), full (pd.read_parquet)
+    mode = 'fast'
+    if len(choice) > 1 and choice[-1] in ('d', 'f'):
+        mode = 'deep' if choice[-1] == 'd' else 'full'
+        choice = choice[:-1]
     
     files_to_check = []
     
@@ -133,8 +234,8 @@ def main():
     total_rows = 0
     total_size = 0
     
-    for filepath in files_to_check:
-        info = check_parquet_file(filepath)
+    print(f"Modalità check: {mode.upper()}")
+    for filepath, info in zip(files_to_check, check_parquet_files(files_to_check, mode)):
         display_file_info(filepath, info)
         
         if info['status'] == 'OK':
@@ -22,6 +22,16 @@ def parse_date(date_str):
     except ValueError:
         raise ValueError("Formato data non valido. Usa YYYY-MM-DD.")
 
+def to_timestamp_ms(value):
+    """Converte timestamp_ms, stringa YYYY-MM-DD o datetime in timestamp_ms (None resta None)."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return parse_date(value)
+    if isinstance(value, datetime):
+        return datetime_to_timestamp_ms(value)
+    return int(value)
+
 def format_timedelta(seconds):
     """Formatta secondi in stringa leggibile (hh:mm:ss)."""
     hours = seconds // 3600
@@ -0,0 +1,91 @@
+# utils/download_utils.py
+# Funzioni condivise tra il downloader sincrono (start/mehd.py) e quello asincrono (start/async_downloader.py)
+import logging
+import time
+from utils.date_utils import parse_date, timestamp_to_datetime
+from utils.file_utils import get_data_stats
+from utils.resample_utils import resample_pair
+from utils.metrics import metrics, describe_path
+from start.config import DEFAULT_START_DATE, AUTO_RESAMPLE, PROBE_LISTING_DATE
+
+logger = logging.getLogger('MEHD')
+
+def skip_to_listing(since, find_listing=None):
+    """Sposta since alla prima candela reale della coppia, se successiva (find_listing(since) -> ms o None)."""
+    if find_listing is None or not PROBE_LISTING_DATE:
+        return since
+    try:
+        listing = find_listing(since)
+    except Exception as e:
+        logger.warning(f"⚠️ Ricerca della data di listing non riuscita: {e}")
+        return since
+    if listing is not None and listing > since:
+        logger.info(f"⏩ Nessun dato prima del {timestamp_to_datetime(listing)}: il download parte da lì")
+        return listing
+    return since
+
+def clamp_to_history(since, history_start=None):
+    """Non chiedere dati più vecchi di quelli che l'exchange conserva."""
+    if history_start is not None and since < history_start:
+        logger.info(f"⏩ L'exchange conserva i dati solo dal {timestamp_to_datetime(history_start)}")
+        return history_start
+    return since
+
+def resolve_start_timestamp(filepath, start_timestamp=None, append=False, find_listing=None, history_start=None):
+    """Determina da quale timestamp iniziare il download (ultimo timestamp in APPEND, start date altrimenti).
+
+    find_listing (opzionale) viene usato solo quando si parte dalla start date, per saltare lo storico vuoto.
+    history_start (opzionale) è il primo timestamp che l'exchange conserva (profilo dell'exchange).
+    """
+    stats = get_data_stats(filepath) if append else None
+    if stats is not None:
+        if stats['rows'] and stats['max_timestamp'] is not None:
+            # Prendi l'ultimo timestamp dal manifest (o dai footer Parquet), senza caricare i dati
+            last_timestamp = stats['max_timestamp']
+            logger.info(f"🔄 Continuando da {timestamp_to_datetime(last_timestamp)}")
+            return last_timestamp + 1  # Continua dal successivo
+        
+        # File esiste ma è vuoto, usa start_timestamp se fornito, altrimenti DEFAULT_START_DATE
+        since = start_timestamp if start_timestamp else parse_date(DEFAULT_START_DATE)
+        logger.info(f"🔄 File esistente vuoto, partendo da {timestamp_to_datetime(since)}")
+        return skip_to_listing(clamp_to_history(since, history_start), find_listing)
+    
+    # Modalità overwrite o file non esistente
+    # Usa start_timestamp se fornito, altrimenti DEFAULT_START_DATE
+    since = start_timestamp if start_timestamp else parse_date(DEFAULT_START_DATE)
+    logger.info(f"🔄 Partendo da {timestamp_to_datetime(since)}")
+    return skip_to_listing(clamp_to_history(since, history_start), find_listing)
+
+def build_download_summary(pair, filepath, new_candles, pages, first_timestamp, last_timestamp, started):
+    """Riepilogo leggero di un download (nessun DataFrame): nuove candele, range scaricato e totale dal manifest."""
+    stats = get_data_stats(filepath)
+    if stats is None:
+        return None
+    elapsed = time.time() - started
+    target = describe_path(filepath)
+    metrics.inc('mehd_records_downloaded_total', new_candles, target=target)
+    metrics.set_gauge('mehd_download_records_per_second', round(new_candles / elapsed, 1) if elapsed > 0 else 0, target=target)
+    return {
+        'pair': pair,
+        'path': filepath,
+        'new_candles': new_candles,
+        'pages': pages,
+        'first_timestamp': first_timestamp,
+        'last_timestamp': last_timestamp if new_candles else None,
+        'total_rows': stats['rows'],
+        'elapsed_s': round(elapsed, 2),
+    }
+
+def update_resampled(filepath, since_ms=None):
+    """Aggiorna i timeframe superiori dopo un salvataggio (since_ms None = ricostruzione completa).
+
+    Un errore nel resample non invalida il download: i timeframe si possono ricostruire in seguito.
+    """
+    if not AUTO_RESAMPLE:
+        return None
+    try:
+        with metrics.timed('mehd_resample_seconds', target=describe_path(filepath)):
+            return resample_pair(filepath, since_ms)
+    except Exception as e:
+        logger.error(f"❌ Errore durante il resample di {filepath}: {e}")
+        return None
@@ -0,0 +1,207 @@
+# utils/exchange_profiles.py
+# Profili di capacità degli exchange: dimensione massima della pagina OHLCV, peso di una richiesta
+# per il rate limiter, profondità massima dello storico e timeframe supportati per l'open interest.
+# Solo la dimensione della pagina viene calibrata (una volta per exchange e tipo di mercato, con richieste
+# di prova su due finestre diverse) e salvata in cache/exchange_profiles.json, ricalibrata quando cambia la
+# versione di ccxt. Il peso di una pagina è il costo dell'endpoint nelle definizioni API di ccxt; profondità
+# dello storico e timeframe dell'open interest sono valori statici presi dalla documentazione API, non sondati.
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+import ccxt
+from utils.date_utils import get_current_timestamp_ms
+from utils.resample_utils import timeframe_to_ms
+from start.config import CACHE_PATH, CALIBRATE_EXCHANGE_PROFILES
+
+logger = logging.getLogger('MEHD')
+
+PROFILES_CACHE_PATH = os.path.join(CACHE_PATH, 'exchange_profiles.json')
+
+# Valori noti (documentazione API). ohlcv_limit è il default finché la calibrazione non lo sostituisce;
+# max_history_candles: candele recuperabili a ritroso da adesso (None = nessun limite)
+# oi_timeframes: periodi accettati dallo storico dell'open interest (il funding non ha timeframe: è l'exchange a
+# deciderne la frequenza, 1h/4h/8h a seconda della coppia)
+EXCHANGE_PROFILES = {
+    'binance': {
+        'ohlcv_limit': 1000,
+        'max_history_candles': None,
+        'oi_timeframes': ['5m', '15m', '30m', '1h', '2h', '4h', '6h', '12h', '1d'],
+    },
+    'bybit': {
+        'ohlcv_limit': 1000,
+        'max_history_candles': None,
+        'oi_timeframes': ['5m', '15m', '30m', '1h', '4h', '1d'],
+    },
+    'kucoin': {
+        'ohlcv_limit': 1500,
+        'max_history_candles': None,
+        'oi_timeframes': [],
+    },
+    'gateio': {
+        'ohlcv_limit': 1000,
+        'max_history_candles': 10000,
+        'oi_timeframes': ['5m', '15m', '30m', '1h', '4h', '1d'],
+    },
+    'okx': {
+        'ohlcv_limit': 100,
+        'max_history_candles': None,
+        'oi_timeframes': ['5m', '1h', '1d'],
+    },
+}
+DEFAULT_PROFILE = {
+    'ohlcv_limit': 1000,
+    'max_history_candles': None,
+    'oi_timeframes': [],
+}
+
+# Endpoint ccxt chiamato da fetch_ohlcv per tipo di mercato: il costo dichiarato da ccxt (eventualmente per
+# fascia di limit, 'byLimit') è nella stessa unità del rate limiter (1 = una richiesta ogni exchange.rateLimit ms)
+OHLCV_ENDPOINTS = {
+    'binance': {'spot': ('public', 'get', 'klines'), 'perpetual': ('fapiPublic', 'get', 'klines')},
+    'bybit': {'spot': ('public', 'get', 'v5/market/kline'), 'perpetual': ('public', 'get', 'v5/market/kline')},
+    'kucoin': {'spot': ('public', 'get', 'market/candles')},
+    'gateio': {'spot': ('public', 'spot', 'get', 'candlesticks'),
+               'perpetual': ('public', 'futures', 'get', '{settle}/candlesticks')},
+    'okx': {'spot': ('public', 'get', 'market/history-candles'),
+            'perpetual': ('public', 'get', 'market/history-candles')},
+}
+
+# Limiti provati in calibrazione, dal più grande: la prima risposta piena o troncata indica il massimo
+CALIBRATION_LIMITS = (1500, 1000, 500, 300, 200, 100)
+# Finestre sondate (candele a ritroso da adesso): una pagina corta vale come massimo solo se le due finestre
+# concordano, così un buco nei dati o una coppia listata da poco non salvano un limite troppo basso
+CALIBRATION_LOOKBACKS = (5000, 20000)
+
+_cache_lock = threading.Lock()
+_calibration_locks = {}
+_weights = {}
+_calibrations = None  # Copia in memoria della cache su disco (letta una volta per processo)
+
+def read_profiles_cache():
+    """Profili calibrati {exchange: {...}} della versione corrente di ccxt (vuoto se assente)."""
+    try:
+        with open(PROFILES_CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {exchange_id: profile for exchange_id, profile in cache.items()
+            if profile.get('ccxt_version') == ccxt.__version__}
+
+def write_calibration(exchange_id, market_type, ohlcv_limit):
+    """Salva il limite calibrato per exchange e tipo di mercato (scrittura atomica, sicura tra thread)."""
+    global _calibrations
+    with _cache_lock:
+        cache = read_profiles_cache()
+        profile = cache.setdefault(exchange_id, {'ccxt_version': ccxt.__version__, 'ohlcv_limits': {}})
+        profile['ohlcv_limits'][market_type] = ohlcv_limit
+        profile['calibrated_at'] = datetime.now(timezone.utc).isoformat()
+        os.makedirs(os.path.dirname(PROFILES_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{PROFILES_CACHE_PATH}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, PROFILES_CACHE_PATH)
+        _calibrations = cache
+
+def get_exchange_profile(exchange_id):
+    """Profilo completo: valori noti più i limiti calibrati per tipo di mercato (ohlcv_limits)."""
+    global _calibrations
+    if _calibrations is None:
+        _calibrations = read_profiles_cache()
+    profile = dict(EXCHANGE_PROFILES.get(exchange_id, DEFAULT_PROFILE))
+    profile['ohlcv_limits'] = dict(_calibrations.get(exchange_id, {}).get('ohlcv_limits', {}))
+    return profile
+
+def probe_page_size(tf_ms, fetch, limit, lookback):
+    """Candele restituite da una pagina di `limit` a partire da `lookback` candele fa (None se non utile)."""
+    now = get_current_timestamp_ms()
+    since = now - now % tf_ms - lookback * tf_ms
+    try:
+        page = fetch(since, limit)
+    except Exception:
+        return None  # Limit rifiutato o errore: si prova il limite successivo
+    if not page or (len(page) < limit and page[-1][0] >= now - 2 * tf_ms):
+        return None  # Pagina vuota o corta perché ha raggiunto il presente, non per il limite dell'exchange
+    return min(len(page), limit)
+
+def calibrate_ohlcv_limit(exchange_id, tf_ms, fetch):
+    """Pagina massima reale: prova limiti decrescenti su due finestre con abbastanza candele.
+
+    fetch(since, limit) -> pagina ccxt. Il primo limite con una risposta utile decide: il risultato vale
+    solo se la seconda finestra restituisce lo stesso numero di candele, altrimenti (buchi nei dati, coppia
+    con poco storico) la calibrazione non è conclusiva e restituisce None (nulla viene salvato).
+    """
+    first_lookback, second_lookback = CALIBRATION_LOOKBACKS
+    for limit in CALIBRATION_LIMITS:
+        size = probe_page_size(tf_ms, fetch, limit, first_lookback)
+        if size is None:
+            continue
+        return size if probe_page_size(tf_ms, fetch, limit, second_lookback) == size else None
+    return None
+
+def get_ohlcv_limit(exchange_id, market_type, tf_ms=None, fetch=None):
+    """Candele per pagina da richiedere: valore calibrato, altrimenti calibrazione (se possibile) o valore noto."""
+    profile = get_exchange_profile(exchange_id)
+    if market_type in profile['ohlcv_limits']:
+        return profile['ohlcv_limits'][market_type]
+    if fetch is None or tf_ms is None or not CALIBRATE_EXCHANGE_PROFILES:
+        return profile['ohlcv_limit']
+
+    # Una sola calibrazione per exchange/mercato anche con molte coppie in parallelo
+    with _cache_lock:
+        lock = _calibration_locks.setdefault((exchange_id, market_type), threading.Lock())
+    with lock:
+        calibrated = get_exchange_profile(exchange_id)['ohlcv_limits'].get(market_type)
+        if calibrated is not None:
+            return calibrated
+        limit = calibrate_ohlcv_limit(exchange_id, tf_ms, fetch)
+        if limit is None:
+            logger.warning(f"⚠️ Calibrazione pagina OHLCV di {exchange_id} ({market_type}) non conclusiva, uso {profile['ohlcv_limit']}")
+            return profile['ohlcv_limit']
+        write_calibration(exchange_id, market_type, limit)
+        logger.info(f"📏 {exchange_id} ({market_type}): pagina OHLCV massima {limit} candele (salvata in cache)")
+        return limit
+
+def get_ohlcv_weight(exchange, pair, limit):
+    """Costo in token di una pagina OHLCV secondo le definizioni API di ccxt (1 se l'endpoint non è noto)."""
+    market_type = 'perpetual' if ':' in pair else 'spot'  # Simboli unificati ccxt: BASE/QUOTE:SETTLE per i derivati
+    key = (exchange.id, market_type, limit)
+    if key not in _weights:
+        _weights[key] = endpoint_cost(getattr(exchange, 'api', None),
+                                      OHLCV_ENDPOINTS.get(exchange.id, {}).get(market_type), limit)
+    return _weights[key]
+
+def endpoint_cost(api, path, limit):
+    """Costo di un endpoint nella struttura exchange.api di ccxt, con le fasce byLimit se presenti."""
+    if not api or not path:
+        return 1
+    node = api
+    for part in path:
+        if not isinstance(node, dict) or part not in node:
+            return 1
+        node = node[part]
+    if isinstance(node, (int, float)):
+        return node
+    for max_limit, cost in node.get('byLimit', []):
+        if limit <= max_limit:
+            return cost
+    return node.get('cost', 1)
+
+def get_history_start(exchange_id, tf_ms):
+    """Primo timestamp ancora recuperabile dall'exchange (None se lo storico non ha limiti)."""
+    max_candles = get_exchange_profile(exchange_id)['max_history_candles']
+    if not max_candles:
+        return None
+    now = get_current_timestamp_ms()
+    return now - now % tf_ms - (max_candles - 1) * tf_ms
+
+def get_oi_timeframe(exchange_id, configured):
+    """Timeframe dell'open interest da usare: quello configurato se supportato, altrimenti il supportato più vicino."""
+    supported = get_exchange_profile(exchange_id)['oi_timeframes']
+    if not supported or configured in supported:
+        return configured
+    target = timeframe_to_ms(configured)
+    closest = min(supported, key=lambda timeframe: abs(timeframe_to_ms(timeframe) - target))
+    logger.warning(f"⚠️ {exchange_id}: timeframe {configured} non supportato per l'open interest, uso {closest}")
+    return closest
@@ -1,11 +1,44 @@
 # utils/file_utils.py
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
 import os
-from utils.date_utils import timestamp_to_datetime
+import glob
+import json
+import logging
+from datetime import datetime, timezone
+from utils.date_utils import get_current_timestamp_ms, to_timestamp_ms
+from utils.parquet_profile import write_table, conform_table
+from utils.metrics import metrics, describe_path
+from start.config import DATA_DIRECTORIES, STORAGE_MODE, PARTITION_BY, TIMEFRAME
+
+logger = logging.getLogger('MEHD')
+
+# Granularità numpy per le partizioni del dataset
+PARTITION_UNITS = {
+    'month': 'datetime64[M]',   # 2024-03.parquet
+    'day': 'datetime64[D]',     # 2024-03-15.parquet
+}
+
+MANIFEST_VERSION = 1
+STAGING_DIRNAME = '_staging'
+MANIFEST_MAX_GAPS = 1000  # Gap salvati nel manifest (il conteggio totale resta in gap_count)
+
+# Cartelle legacy (STORAGE_MODE = 'file') per i dati non-candele
+LEGACY_DIRECTORY_KEYS = {
+    'funding': 'funding',
+    'oi': 'open_interest',
+}
+
+def get_pair_safe(pair):
+    """Converte il simbolo in una stringa sicura per i path (BTC/USDT:USDT -> BTC-USDT-USDT)."""
+    return pair.replace('/', '-').replace(':', '-')
 
 def get_parquet_filename(exchange_id, pair, timeframe, market_type, data_type='candles'):
     """Genera il nome del file Parquet."""
-    pair_safe = pair.replace('/', '-').replace(':', '-')
+    pair_safe = get_pair_safe(pair)
     
     if data_type == 'candles':
         return f"{exchange_id}_{market_type}_{pair_safe}_{timeframe}.parquet"
@@ -16,103 +49,567 @@ def get_parquet_filename(exchange_id, pair, timeframe, market_type, data_type='c
     else:
         return f"{exchange_id}_{market_type}_{pair_safe}_{data_type}.parquet"
 
+def get_dataset_dir(exchange_id, pair, timeframe, market_type, data_type='candles'):
+    """Genera la cartella del dataset partizionato (es. data/spot/binance/BTC-USDT/1m, .../funding/1h)."""
+    # Funding/OI separati per timeframe: un cambio di FUNDING_TIMEFRAME/OI_TIMEFRAME non mescola le serie
+    subdir = timeframe if data_type == 'candles' else os.path.join(data_type, timeframe)
+    return os.path.join(DATA_DIRECTORIES[market_type], exchange_id, get_pair_safe(pair), subdir)
+
+def get_data_path(exchange_id, pair, timeframe, market_type, data_type='candles'):
+    """Restituisce il percorso dei dati (file singolo o cartella dataset) in base a STORAGE_MODE."""
+    if STORAGE_MODE == 'dataset':
+        return get_dataset_dir(exchange_id, pair, timeframe, market_type, data_type)
+    
+    directory_key = LEGACY_DIRECTORY_KEYS.get(data_type, market_type)
+    directory = DATA_DIRECTORIES.get(directory_key, DATA_DIRECTORIES[market_type])
+    return os.path.join(directory, get_parquet_filename(exchange_id, pair, timeframe, market_type, data_type))
+
+def is_dataset_path(path):
+    """True se il percorso è un dataset partizionato (cartella) e non un singolo file."""
+    return not path.endswith('.parquet')
+
+def list_partitions(dataset_dir):
+    """Restituisce i file partizione del dataset in ordine cronologico."""
+    return sorted(glob.glob(os.path.join(dataset_dir, '*.parquet')))
+
+def get_staging_dir(path):
+    """Cartella dei segmenti di staging di un percorso dati (vedi utils/staging.py).
+
+    Il prefisso '_' la esclude da partizioni, dataset pyarrow e migrazione.
+    """
+    path = path.rstrip(os.sep)
+    if is_dataset_path(path):
+        return os.path.join(path, STAGING_DIRNAME)
+    return os.path.join(os.path.dirname(path), STAGING_DIRNAME, os.path.basename(path)[:-len('.parquet')])
+
+def list_segments(path):
+    """Segmenti di staging non ancora compattati, in ordine di scrittura (nome = timestamp in nanosecondi)."""
+    return sorted(glob.glob(os.path.join(get_staging_dir(path), 'seg_*.parquet')))
+
+def get_partition_keys(timestamps_ms, partition_by=PARTITION_BY):
+    """Calcola (vettorizzato) la chiave di partizione per ogni timestamp_ms."""
+    if partition_by not in PARTITION_UNITS:
+        raise ValueError(f"PARTITION_BY non valido: {partition_by}. Usa {list(PARTITION_UNITS)}")
+    timestamps = np.asarray(timestamps_ms, dtype='int64').astype('datetime64[ms]')
+    return timestamps.astype(PARTITION_UNITS[partition_by])
+
 def check_file_exists(path):
     """Controlla se un file esiste."""
     return os.path.exists(path)
 
 def load_parquet(path):
-    """Carica un file Parquet."""
+    """Carica un file Parquet o un dataset partizionato come unica tabella."""
     try:
+        if is_dataset_path(path):
+            partitions = list_partitions(path)
+            if not partitions:
+                return pd.DataFrame()
+            tables = [pq.read_table(partition) for partition in partitions]
+            return pa.concat_tables(tables, promote_options='default').to_pandas()
         return pd.read_parquet(path)
     except Exception:
         return pd.DataFrame()
 
+def select_partitions(dataset_dir, start_ms=None, end_ms=None, partition_by=PARTITION_BY):
+    """Partizioni del dataset che possono contenere timestamp in [start_ms, end_ms)."""
+    partitions = list_partitions(dataset_dir)
+    first_key = str(get_partition_keys([start_ms], partition_by)[0]) if start_ms is not None else None
+    last_key = str(get_partition_keys([end_ms - 1], partition_by)[0]) if end_ms is not None else None
+    selected = []
+    for partition in partitions:
+        key = os.path.basename(partition)[:-len('.parquet')]
+        if (first_key is None or key >= first_key) and (last_key is None or key <= last_key):
+            selected.append(partition)
+    return selected
+
+def select_row_groups(parquet_file, start_ms=None, end_ms=None):
+    """Indici dei row group il cui intervallo timestamp_ms (statistiche del footer) interseca [start_ms, end_ms)."""
+    metadata = parquet_file.metadata
+    ts_index = parquet_file.schema_arrow.get_field_index('timestamp_ms')
+    selected = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(ts_index).statistics
+        if stats is None or not stats.has_min_max:
+            selected.append(i)  # Senza statistiche non si può escludere
+        elif (start_ms is None or stats.max >= start_ms) and (end_ms is None or stats.min < end_ms):
+            selected.append(i)
+    return selected
+
+def read_path_range(path, start_ms=None, end_ms=None, columns=None):
+    """Legge da un file o dataset solo partizioni, row group e colonne necessari per [start_ms, end_ms)."""
+    if is_dataset_path(path):
+        data_files = select_partitions(path, start_ms, end_ms)
+    else:
+        data_files = [path] if check_file_exists(path) else []
+
+    read_columns = None
+    if columns is not None:
+        read_columns = ['timestamp_ms'] + [name for name in columns if name != 'timestamp_ms']
+
+    # Segmenti di staging non ancora compattati (es. live tail): letti dopo i dati definitivi
+    segments = list_segments(path)
+
+    tables = []
+    for data_file in data_files + segments:
+        try:
+            parquet_file = pq.ParquetFile(data_file)
+        except FileNotFoundError:
+            continue  # Segmento appena compattato ed eliminato
+        row_groups = select_row_groups(parquet_file, start_ms, end_ms)
+        if row_groups:
+            tables.append(parquet_file.read_row_groups(row_groups, columns=read_columns))
+    if not tables:
+        return None
+    table = pa.concat_tables(tables, promote_options='permissive')
+    if segments:
+        table = merge_tables(None, table)  # I segmenti possono sovrapporsi ai dati già compattati
+
+    # I row group selezionati possono sforare l'intervallo ai bordi: filtro esatto solo su quelli
+    timestamps = table.column('timestamp_ms')
+    mask = None
+    if start_ms is not None:
+        mask = pc.greater_equal(timestamps, start_ms)
+    if end_ms is not None:
+        end_mask = pc.less(timestamps, end_ms)
+        mask = end_mask if mask is None else pc.and_(mask, end_mask)
+    if mask is not None:
+        table = table.filter(mask)
+    return table.select(columns) if columns is not None else table
+
+def read_range(exchange_id, pair, market_type, start=None, end=None, columns=None,
+               timeframe=TIMEFRAME, data_type='candles', as_pandas=True):
+    """Legge un intervallo temporale [start, end) dei dati di una coppia.
+
+    start/end accettano timestamp_ms, stringhe YYYY-MM-DD o datetime (None = senza limite).
+    Vengono letti solo le partizioni e i row group che intersecano l'intervallo e le colonne richieste.
+    Restituisce un DataFrame (as_pandas=True) o una tabella Arrow; vuoti se non ci sono dati.
+    """
+    path = get_data_path(exchange_id, pair, timeframe, market_type, data_type)
+    table = read_path_range(path, to_timestamp_ms(start), to_timestamp_ms(end), columns)
+    if table is None:
+        return pd.DataFrame(columns=columns) if as_pandas else None
+    return table.to_pandas() if as_pandas else table
+
+def write_parquet_atomic(table, path, tier='hot'):
+    """Scrive una tabella (schema e profilo Parquet fissi) su file temporaneo e lo rinomina."""
+    tmp_path = f"{path}.tmp"
+    table = to_arrow_table(table)
+    write_table(table, tmp_path, tier=tier)
+    os.replace(tmp_path, path)
+    
+    target = describe_path(path)
+    metrics.inc('mehd_bytes_written_total', os.path.getsize(path), target=target)
+    metrics.inc('mehd_rows_written_total', table.num_rows, target=target)
+
+def merge_tables(existing, new):
+    """Unisce dati esistenti e nuovi per timestamp_ms; i dati nuovi sostituiscono i duplicati."""
+    new_timestamps = new.column('timestamp_ms').to_numpy()
+    new_sorted = new.num_rows < 2 or bool(np.all(np.diff(new_timestamps) > 0))
+    
+    if existing is None or existing.num_rows == 0:
+        if new_sorted:
+            return new
+        combined = new
+    else:
+        combined = pa.concat_tables([existing, new], promote_options='permissive')
+        # Caso tipico dell'append: nuovi dati tutti successivi a quelli esistenti, nessun riordino
+        if new_sorted and new_timestamps[0] > pc.max(existing.column('timestamp_ms')).as_py():
+            return combined
+    
+    df = combined.to_pandas()
+    df = df.drop_duplicates(subset=['timestamp_ms'], keep='last').sort_values('timestamp_ms')
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def sorted_unique_timestamps(timestamps_ms):
+    """Ordina e deduplica i timestamp (più veloce di np.unique su array già quasi ordinati)."""
+    timestamps = np.sort(np.asarray(timestamps_ms, dtype='int64'))
+    if len(timestamps) < 2:
+        return timestamps
+    keep = np.empty(len(timestamps), dtype=bool)
+    keep[0] = True
+    np.not_equal(timestamps[1:], timestamps[:-1], out=keep[1:])
+    return timestamps[keep]
+
+def find_missing_ranges(timestamps_ms, interval_ms):
+    """Trova (vettorizzato) gli intervalli mancanti: array di inizio (primo ts mancante) e fine (ts successivo presente)."""
+    timestamps = sorted_unique_timestamps(timestamps_ms)
+    if len(timestamps) < 2 or not interval_ms:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+    
+    diffs = np.diff(timestamps)
+    gap_idx = np.flatnonzero(diffs > interval_ms)
+    return timestamps[gap_idx] + interval_ms, timestamps[gap_idx + 1]
+
+def infer_interval_ms(timestamps_ms):
+    """Stima l'intervallo tra record (mediana delle differenze, robusta ai gap)."""
+    timestamps = sorted_unique_timestamps(timestamps_ms)
+    if len(timestamps) < 2:
+        return None
+    # Le ultime 100k differenze bastano e riflettono l'intervallo attuale
+    return int(np.median(np.diff(timestamps[-100_001:])))
+
+def format_gaps(starts, ends, interval_ms):
+    """Converte gli intervalli mancanti nel formato del manifest."""
+    return [
+        {'start': int(start), 'end': int(end), 'missing': int((end - start) // interval_ms)}
+        for start, end in zip(starts[:MANIFEST_MAX_GAPS], ends[:MANIFEST_MAX_GAPS])
+    ]
+
+def get_manifest_path(path):
+    """Percorso del manifest: _manifest.json nel dataset o <file>.manifest.json accanto al file."""
+    if is_dataset_path(path):
+        return os.path.join(path, '_manifest.json')
+    return f"{path[:-len('.parquet')]}.manifest.json"
+
+def to_arrow_table(data):
+    """Converte DataFrame, RecordBatch o Table in una pyarrow Table."""
+    if data is None:
+        return pa.table({})
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pa.RecordBatch):
+        return pa.Table.from_batches([data])
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+def build_manifest(data):
+    """Calcola il manifest (righe, min/max timestamp, schema, gap) del contenuto completo di un file."""
+    table = to_arrow_table(data)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'rows': int(table.num_rows),
+        'min_timestamp': None,
+        'max_timestamp': None,
+        'interval_ms': None,
+        'schema': {field.name: str(field.type) for field in table.schema},
+        'gap_count': 0,
+        'gaps': [],
+    }
+    if table.num_rows == 0 or 'timestamp_ms' not in table.column_names:
+        return manifest
+    
+    timestamps = table.column('timestamp_ms').to_numpy()
+    interval_ms = infer_interval_ms(timestamps)
+    starts, ends = find_missing_ranges(timestamps, interval_ms)
+    manifest.update({
+        'min_timestamp': int(timestamps.min()),
+        'max_timestamp': int(timestamps.max()),
+        'interval_ms': interval_ms,
+        'gap_count': int(len(starts)),
+        'gaps': format_gaps(starts, ends, interval_ms) if interval_ms else [],
+    })
+    return manifest
+
+def build_dataset_manifest(partitions_stats):
+    """Aggrega i manifest delle partizioni (inclusi i gap a cavallo tra partizioni)."""
+    partitions = [partitions_stats[name] for name in sorted(partitions_stats) if partitions_stats[name]['rows'] > 0]
+    manifest = build_manifest(None)
+    manifest['partitions'] = partitions_stats
+    if not partitions:
+        return manifest
+    
+    intervals = [p['interval_ms'] for p in partitions if p['interval_ms']]
+    interval_ms = int(np.median(intervals)) if intervals else None
+    gaps = [gap for p in partitions for gap in p['gaps']]
+    gap_count = sum(p['gap_count'] for p in partitions)
+    
+    # Gap tra la fine di una partizione e l'inizio della successiva
+    if interval_ms:
+        for previous, current in zip(partitions, partitions[1:]):
+            if current['min_timestamp'] - previous['max_timestamp'] > interval_ms:
+                start = previous['max_timestamp'] + interval_ms
+                gaps.append({'start': start, 'end': current['min_timestamp'],
+                             'missing': (current['min_timestamp'] - start) // interval_ms})
+                gap_count += 1
+    
+    manifest.update({
+        'rows': sum(p['rows'] for p in partitions),
+        'min_timestamp': partitions[0]['min_timestamp'],
+        'max_timestamp': partitions[-1]['max_timestamp'],
+        'interval_ms': interval_ms,
+        'schema': partitions[-1]['schema'],
+        'gap_count': gap_count,
+        'gaps': sorted(gaps, key=lambda gap: gap['start'])[:MANIFEST_MAX_GAPS],
+    })
+    return manifest
+
+def write_manifest(path, manifest):
+    """Scrive il manifest in modo atomico aggiornando l'orario dell'ultima scrittura."""
+    manifest['last_write'] = datetime.now(timezone.utc).isoformat()
+    manifest_path = get_manifest_path(path)
+    
+    # I gap confermati (assenti anche sull'exchange) sopravvivono alle riscritture dei dati
+    if 'confirmed_gaps' not in manifest and check_file_exists(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest['confirmed_gaps'] = json.load(f).get('confirmed_gaps', [])
+        except (OSError, ValueError):
+            pass
+    
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def read_manifest(path):
+    """Legge il manifest se esiste ed è più recente dei dati, altrimenti None."""
+    manifest_path = get_manifest_path(path)
+    if not check_file_exists(manifest_path):
+        return None
+    
+    # Dati modificati dopo il manifest (es. scritture esterne): manifest non affidabile
+    data_files = list_partitions(path) if is_dataset_path(path) else [path]
+    manifest_mtime = os.path.getmtime(manifest_path)
+    if any(os.path.getmtime(data_file) > manifest_mtime for data_file in data_files if check_file_exists(data_file)):
+        return None
+    
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+def read_footer_stats(path):
+    """Statistiche dai soli footer Parquet (righe, min/max timestamp_ms, schema) senza leggere i dati."""
+    data_files = list_partitions(path) if is_dataset_path(path) else [path]
+    stats = {'rows': 0, 'min_timestamp': None, 'max_timestamp': None, 'schema': {}, 'gap_count': None, 'gaps': None}
+    
+    for data_file in data_files:
+        metadata = pq.ParquetFile(data_file).metadata
+        stats['rows'] += metadata.num_rows
+        schema = metadata.schema.to_arrow_schema()
+        stats['schema'] = {field.name: str(field.type) for field in schema}
+        if 'timestamp_ms' not in schema.names:
+            continue
+        
+        column_idx = schema.get_field_index('timestamp_ms')
+        for rg in range(metadata.num_row_groups):
+            column_stats = metadata.row_group(rg).column(column_idx).statistics
+            if column_stats is None or not column_stats.has_min_max:
+                continue
+            low, high = int(column_stats.min), int(column_stats.max)
+            stats['min_timestamp'] = low if stats['min_timestamp'] is None else min(stats['min_timestamp'], low)
+            stats['max_timestamp'] = high if stats['max_timestamp'] is None else max(stats['max_timestamp'], high)
+    return stats
+
+def rebuild_manifest(path):
+    """Ricalcola il manifest leggendo i dati (dopo modifiche esterne, es. migrazioni)."""
+    if is_dataset_path(path):
+        partitions_stats = {os.path.basename(partition): build_manifest(pq.read_table(partition))
+                            for partition in list_partitions(path)}
+        manifest = build_dataset_manifest(partitions_stats)
+    else:
+        manifest = build_manifest(pq.read_table(path))
+    write_manifest(path, manifest)
+    return manifest
+
+def get_confirmed_gaps(path):
+    """Restituisce i gap confermati come set di (inizio, fine): intervalli che l'exchange non ha."""
+    manifest = read_manifest(path) or {}
+    return {tuple(gap) for gap in manifest.get('confirmed_gaps', [])}
+
+def add_confirmed_gaps(path, gaps):
+    """Registra nel manifest gli intervalli verificati come assenti sull'exchange (non verranno più richiesti)."""
+    manifest = read_manifest(path)
+    if manifest is None or not gaps:
+        return
+    confirmed = {tuple(gap) for gap in manifest.get('confirmed_gaps', [])} | {tuple(gap) for gap in gaps}
+    manifest['confirmed_gaps'] = sorted([int(start), int(end)] for start, end in confirmed)
+    write_manifest(path, manifest)
+
+def load_timestamps(path):
+    """Carica solo la colonna timestamp_ms (file o dataset) come array numpy int64 ordinato."""
+    if not check_file_exists(path):
+        return np.empty(0, dtype='int64')
+    
+    data_files = list_partitions(path) if is_dataset_path(path) else [path]
+    arrays = [pq.read_table(data_file, columns=['timestamp_ms']).column('timestamp_ms').to_numpy() for data_file in data_files]
+    if not arrays:
+        return np.empty(0, dtype='int64')
+    return np.sort(np.concatenate(arrays).astype('int64'))
+
+def get_data_stats(path):
+    """Statistiche dei dati dal manifest, con fallback sui footer Parquet. None se i dati non esistono."""
+    if not check_file_exists(path):
+        return None
+    
+    manifest = read_manifest(path)
+    if manifest is not None:
+        return manifest
+    
+    try:
+        return read_footer_stats(path)
+    except Exception:
+        return None
+
 def save_parquet(df, path, append=False):
-    """Salva DataFrame in Parquet con gestione append."""
+    """Salva DataFrame (o RecordBatch/Table Arrow) in Parquet con gestione append."""
+    with metrics.timed('mehd_save_seconds', target=describe_path(path)):
+        if is_dataset_path(path):
+            return save_parquet_dataset(df, path, append=append)
+        save_parquet_file(df, path, append=append)
+
+def save_parquet_file(df, path, append=False):
+    """Salva in un unico file Parquet (STORAGE_MODE = 'file'): in append riscrive l'intero file."""
+    if not isinstance(df, pd.DataFrame):
+        df = to_arrow_table(df).to_pandas()
+    
     if append and check_file_exists(path):
         existing_df = load_parquet(path)
         if not existing_df.empty and not df.empty:
-            # Usa subset esplicito per evitare problemi di tipo
+            # Usa subset esplicito per evitare problemi di tipo; come merge_tables i dati nuovi sostituiscono
+            # i duplicati (es. barre del resample ricalcolate)
             subset_cols = ['timestamp_ms'] if 'timestamp_ms' in df.columns else list(df.columns)
-            df = pd.concat([existing_df, df]).drop_duplicates(subset=subset_cols).sort_values('timestamp_ms' if 'timestamp_ms' in df.columns else df.columns[0])
+            df = pd.concat([existing_df, df]).drop_duplicates(subset=subset_cols, keep='last').sort_values('timestamp_ms' if 'timestamp_ms' in df.columns else df.columns[0])
     
     # Assicurati che la directory esista
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    df.to_parquet(path, index=False)
-    print(f"Salvati {len(df)} record in {path}")
+    table = conform_table(to_arrow_table(df))
+    write_parquet_atomic(table, path)
+    
+    # Il DataFrame in memoria è il contenuto completo del file: manifest ricalcolato da zero
+    write_manifest(path, build_manifest(table))
+    logger.debug(f"Salvati {len(df)} record in {path}")
+
+def save_parquet_dataset(data, dataset_dir, append=False, partition_by=PARTITION_BY):
+    """Salva dati (DataFrame o Arrow) in un dataset partizionato riscrivendo solo le partizioni toccate."""
+    table = to_arrow_table(data)
+    
+    # OVERWRITE: rimuovi le partizioni esistenti prima della prima scrittura
+    manifest = read_manifest(dataset_dir) if append else None
+    if not append:
+        for partition in list_partitions(dataset_dir):
+            os.remove(partition)
+    
+    os.makedirs(dataset_dir, exist_ok=True)
+    partitions_stats = manifest.get('partitions', {}) if manifest else {}
+    if append and manifest is None:
+        # Manifest assente o non aggiornato: ricostruiscilo una volta dalle partizioni esistenti
+        for partition in list_partitions(dataset_dir):
+            partitions_stats[os.path.basename(partition)] = build_manifest(pq.read_table(partition))
+    if table.num_rows == 0:
+        write_manifest(dataset_dir, build_dataset_manifest(partitions_stats))
+        return
+    
+    keys = get_partition_keys(table.column('timestamp_ms').to_numpy(), partition_by)
+    current_key = get_partition_keys([get_current_timestamp_ms()], partition_by)[0]
+    touched = []
+    for key in np.sort(pd.unique(keys)):
+        part_table = table.filter(pa.array(keys == key))
+        part_path = os.path.join(dataset_dir, f"{key}.parquet")
+        
+        # In append si ricarica solo la partizione interessata (tipicamente l'ultima)
+        existing = pq.read_table(part_path) if check_file_exists(part_path) else None
+        part_table = conform_table(merge_tables(existing, part_table))
+        
+        # Partizioni chiuse: compressione più aggressiva, non verranno più riscritte spesso
+        write_parquet_atomic(part_table, part_path, tier='hot' if key >= current_key else 'cold')
+        touched.append(os.path.basename(part_path))
+        partitions_stats[os.path.basename(part_path)] = build_manifest(part_table)
+    
+    write_manifest(dataset_dir, build_dataset_manifest(partitions_stats))
+    logger.debug(f"Salvati {table.num_rows} record in {dataset_dir} (partizioni: {', '.join(touched)})")
 
 def ensure_directory_exists(directory):
     """Assicura che la directory esista."""
     if not os.path.exists(directory):
         os.makedirs(directory, exist_ok=True)
 
-def inspect_parquet(filepath, logger=None):
-    """Ispeziona un file Parquet e restituisce un riepilogo dei dati."""
+def build_gap_table(timestamps_ms, interval_ms):
+    """Tabella dei gap (inizio, fine, candele mancanti) calcolata con operazioni vettorizzate."""
+    starts, ends = find_missing_ranges(timestamps_ms, interval_ms)
+    return pd.DataFrame({
+        'start': pd.to_datetime(starts, unit='ms', utc=True),
+        'end': pd.to_datetime(ends - interval_ms, unit='ms', utc=True) if len(ends) else pd.to_datetime(ends, unit='ms', utc=True),
+        'start_ms': starts,
+        'end_ms': ends,
+        'missing_candles': (ends - starts) // interval_ms if interval_ms else ends - starts,
+    })
+
+def load_tail(path, n=5):
+    """Carica le ultime n righe leggendo solo l'ultimo row group dell'ultimo file."""
+    data_files = list_partitions(path) if is_dataset_path(path) else [path]
+    if not data_files:
+        return pd.DataFrame()
+    
+    parquet_file = pq.ParquetFile(data_files[-1])
+    if parquet_file.metadata.num_row_groups == 0:
+        return pd.DataFrame()
+    tail = parquet_file.read_row_group(parquet_file.metadata.num_row_groups - 1).to_pandas()
+    if len(tail) < n:
+        tail = load_parquet(data_files[-1])
+    return tail.sort_values('timestamp_ms').tail(n) if 'timestamp_ms' in tail.columns else tail.tail(n)
+
+def inspect_parquet(filepath, logger=None, interval_ms=None, max_gaps_displayed=50):
+    """Ispeziona un file Parquet e restituisce un riepilogo dei dati e la tabella dei gap."""
     output = logger.info if logger else print
     
     if not check_file_exists(filepath):
         output(f"Errore: Il file {filepath} non esiste.")
         return False
     
-    # Carica il file Parquet
-    df = load_parquet(filepath)
+    # Legge solo timestamp_ms e le ultime righe: niente conversioni riga per riga
+    timestamps = load_timestamps(filepath)
     
-    if df.empty:
+    if len(timestamps) == 0:
         output(f"Il file {filepath} è vuoto.")
         return False
     
-    # Determina il tipo di dati in base al nome del file
     filename = os.path.basename(filepath)
+    tail = load_tail(filepath)
     
 # Ispezione per file candele (default)
     output(f"📊 ISPEZIONE CANDLE: {filename}")
-        
-    # Converti timestamp_ms in datetime per leggibilità
-    if 'timestamp_ms' in df.columns:
-        df['datetime'] = df['timestamp_ms'].apply(timestamp_to_datetime)
-      
+    
+    interval_ms = interval_ms or infer_interval_ms(timestamps)
+    unique_timestamps = sorted_unique_timestamps(timestamps)
+    gaps = build_gap_table(unique_timestamps, interval_ms)
+    first, last = pd.to_datetime([timestamps[0], timestamps[-1]], unit='ms', utc=True)
+    expected = int((timestamps[-1] - timestamps[0]) // interval_ms) + 1 if interval_ms else len(timestamps)
+    summary = {
+        'rows': int(len(timestamps)),
+        'duplicates': int(len(timestamps) - len(unique_timestamps)),
+        'first': first,
+        'last': last,
+        'interval_ms': interval_ms,
+        'expected_rows': expected,
+        'gap_count': int(len(gaps)),
+        'missing_candles': int(gaps['missing_candles'].sum()),
+        'largest_gap': int(gaps['missing_candles'].max()) if len(gaps) else 0,
+        'coverage_pct': round(100 * len(unique_timestamps) / expected, 4) if expected else 100.0,
+        'columns': list(tail.columns),
+    }
+    
     # Stampa informazioni di base
-    output(f"Numero di candele: {len(df)}")
-      
-    if 'datetime' in df.columns:
-        output(f"Data iniziale: {df['datetime'].min()}")
-        output(f"Data finale: {df['datetime'].max()}")
-       
+    output(f"Numero di candele: {summary['rows']} (attese: {summary['expected_rows']}, copertura: {summary['coverage_pct']}%)")
+    output(f"Data iniziale: {summary['first']}")
+    output(f"Data finale: {summary['last']}")
+    if summary['duplicates']:
+        output(f"⚠️  Timestamp duplicati: {summary['duplicates']}")
+    
     # Colonne disponibili
-    output(f"Colonne disponibili: {list(df.columns)}")
-        
+    output(f"Colonne disponibili: {summary['columns']}")
+    
     # Stampa le ultime 5 candele
     output("Ultime 5 candele:")
-    candle_columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
-    available_columns = [col for col in candle_columns if col in df.columns]
-    if 'trades_count' in df.columns:
-        available_columns.append('trades_count')
-        
+    if 'timestamp_ms' in tail.columns:
+        tail = tail.assign(datetime=pd.to_datetime(tail['timestamp_ms'], unit='ms', utc=True))
+    candle_columns = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'trades_count']
+    available_columns = [col for col in candle_columns if col in tail.columns]
     if available_columns:
-        output(df[available_columns].tail(5).to_string(index=False))
-        
-    # Controlla i gap nei timestamp (per timeframe 1m, ogni candela dovrebbe essere a +60 secondi)
-    if 'timestamp_ms' in df.columns:
-        df_sorted = df.sort_values('timestamp_ms').reset_index(drop=True)
-        df_sorted['timestamp_diff'] = df_sorted['timestamp_ms'].diff()
-        gaps = df_sorted[df_sorted['timestamp_diff'] > 60000]  # > 1 minuto
-            
-        if not gaps.empty:
-            output("⚠️  GAP RILEVATI (differenza > 1 minuto):")
-            for i in range(len(df_sorted)):
-                if df_sorted.iloc[i]['timestamp_diff'] > 60000:
-                    prev_row = df_sorted.iloc[i-1]
-                    curr_row = df_sorted.iloc[i]
-                    prev_time = timestamp_to_datetime(prev_row['timestamp_ms'])
-                    curr_time = timestamp_to_datetime(curr_row['timestamp_ms'])
-                    gap_seconds = curr_row['timestamp_diff'] / 1000
-                    output(f"Gap tra {prev_time} e {curr_time} ({gap_seconds:.1f} secondi)")
-        else:
-            output("✅ Nessun gap rilevato nei dati (timeline continua)")
+        output(tail[available_columns].to_string(index=False))
     
-
-
-
+    # Gap nei timestamp (per timeframe 1m, ogni candela dovrebbe essere a +60 secondi)
+    if not gaps.empty:
+        output(f"⚠️  GAP RILEVATI: {summary['gap_count']} gap, {summary['missing_candles']} candele mancanti "
+               f"(gap più lungo: {summary['largest_gap']} candele)")
+        output(gaps[['start', 'end', 'missing_candles']].head(max_gaps_displayed).to_string(index=False))
+        if len(gaps) > max_gaps_displayed:
+            output(f"... altri {len(gaps) - max_gaps_displayed} gap non mostrati")
+    else:
+        output("✅ Nessun gap rilevato nei dati (timeline continua)")
+    
+    return {'summary': summary, 'gaps': gaps}
 
 # Copia della funzione sopra per futura referenza con funding e OI
 # def inspect_parquet(filepath, logger=None):
@@ -0,0 +1,132 @@
+# utils/ingest_buffer.py
+# Buffer colonnare per le candele scaricate: ogni pagina ccxt viene convertita una sola volta
+# in array NumPy tipizzati e consegnata al writer come RecordBatch Arrow (zero-copy).
+# BackgroundWriter persiste i batch in un thread dedicato, così il fetch delle pagine successive
+# prosegue mentre si scrive su disco (coda limitata = backpressure se il disco resta indietro).
+import queue
+import threading
+import time
+import numpy as np
+import pyarrow as pa
+from utils.metrics import metrics
+
+OHLCV_COLUMNS = ['timestamp_ms', 'open', 'high', 'low', 'close', 'volume']
+PRICE_COLUMNS = OHLCV_COLUMNS[1:]
+
+class OHLCVBuffer:
+    """Buffer preallocato (timestamp int64, prezzi/volume float64) svuotato a ogni flush."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._allocate()
+
+    def _allocate(self):
+        self.timestamps = np.empty(self.capacity, dtype='int64')
+        self.values = np.empty((len(PRICE_COLUMNS), self.capacity), dtype='float64')  # Colonne contigue
+        self.trades_count = None
+        self.size = 0
+
+    def _grow(self, required):
+        """Raddoppia la capacità (succede solo se una pagina supera la capacità prevista)."""
+        capacity = max(required, self.capacity * 2)
+        timestamps = np.empty(capacity, dtype='int64')
+        values = np.empty((len(PRICE_COLUMNS), capacity), dtype='float64')
+        timestamps[:self.size] = self.timestamps[:self.size]
+        values[:, :self.size] = self.values[:, :self.size]
+        if self.trades_count is not None:
+            trades_count = np.empty(capacity, dtype='float64')
+            trades_count[:self.size] = self.trades_count[:self.size]
+            self.trades_count = trades_count
+        self.capacity, self.timestamps, self.values = capacity, timestamps, values
+
+    def __len__(self):
+        return self.size
+
+    def append_page(self, ohlcv):
+        """Aggiunge una pagina ccxt ([[ts, o, h, l, c, v(, trades)], ...]) con un'unica conversione."""
+        count = len(ohlcv)
+        if count == 0:
+            return
+        if self.size + count > self.capacity:
+            self._grow(self.size + count)
+
+        with metrics.timed('mehd_buffer_convert_seconds', step='append'):
+            page = np.asarray(ohlcv, dtype='float64')  # None -> NaN
+            end = self.size + count
+            self.timestamps[self.size:end] = page[:, 0]
+            self.values[:, self.size:end] = page[:, 1:6].T
+
+            # trades_count disponibile solo su alcuni exchange (7a colonna)
+            if page.shape[1] > 6:
+                if self.trades_count is None:
+                    self.trades_count = np.full(self.capacity, np.nan, dtype='float64')
+                self.trades_count[self.size:end] = page[:, 6]
+            self.size = end
+
+    def take(self):
+        """Restituisce il contenuto come RecordBatch e riparte con array nuovi (il batch resta valido)."""
+        if self.size == 0:
+            return None
+
+        with metrics.timed('mehd_buffer_convert_seconds', step='take'):
+            arrays = [pa.array(self.timestamps[:self.size])]
+            arrays += [pa.array(self.values[i, :self.size]) for i in range(len(PRICE_COLUMNS))]
+            names = list(OHLCV_COLUMNS)
+            if self.trades_count is not None:
+                arrays.append(pa.array(self.trades_count[:self.size]))
+                names.append('trades_count')
+
+            batch = pa.RecordBatch.from_arrays(arrays, names=names)
+        self._allocate()
+        return batch
+
+class BackgroundWriter:
+    """Writer in un thread dedicato: i batch vengono scritti nell'ordine di arrivo con write_fn(batch, append).
+
+    submit() si blocca quando la coda è piena (max_pending batch in attesa); close() svuota la coda,
+    attende l'ultima scrittura e rilancia l'eventuale errore del thread.
+    """
+
+    _STOP = object()
+
+    def __init__(self, write_fn, append=False, max_pending=2, name='writer'):
+        self.write_fn = write_fn
+        self.append = append
+        self.name = name
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.error = None
+        self.written_batches = 0
+        self.thread = threading.Thread(target=self._run, name=f"mehd-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is self._STOP:
+                return
+            if self.error is not None:
+                continue  # Dopo un errore si scartano i batch restanti (il download viene interrotto)
+            try:
+                self.write_fn(batch, self.append)
+                self.append = True  # Dopo la prima scrittura si aggiunge sempre
+                self.written_batches += 1
+            except Exception as e:
+                self.error = e
+
+    def submit(self, batch):
+        """Accoda un batch; attende se il writer è indietro (il tempo di attesa finisce nelle metriche)."""
+        if self.error is not None:
+            raise self.error
+        if batch is None:
+            return
+        started = time.perf_counter()
+        self.queue.put(batch)
+        metrics.observe('mehd_writer_backpressure_seconds', time.perf_counter() - started, target=self.name)
+
+    def close(self):
+        """Attende la scrittura di tutti i batch accodati; rilancia l'errore del writer, se presente."""
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
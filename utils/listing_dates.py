@@ -0,0 +1,111 @@
+# utils/listing_dates.py
+# Data di listing (primo dato disponibile) di ogni coppia, trovata con una ricerca binaria sul tempo
+# e salvata in cache/listing_dates.json: i download di coppie nuove partono dalla prima candela reale
+# invece di camminare da DEFAULT_START_DATE (alcuni exchange restituiscono pagine vuote prima del listing,
+# altri le candele più recenti: in entrambi i casi il sondaggio a since fisso non è affidabile).
+import json
+import logging
+import os
+import threading
+from utils.date_utils import get_current_timestamp_ms, timestamp_to_datetime
+from start.config import CACHE_PATH, LISTING_PROBE_MAX_GAP_DAYS
+
+logger = logging.getLogger('MEHD')
+
+LISTING_CACHE_PATH = os.path.join(CACHE_PATH, 'listing_dates.json')
+_cache_lock = threading.Lock()
+
+def read_listing_cache():
+    """Cache completa {exchange: {coppia: {timeframe: timestamp_ms}}} (vuota se assente o illeggibile)."""
+    try:
+        with open(LISTING_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_cached_listing(exchange_id, pair, timeframe):
+    return read_listing_cache().get(exchange_id, {}).get(pair, {}).get(timeframe)
+
+def store_listing(exchange_id, pair, timeframe, listing_ms):
+    """Aggiunge una data di listing alla cache (lettura-modifica-scrittura atomica, sicura tra thread)."""
+    with _cache_lock:
+        cache = read_listing_cache()
+        cache.setdefault(exchange_id, {}).setdefault(pair, {})[timeframe] = int(listing_ms)
+        os.makedirs(os.path.dirname(LISTING_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{LISTING_CACHE_PATH}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, LISTING_CACHE_PATH)
+
+def listing_search(since, until, tf_ms, max_gap_ms=LISTING_PROBE_MAX_GAP_DAYS * 86_400_000):
+    """Ricerca binaria del primo dato in [since, until], indipendente da come si esegue il fetch.
+
+    Generatore: produce il since da sondare (fetch con limit=1), riceve la pagina ottenuta e alla fine
+    restituisce il timestamp di listing (StopIteration.value), o None se since ha già dei dati o se
+    non c'è nessun dato recente (coppia delistata). Un sondaggio è "positivo" se la prima candela
+    restituita non dista più di max_gap_ms dal since richiesto: pagine vuote e candele molto successive
+    (exchange che ignorano since e restituiscono le ultime candele) contano come "prima del listing".
+    """
+    def first_timestamp(page, probe):
+        if page and page[0][0] - probe <= max_gap_ms:
+            return page[0][0]
+        return None
+
+    if first_timestamp((yield since), since) is not None:
+        return None  # Dati già presenti allo start richiesto: nessuna ricerca necessaria
+
+    hi = until - until % tf_ms - 2 * tf_ms  # Ultime candele chiuse: esistono se la coppia è attiva
+    listing = first_timestamp((yield hi), hi)
+    if listing is None:
+        return None
+
+    lo = since
+    while hi - lo > tf_ms:
+        mid = (lo + (hi - lo) // 2) // tf_ms * tf_ms
+        if mid <= lo:
+            break
+        found = first_timestamp((yield mid), mid)
+        if found is None:
+            lo = mid
+        else:
+            hi = mid
+            listing = min(listing, found)
+    return listing
+
+def _finish(exchange_id, pair, timeframe, listing, requests):
+    if listing is not None:
+        store_listing(exchange_id, pair, timeframe, listing)
+        logger.info(f"🔎 Primo dato di {pair} su {exchange_id}: {timestamp_to_datetime(listing)} ({requests} richieste)")
+    return listing
+
+def find_listing_timestamp(exchange_id, pair, timeframe, tf_ms, since, fetch):
+    """Data di listing dalla cache o, se manca, con la ricerca binaria; fetch(since, limit) -> pagina ccxt."""
+    cached = get_cached_listing(exchange_id, pair, timeframe)
+    if cached is not None:
+        return cached
+
+    search = listing_search(since, get_current_timestamp_ms(), tf_ms)
+    probe, requests = next(search), 0
+    try:
+        while True:
+            page = fetch(probe, 1)
+            requests += 1
+            probe = search.send(page)
+    except StopIteration as stop:
+        return _finish(exchange_id, pair, timeframe, stop.value, requests)
+
+async def find_listing_timestamp_async(exchange_id, pair, timeframe, tf_ms, since, fetch):
+    """Come find_listing_timestamp, con fetch asincrono (await fetch(since, limit))."""
+    cached = get_cached_listing(exchange_id, pair, timeframe)
+    if cached is not None:
+        return cached
+
+    search = listing_search(since, get_current_timestamp_ms(), tf_ms)
+    probe, requests = next(search), 0
+    try:
+        while True:
+            page = await fetch(probe, 1)
+            requests += 1
+            probe = search.send(page)
+    except StopIteration as stop:
+        return _finish(exchange_id, pair, timeframe, stop.value, requests)
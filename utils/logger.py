@@ -1,43 +1,132 @@
 # utils/logger.py
-import logging
+# Logging non bloccante: il logger 'MEHD' mette i record in una coda (QueueHandler) e un thread dedicato
+# (QueueListener) li scrive su file e console, così le coppie scaricate in parallelo non si contendono l'I/O.
+# Le barre di avanzamento per coppia (tqdm) sostituiscono i log a ogni salvataggio; i messaggi in console
+# passano da tqdm.write per non spezzare le barre.
+import atexit
 import datetime
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import threading
 from colorama import init, Fore, Style
+from tqdm import tqdm
+from start.config import LOG_JSON, PROGRESS_BARS, PROGRESS_MIN_INTERVAL
 
 # Inizializza colorama (necessario per Windows)
 init(autoreset=True)
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+_progress_lock = threading.Lock()
+_progress_positions = set()
+
+class ColoredFormatter(logging.Formatter):
+    """Formattatore console con un colore per livello (formattatori creati una volta sola)."""
+
+    FORMATS = {
+        logging.INFO: f"{Fore.GREEN}{LOG_FORMAT}{Style.RESET_ALL}",
+        logging.WARNING: f"{Fore.YELLOW}{LOG_FORMAT}{Style.RESET_ALL}",
+        logging.ERROR: f"{Fore.RED}{LOG_FORMAT}{Style.RESET_ALL}"
+    }
+
+    def __init__(self):
+        super().__init__(LOG_FORMAT)
+        self.formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
+    def format(self, record):
+        formatter = self.formatters.get(record.levelno)
+        return formatter.format(record) if formatter else super().format(record)
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record (time, level, thread, message) per l'analisi automatica dei log."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class TqdmConsoleHandler(logging.StreamHandler):
+    """Console handler che scrive sopra le barre di avanzamento attive invece di spezzarle."""
+
+    def emit(self, record):
+        try:
+            tqdm.write(self.format(record), file=self.stream)
+        except Exception:
+            self.handleError(record)
+
 def setup_logger(logs_path):
-    """Setup del logger con output colorato."""
-    log_filename = datetime.datetime.now().strftime('%Y-%m-%d.log')
-    log_path = os.path.join(logs_path, log_filename)
-    
+    """Setup del logger con output colorato, scritto in background da un QueueListener."""
+    global _listener
     logger = logging.getLogger('MEHD')
     logger.setLevel(logging.INFO)
-    
-    # Formattatore personalizzato con colori
-    class ColoredFormatter(logging.Formatter):
-        FORMATS = {
-            logging.INFO: f"{Fore.GREEN}%(asctime)s - %(levelname)s - %(message)s{Style.RESET_ALL}",
-            logging.WARNING: f"{Fore.YELLOW}%(asctime)s - %(levelname)s - %(message)s{Style.RESET_ALL}",
-            logging.ERROR: f"{Fore.RED}%(asctime)s - %(levelname)s - %(message)s{Style.RESET_ALL}"
-        }
-
-        def format(self, record):
-            formatter = logging.Formatter(self.FORMATS.get(record.levelno, '%(asctime)s - %(levelname)s - %(message)s'))
-            return formatter.format(record)
+    if _listener is not None:
+        return logger  # Già configurato in questo processo
 
-    # File handler (senza colori, per mantenere il file di log pulito)
-    file_handler = logging.FileHandler(log_path)
+    # File handler (senza colori, per mantenere il file di log pulito; JSON lines con LOG_JSON)
+    log_filename = datetime.datetime.now().strftime('%Y-%m-%d.jsonl' if LOG_JSON else '%Y-%m-%d.log')
+    file_handler = logging.FileHandler(os.path.join(logs_path, log_filename), encoding='utf-8')
     file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    file_handler.setFormatter(JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT))
 
     # Console handler (con colori)
-    console_handler = logging.StreamHandler()
+    console_handler = TqdmConsoleHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(ColoredFormatter())
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+    # I thread dei download mettono solo il record in coda: formattazione e I/O avvengono nel listener
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logger)
+
+    return logger
+
+def stop_logger():
+    """Svuota la coda dei log e ferma il listener (chiamata anche all'uscita del processo)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class PairProgress:
+    """Barra di avanzamento di un download: posizione nel tempo tra start e end, ridisegnata al massimo
+    ogni PROGRESS_MIN_INTERVAL secondi. Ogni barra occupa una riga propria finché è aperta."""
+
+    def __init__(self, desc, start_ms, end_ms, tf_ms):
+        self.start_ms = start_ms
+        self.tf_ms = tf_ms
+        with _progress_lock:
+            self.position = min(set(range(len(_progress_positions) + 1)) - _progress_positions)
+            _progress_positions.add(self.position)
+        # disable=None: barre disattivate automaticamente se l'output non è un terminale (cron, batch)
+        self.bar = tqdm(total=max(0, (end_ms - start_ms) // tf_ms), desc=desc, unit='candele', unit_scale=True,
+                        position=self.position, leave=False, mininterval=PROGRESS_MIN_INTERVAL,
+                        dynamic_ncols=True, disable=None if PROGRESS_BARS else True)
+
+    def advance(self, since):
+        """Aggiorna la barra all'ultimo timestamp raggiunto (include le finestre vuote saltate)."""
+        done = min(self.bar.total, max(0, (since - self.start_ms) // self.tf_ms))
+        if done > self.bar.n:
+            self.bar.update(done - self.bar.n)
+
+    def close(self):
+        self.bar.close()
+        with _progress_lock:
+            _progress_positions.discard(self.position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,5 +1,6 @@
 # utils/market_utils.py
 import re
+from utils.markets_cache import load_markets_cached
 
 def detect_market_type(exchange, pair):
     """Rileva se il pair è spot o perpetual, escludendo futures e opzioni."""
@@ -43,6 +44,10 @@ def get_available_pairs(exchange, asset):
     """Trova tutti i pair disponibili per un asset, escludendo futures e opzioni."""
     available_pairs = []
     
+    # Mercati non ancora caricati: usa la cache locale prima della rete
+    if not exchange.markets:
+        load_markets_cached(exchange)
+    
     for symbol, market in exchange.markets.items():
         # Estrai la base currency (prima parte del simbolo)
         base_currency = symbol.split('/')[0].split(':')[0]
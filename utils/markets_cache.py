@@ -0,0 +1,65 @@
+# utils/markets_cache.py
+# Cache su disco dei mercati ccxt: evita di riscaricare diversi MB di metadati a ogni avvio.
+# Un file per exchange e versione di ccxt (una nuova versione può cambiare il formato dei mercati).
+import json
+import logging
+import os
+import time
+import ccxt
+from start.config import CACHE_PATH, MARKETS_CACHE_TTL_HOURS
+
+logger = logging.getLogger('MEHD')
+
+MARKETS_CACHE_DIR = os.path.join(CACHE_PATH, 'markets')
+
+def get_markets_cache_path(exchange_id):
+    """Percorso della cache mercati per exchange e versione di ccxt."""
+    return os.path.join(MARKETS_CACHE_DIR, f"{exchange_id}_ccxt-{ccxt.__version__}.json")
+
+def read_markets_cache(exchange_id, ttl_hours=MARKETS_CACHE_TTL_HOURS):
+    """Legge la cache se esiste e non è scaduta, altrimenti None."""
+    cache_path = get_markets_cache_path(exchange_id)
+    if not os.path.exists(cache_path):
+        return None
+    
+    age_hours = (time.time() - os.path.getmtime(cache_path)) / 3600
+    if age_hours > ttl_hours:
+        return None
+    
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_markets_cache(exchange):
+    """Salva mercati e valute dell'exchange (scrittura atomica)."""
+    os.makedirs(MARKETS_CACHE_DIR, exist_ok=True)
+    cache_path = get_markets_cache_path(exchange.id)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'markets': exchange.markets, 'currencies': exchange.currencies}, f, default=str)
+    os.replace(tmp_path, cache_path)
+
+def load_markets_cached(exchange, reload=False, ttl_hours=MARKETS_CACHE_TTL_HOURS):
+    """Carica i mercati dalla cache locale; scarica dall'exchange solo se la cache è scaduta o reload=True."""
+    if not reload:
+        cached = read_markets_cache(exchange.id, ttl_hours)
+        if cached and cached.get('markets'):
+            exchange.set_markets(cached['markets'], cached.get('currencies'))
+            logger.info(f"⚡ Mercati di {exchange.id} caricati dalla cache locale")
+            return exchange.markets
+    
+    markets = exchange.load_markets(reload=True)
+    if markets:
+        write_markets_cache(exchange)
+    return markets
+
+def ensure_symbol_loaded(exchange, symbol):
+    """Ricarica i mercati dalla rete solo se il simbolo manca (es. nuovo listing dopo l'ultimo salvataggio)."""
+    if exchange.markets and symbol in exchange.markets:
+        return True
+    
+    logger.info(f"🔄 {symbol} non presente nella cache mercati di {exchange.id}, ricarico...")
+    load_markets_cached(exchange, reload=True)
+    return symbol in (exchange.markets or {})
@@ -0,0 +1,214 @@
+# utils/metrics.py
+# Metriche di runtime (contatori, gauge, istogrammi di latenza) con export JSON e Prometheus text format.
+# Registro unico per processo, thread-safe: lo usano downloader sync/async, rate limiter e salvataggi.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from start.config import LOGS_PATH, METRICS_ENABLED, METRICS_EXPORT_INTERVAL
+
+# Limiti superiori dei bucket in secondi (da 1ms a 1 minuto)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_FILENAME = 'mehd_metrics'
+
+class Histogram:
+    """Istogramma a bucket fissi (cumulativi in export, come Prometheus)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Ultimo = +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Stima del quantile dal limite superiore del bucket che lo contiene."""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+class MetricsRegistry:
+    """Contatori, gauge e istogrammi identificati da nome + etichette (exchange, pair, target...)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Misura la durata del blocco in un istogramma (anche se il blocco solleva eccezioni)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_dict(self):
+        with self.lock:
+            def group(items, render):
+                grouped = {}
+                for (name, labels), value in sorted(items):
+                    grouped.setdefault(name, []).append({'labels': dict(labels), **render(value)})
+                return grouped
+
+            return {
+                'generated_at': datetime.now(timezone.utc).isoformat(),
+                'uptime_s': round(time.time() - self.started, 1),
+                'counters': group(self.counters.items(), lambda value: {'value': value}),
+                'gauges': group(self.gauges.items(), lambda value: {'value': value}),
+                'histograms': group(self.histograms.items(), lambda h: {
+                    'count': h.count,
+                    'sum': round(h.sum, 6),
+                    'avg': round(h.sum / h.count, 6) if h.count else None,
+                    'p50': h.quantile(0.5),
+                    'p95': h.quantile(0.95),
+                    'p99': h.quantile(0.99),
+                }),
+            }
+
+    def to_prometheus(self):
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self.lock:
+            for kind, items in (('counter', self.counters), ('gauge', self.gauges)):
+                current = None
+                for (name, labels), value in sorted(items.items()):
+                    if name != current:
+                        lines.append(f"# TYPE {name} {kind}")
+                        current = name
+                    lines.append(f"{name}{labels_text(labels)} {value}")
+
+            current = None
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name != current:
+                    lines.append(f"# TYPE {name} histogram")
+                    current = name
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory=LOGS_PATH):
+        """Scrive metriche JSON e Prometheus (file sostituiti in modo atomico, leggibili durante la run)."""
+        if not METRICS_ENABLED:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        base_path = os.path.join(directory, METRICS_FILENAME)
+        for extension, content in (('json', json.dumps(self.to_dict(), indent=2)), ('prom', self.to_prometheus())):
+            path = f"{base_path}.{extension}"
+            with open(f"{path}.tmp", 'w') as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+        return base_path
+
+# Registro globale del processo
+metrics = MetricsRegistry()
+
+def describe_path(path):
+    """Etichetta leggibile per un percorso dati (exchange/coppia/timeframe per i dataset, nome file altrimenti)."""
+    path = path.rstrip(os.sep)
+    if path.endswith('.parquet'):
+        name = os.path.basename(path)[:-len('.parquet')]
+        # Partizioni (2024-03) e shard (shard_0001_00000) appartengono al dataset che le contiene
+        if name[:1].isdigit() or name.startswith('shard_'):
+            return describe_path(os.path.dirname(path))
+        # Segmenti di staging: etichetta del percorso dati a cui appartengono
+        if name.startswith('seg_'):
+            staging_dir = os.path.dirname(path)
+            if os.path.basename(staging_dir) == '_staging':
+                return describe_path(os.path.dirname(staging_dir))
+            return os.path.basename(staging_dir)
+        return name
+    return '/'.join(path.split(os.sep)[-3:])
+
+class MetricsExporter:
+    """Export periodico in un thread daemon durante le run lunghe, più un export finale allo stop."""
+
+    def __init__(self, directory=LOGS_PATH, interval=METRICS_EXPORT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                metrics.export(self.directory)
+            except OSError:
+                pass  # Un export fallito non deve interrompere il download
+
+    def start(self):
+        if METRICS_ENABLED and self.interval and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return metrics.export(self.directory)
@@ -0,0 +1,80 @@
+# utils/parquet_profile.py
+# Schema Arrow fisso per tipo di dato e profilo di scrittura Parquet:
+# - timestamp_ms int64 con DELTA_BINARY_PACKED (timestamp equispaziati -> quasi zero byte)
+# - prezzi/valori con dizionario (prezzi a tick ripetuti) e zstd
+# - row group dimensionati per il pruning per intervallo temporale
+# - ordinamento per timestamp_ms dichiarato nei metadati (sorting_columns)
+import pyarrow as pa
+import pyarrow.parquet as pq
+from start.config import PARQUET_TIERS, PARQUET_ROW_GROUP_SIZES
+
+SCHEMAS = {
+    'candles': pa.schema([
+        pa.field('timestamp_ms', pa.int64(), nullable=False),
+        pa.field('open', pa.float64()),
+        pa.field('high', pa.float64()),
+        pa.field('low', pa.float64()),
+        pa.field('close', pa.float64()),
+        pa.field('volume', pa.float64()),
+        pa.field('trades_count', pa.float64()),
+    ]),
+    'funding': pa.schema([
+        pa.field('timestamp_ms', pa.int64(), nullable=False),
+        pa.field('funding_rate', pa.float64()),
+    ]),
+    'oi': pa.schema([
+        pa.field('timestamp_ms', pa.int64(), nullable=False),
+        pa.field('open_interest', pa.float64()),
+        pa.field('open_interest_value', pa.float64()),
+    ]),
+}
+
+def infer_data_type(column_names):
+    """Deduce il tipo di dato (candles, funding, oi) dalle colonne."""
+    if 'funding_rate' in column_names:
+        return 'funding'
+    if 'open_interest' in column_names:
+        return 'oi'
+    return 'candles'
+
+def conform_table(table, data_type=None):
+    """Applica lo schema fisso: colonne nell'ordine previsto, tipi espliciti, colonne opzionali mancanti a null."""
+    data_type = data_type or infer_data_type(table.column_names)
+    schema = SCHEMAS[data_type]
+    if table.schema.equals(schema):
+        return table
+
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            # safe=False: timestamp float (es. 1.7e12) -> int64 senza errori di overflow apparente
+            columns.append(table.column(field.name).cast(field.type, safe=False))
+        else:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+    fields = list(schema)
+
+    # Colonne extra non previste dallo schema: mantenute in coda per non perdere dati
+    for name in table.column_names:
+        if name not in schema.names:
+            columns.append(table.column(name))
+            fields.append(table.schema.field(name))
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+def write_table(table, path, data_type=None, tier='hot'):
+    """Scrive una tabella con schema e profilo di encoding del tipo di dato."""
+    data_type = data_type or infer_data_type(table.column_names)
+    table = conform_table(table, data_type)
+    compression_level = PARQUET_TIERS[tier]
+    value_columns = [name for name in table.column_names if name != 'timestamp_ms']
+
+    pq.write_table(
+        table,
+        path,
+        compression='zstd',
+        compression_level=compression_level,
+        row_group_size=PARQUET_ROW_GROUP_SIZES[data_type],
+        use_dictionary=value_columns,
+        column_encoding={'timestamp_ms': 'DELTA_BINARY_PACKED'},
+        sorting_columns=[pq.SortingColumn(table.schema.get_field_index('timestamp_ms'))],
+        write_statistics=True,
+    )
@@ -0,0 +1,113 @@
+# utils/rate_limiter.py
+# Rate limiter adattivo a token bucket, uno per exchange e condiviso tra downloader sync e async.
+# Il bucket si ricarica anche durante il tempo speso in rete, quindi dopo ogni pagina si attende
+# solo il tempo residuo invece dell'intero exchange.rateLimit.
+import asyncio
+import logging
+import threading
+import time
+from utils.metrics import metrics
+from start.config import RATE_LIMIT_CAPACITY, RATE_LIMIT_MIN_FACTOR, RATE_LIMIT_RECOVERY_STEP, RATE_LIMIT_PENALTY_SECONDS
+
+logger = logging.getLogger('MEHD')
+
+# Header con il budget residuo: (header rimanente, header limite) oppure (header usato, limite fisso)
+RATE_LIMIT_HEADERS = {
+    'binance': ('x-mbx-used-weight-1m', 6000),
+    'bybit': ('x-bapi-limit-status', 'x-bapi-limit'),
+    'kucoin': ('gw-ratelimit-remaining', 'gw-ratelimit-limit'),
+    'gateio': ('x-gate-ratelimit-requests-remain', 'x-gate-ratelimit-limit'),
+}
+LOW_BUDGET_RATIO = 0.1  # Sotto il 10% di budget residuo si rallenta
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+class TokenBucketRateLimiter:
+    """Token bucket con backoff su 429/DDoSProtection e recupero graduale del rate nominale."""
+
+    def __init__(self, name, rate, capacity=RATE_LIMIT_CAPACITY):
+        self.name = name
+        self.base_rate = rate       # Token (peso) al secondo dichiarati dall'exchange
+        self.rate = rate            # Rate corrente, ridotto dopo i backoff
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost=1):
+        """Prenota `cost` token e restituisce i secondi da attendere prima della richiesta."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, cost=1):
+        """Attende (bloccante) finché la richiesta di peso `cost` rientra nel budget."""
+        wait = self.reserve(cost)
+        metrics.observe('mehd_rate_limit_wait_seconds', wait, exchange=self.name)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, cost=1):
+        """Come acquire, senza bloccare l'event loop."""
+        wait = self.reserve(cost)
+        metrics.observe('mehd_rate_limit_wait_seconds', wait, exchange=self.name)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, retry_after=None):
+        """Dimezza il rate e svuota il bucket dopo un 429/DDoSProtection."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.base_rate * RATE_LIMIT_MIN_FACTOR, self.rate / 2)
+            cooldown = retry_after if retry_after else RATE_LIMIT_PENALTY_SECONDS
+            self.tokens = min(self.tokens, 0.0) - cooldown * self.rate
+        metrics.inc('mehd_rate_limit_penalties_total', exchange=self.name)
+        metrics.set_gauge('mehd_rate_limit_rate', round(self.rate, 4), exchange=self.name)
+        logger.warning(f"🐢 Rate limit su {self.name}: rate ridotto a {self.rate:.2f} req/s, pausa {cooldown:.1f}s")
+
+    def reward(self):
+        """Riporta gradualmente il rate verso il valore nominale dopo una richiesta riuscita."""
+        if self.rate < self.base_rate:
+            with self.lock:
+                self.rate = min(self.base_rate, self.rate + self.base_rate * RATE_LIMIT_RECOVERY_STEP)
+
+    def update_from_headers(self, headers):
+        """Usa gli header di peso/budget dell'exchange per rallentare prima di ricevere un 429."""
+        header_info = RATE_LIMIT_HEADERS.get(self.name)
+        if not header_info or not headers:
+            return
+
+        headers = {str(key).lower(): value for key, value in headers.items()}
+        first_header, limit = header_info
+        try:
+            if isinstance(limit, str):
+                remaining = float(headers[first_header])
+                limit = float(headers[limit])
+            else:
+                remaining = limit - float(headers[first_header])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        if limit > 0 and remaining / limit < LOW_BUDGET_RATIO:
+            with self.lock:
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, 0.0)
+
+def get_rate_limiter(exchange):
+    """Restituisce il limiter condiviso dell'exchange e disattiva il throttler interno di ccxt."""
+    # Il budget è gestito qui: lasciare attivo anche quello di ccxt raddoppierebbe le attese
+    exchange.enableRateLimit = False
+
+    with _limiters_lock:
+        if exchange.id not in _limiters:
+            rate = 1000 / exchange.rateLimit if exchange.rateLimit else 10
+            _limiters[exchange.id] = TokenBucketRateLimiter(exchange.id, rate)
+        return _limiters[exchange.id]
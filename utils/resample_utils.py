@@ -0,0 +1,122 @@
+# utils/resample_utils.py
+# Ricampionamento delle candele 1m in timeframe superiori (5m, 15m, 1h, 4h, 1d) salvati accanto al 1m.
+# Dopo un APPEND si ricalcolano solo i bucket toccati dalle nuove candele: si rilegge il 1m dall'inizio
+# del bucket più vecchio interessato e le barre ricalcolate sostituiscono quelle esistenti (dedupe keep='last').
+#
+# python utils/resample_utils.py --path data/spot/binance/BTC-USDT/1m [--timeframes 5m 1h]
+import argparse
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pyarrow as pa
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.file_utils import is_dataset_path, read_path_range, get_data_stats, save_parquet
+from utils.parquet_profile import conform_table
+from start.config import TIMEFRAME, RESAMPLE_TIMEFRAMES
+
+logger = logging.getLogger('MEHD')
+
+TIMEFRAME_UNITS_MS = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000}
+
+def timeframe_to_ms(timeframe):
+    """Converte un timeframe ccxt ('5m', '4h', '1d') in millisecondi."""
+    try:
+        return int(timeframe[:-1]) * TIMEFRAME_UNITS_MS[timeframe[-1]]
+    except (KeyError, ValueError):
+        raise ValueError(f"Timeframe non supportato: {timeframe}. Usa minuti (m), ore (h) o giorni (d)")
+
+def get_resampled_path(source_path, timeframe):
+    """Percorso dell'output ricampionato: cartella sorella nel layout dataset, suffisso diverso nel layout file."""
+    if is_dataset_path(source_path):
+        return os.path.join(os.path.dirname(source_path.rstrip(os.sep)), timeframe)
+    suffix = f"_{TIMEFRAME}.parquet"
+    if not source_path.endswith(suffix):
+        raise ValueError(f"Il file sorgente non è un file {TIMEFRAME}: {source_path}")
+    return f"{source_path[:-len(suffix)]}_{timeframe}.parquet"
+
+def resample_ohlcv(table, bucket_ms):
+    """Aggrega candele ordinate per timestamp in barre di bucket_ms (riduzioni NumPy per segmento)."""
+    table = conform_table(table)
+    timestamps = table.column('timestamp_ms').to_numpy()
+    if len(timestamps) == 0:
+        return table.slice(0, 0)
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='stable')
+        table = table.take(pa.array(order))
+        timestamps = timestamps[order]
+
+    buckets = timestamps - timestamps % bucket_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    def column(name):
+        return table.column(name).to_numpy(zero_copy_only=False).astype('float64')
+
+    volume = column('volume')
+    trades = column('trades_count')
+    trades_present = np.add.reduceat(~np.isnan(trades), starts) > 0
+    return pa.table({
+        'timestamp_ms': buckets[starts],
+        'open': column('open')[starts],
+        'high': np.fmax.reduceat(column('high'), starts),    # fmax/fmin ignorano i NaN
+        'low': np.fmin.reduceat(column('low'), starts),
+        'close': column('close')[ends],
+        'volume': np.add.reduceat(np.nan_to_num(volume), starts),
+        'trades_count': np.where(trades_present, np.add.reduceat(np.nan_to_num(trades), starts), np.nan),
+    })
+
+def resample_pair(source_path, since_ms=None, timeframes=RESAMPLE_TIMEFRAMES):
+    """Aggiorna i timeframe superiori di una coppia.
+
+    since_ms = None ricostruisce tutto lo storico; altrimenti ricalcola solo i bucket
+    che contengono candele >= since_ms (le barre esistenti vengono sostituite).
+    """
+    if not timeframes:
+        return {}
+    started = time.time()
+
+    # Inizio del ricalcolo per ogni timeframe: bucket della prima candela nuova, o tutto se l'output non esiste
+    plan = {}
+    for timeframe in timeframes:
+        bucket_ms = timeframe_to_ms(timeframe)
+        output_path = get_resampled_path(source_path, timeframe)
+        incremental = since_ms is not None and get_data_stats(output_path) is not None
+        plan[timeframe] = (bucket_ms, output_path, since_ms - since_ms % bucket_ms if incremental else None)
+
+    read_starts = [bucket_start for _, _, bucket_start in plan.values()]
+    read_from = None if None in read_starts else min(read_starts)
+    candles = read_path_range(source_path, read_from)
+    if candles is None or candles.num_rows == 0:
+        return {}
+
+    timestamps = candles.column('timestamp_ms').to_numpy()
+    results = {}
+    for timeframe, (bucket_ms, output_path, bucket_start) in plan.items():
+        subset = candles if bucket_start is None else candles.filter(pa.array(timestamps >= bucket_start))
+        bars = resample_ohlcv(subset, bucket_ms)
+        save_parquet(bars, output_path, append=bucket_start is not None)
+        results[timeframe] = bars.num_rows
+
+    mode = 'completo' if read_from is None else 'incrementale'
+    logger.info(f"🧮 Resample {mode} di {os.path.basename(source_path.rstrip(os.sep))}: {candles.num_rows} candele "
+                f"→ {', '.join(f'{tf}: {n}' for tf, n in results.items())} barre ({time.time() - started:.2f}s)")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ricostruisce i timeframe superiori dai dati 1m")
+    parser.add_argument('--path', required=True, help=f"Dataset o file {TIMEFRAME} sorgente")
+    parser.add_argument('--timeframes', nargs='+', default=RESAMPLE_TIMEFRAMES, help="Timeframe da generare")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    results = resample_pair(args.path, None, args.timeframes)
+    if not results:
+        print(f"ℹ️  Nessuna candela trovata in {args.path}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
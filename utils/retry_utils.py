@@ -0,0 +1,189 @@
+# utils/retry_utils.py
+# Retry delle richieste agli exchange, condiviso tra downloader sync e async.
+# Gli errori vengono classificati in rate limit (429/DDoSProtection: il limiter rallenta e si riprova),
+# ritentabili (rete, timeout, 5xx, manutenzione: backoff esponenziale con jitter) e terminali (simbolo
+# non valido, parametri errati, autenticazione: nessun retry). Un fetch fallito solleva FetchError invece
+# di restituire []: una pagina vuota significa solo "nessun dato in questa finestra".
+# Un circuit breaker per exchange sospende le richieste dopo troppi errori consecutivi, così le coppie
+# in parallelo non martellano un exchange giù e riprendono insieme quando torna disponibile.
+import asyncio
+import logging
+import random
+import threading
+import time
+import ccxt
+from utils.metrics import metrics
+from utils.rate_limiter import get_rate_limiter
+from start.config import (RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                          CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN)
+
+logger = logging.getLogger('MEHD')
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+class FetchError(Exception):
+    """Fetch fallito dopo i retry (o errore terminale): distinto da una finestra senza dati."""
+
+    def __init__(self, exchange_id, pair, endpoint, cause, terminal=False):
+        self.exchange_id = exchange_id
+        self.pair = pair
+        self.endpoint = endpoint
+        self.cause = cause
+        self.terminal = terminal
+        kind = "errore terminale" if terminal else "tentativi esauriti"
+        super().__init__(f"{endpoint} {pair} su {exchange_id} ({kind}): {cause}")
+
+def classify_error(error):
+    """'rate_limit', 'retriable' o 'terminal'.
+
+    ccxt converte già gli status HTTP: 429/418 in RateLimitExceeded/DDoSProtection, 5xx in ExchangeNotAvailable/RequestTimeout
+    (sottoclassi di NetworkError). Anche le risposte malformate (BadResponse) sono in genere transitorie.
+    """
+    if isinstance(error, (ccxt.DDoSProtection, ccxt.RateLimitExceeded)):
+        return 'rate_limit'
+    if isinstance(error, ccxt.OperationFailed):  # NetworkError, RequestTimeout, ExchangeNotAvailable, BadResponse
+        return 'retriable'
+    return 'terminal'
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Backoff esponenziale con full jitter: le coppie in parallelo non riprovano tutte nello stesso istante."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+class CircuitBreaker:
+    """Circuit breaker per exchange: closed → open dopo `threshold` errori ritentabili consecutivi,
+    half-open dopo `cooldown` secondi (una sola richiesta di prova), closed alla prima risposta."""
+
+    def __init__(self, name, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def wait_time(self):
+        """Secondi da attendere prima di poter inviare una richiesta (0 = via libera)."""
+        with self.lock:
+            if self.state == 'closed':
+                return 0.0
+            now = time.monotonic()
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown - now
+                if remaining > 0:
+                    return remaining
+                self.state = 'half_open'
+            # Half-open: passa solo la richiesta di prova (una nuova se la precedente non ha mai risposto)
+            if self.probe_started is None or now - self.probe_started > self.cooldown:
+                self.probe_started = now
+                return 0.0
+            return min(self.cooldown, RETRY_BASE_DELAY)
+
+    def record_success(self):
+        """L'exchange ha risposto (anche con un errore terminale): il circuito si chiude."""
+        with self.lock:
+            reopened = self.state != 'closed'
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_started = None
+        if reopened:
+            metrics.set_gauge('mehd_circuit_open', 0, exchange=self.name)
+            logger.info(f"🔌 {self.name} di nuovo disponibile: circuit breaker chiuso")
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'open' or (self.state == 'closed' and self.failures < self.threshold):
+                return
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+        metrics.inc('mehd_circuit_trips_total', exchange=self.name)
+        metrics.set_gauge('mehd_circuit_open', 1, exchange=self.name)
+        logger.warning(f"🔌 {self.name} non risponde ({self.failures} errori consecutivi): "
+                       f"richieste sospese per {self.cooldown:.0f}s")
+
+def get_circuit_breaker(exchange_id):
+    """Circuit breaker condiviso dell'exchange (come il rate limiter, uno per processo)."""
+    with _breakers_lock:
+        if exchange_id not in _breakers:
+            _breakers[exchange_id] = CircuitBreaker(exchange_id)
+        return _breakers[exchange_id]
+
+def handle_fetch_error(exchange, pair, endpoint, error, attempt):
+    """Decide cosa fare dopo un errore: restituisce i secondi di attesa o solleva FetchError."""
+    kind = classify_error(error)
+    breaker = get_circuit_breaker(exchange.id)
+
+    if kind == 'terminal':
+        breaker.record_success()  # L'exchange ha risposto: il problema è la richiesta
+        metrics.inc('mehd_fetch_errors_total', exchange=exchange.id, pair=pair, error='terminal')
+        raise FetchError(exchange.id, pair, endpoint, error, terminal=True) from error
+
+    metrics.inc('mehd_fetch_retries_total', exchange=exchange.id, pair=pair)
+    if attempt >= RETRY_MAX_ATTEMPTS:
+        metrics.inc('mehd_fetch_errors_total', exchange=exchange.id, pair=pair, error=kind)
+        raise FetchError(exchange.id, pair, endpoint, error) from error
+
+    if kind == 'rate_limit':
+        # 429 / protezione DDoS: il limiter rallenta tutte le coppie dell'exchange, poi stessa pagina
+        logger.warning(f"⏳ [{pair}] Rate limit raggiunto ({attempt}/{RETRY_MAX_ATTEMPTS}): {error}")
+        get_rate_limiter(exchange).penalize()
+        return 0.0
+
+    breaker.record_failure()
+    delay = backoff_delay(attempt)
+    logger.warning(f"🔁 [{pair}] {type(error).__name__} su {exchange.id} ({attempt}/{RETRY_MAX_ATTEMPTS}), "
+                   f"nuovo tentativo tra {delay:.1f}s: {error}")
+    return delay
+
+def _succeeded(exchange, limiter):
+    limiter.update_from_headers(exchange.last_response_headers)
+    limiter.reward()
+    get_circuit_breaker(exchange.id).record_success()
+
+def call_with_retry(exchange, pair, endpoint, request, weight=1):
+    """Esegue request() sotto rate limiter, retry e circuit breaker dell'exchange (bloccante)."""
+    limiter = get_rate_limiter(exchange)
+    breaker = get_circuit_breaker(exchange.id)
+    attempt = 0
+    while True:
+        wait = breaker.wait_time()
+        if wait > 0:
+            time.sleep(wait)  # Le attese a circuito aperto non consumano tentativi: contano solo le richieste fallite
+            continue
+        attempt += 1
+        limiter.acquire(weight)
+        try:
+            with metrics.timed('mehd_fetch_seconds', exchange=exchange.id, pair=pair, endpoint=endpoint):
+                result = request()
+        except Exception as e:
+            # Solleva FetchError dopo RETRY_MAX_ATTEMPTS richieste fallite o su un errore terminale
+            time.sleep(handle_fetch_error(exchange, pair, endpoint, e, attempt))
+            continue
+        _succeeded(exchange, limiter)
+        return result
+
+async def call_with_retry_async(exchange, pair, endpoint, request, weight=1):
+    """Come call_with_retry, con request() coroutine e attese che non bloccano l'event loop."""
+    limiter = get_rate_limiter(exchange)
+    breaker = get_circuit_breaker(exchange.id)
+    attempt = 0
+    while True:
+        wait = breaker.wait_time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+            continue
+        attempt += 1
+        await limiter.acquire_async(weight)
+        try:
+            with metrics.timed('mehd_fetch_seconds', exchange=exchange.id, pair=pair, endpoint=endpoint):
+                result = await request()
+        except Exception as e:
+            # Solleva FetchError dopo RETRY_MAX_ATTEMPTS richieste fallite o su un errore terminale
+            await asyncio.sleep(handle_fetch_error(exchange, pair, endpoint, e, attempt))
+            continue
+        _succeeded(exchange, limiter)
+        return result
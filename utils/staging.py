@@ -0,0 +1,136 @@
+# utils/staging.py
+# Staging write-ahead delle candele: ogni pagina scaricata diventa un piccolo segmento Parquet (file temporaneo
+# + rename atomico) dentro _staging/, scritto dal BackgroundWriter del download. Un crash perde le pagine non ancora
+# scritte: al massimo WRITER_QUEUE_SIZE + 2 (quella in conversione, quelle in coda e quella in scrittura), che la
+# ripresa in APPEND scarica di nuovo; i file temporanei lasciati a metà vengono eliminati alla ripresa.
+# La compattazione (in un thread separato) unisce i segmenti nei dati definitivi, ordinati e senza duplicati,
+# ogni STAGING_COMPACT_ROWS righe e a fine download; i segmenti rimasti da un crash vengono compattati alla ripresa.
+#
+# Layout: data/spot/binance/BTC-USDT/1m/_staging/seg_<ns>.parquet          (STORAGE_MODE = 'dataset')
+#         data/spot/_staging/binance_spot_BTC-USDT_1m/seg_<ns>.parquet     (STORAGE_MODE = 'file')
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.file_utils import (get_staging_dir, list_segments, list_partitions, is_dataset_path, write_parquet_atomic,
+                              merge_tables, save_parquet, check_file_exists)
+from utils.parquet_profile import conform_table
+from utils.metrics import metrics, describe_path
+from start.config import STAGING_COMPACT_ROWS
+
+logger = logging.getLogger('MEHD')
+
+def write_segment(data, path):
+    """Scrive un segmento con rename atomico: o è completo o non esiste."""
+    table = data if isinstance(data, pa.Table) else pa.Table.from_batches([data])
+    staging_dir = get_staging_dir(path)
+    os.makedirs(staging_dir, exist_ok=True)
+    segment_path = os.path.join(staging_dir, f"seg_{time.time_ns():020d}.parquet")
+    write_parquet_atomic(conform_table(table), segment_path)
+    metrics.inc('mehd_staging_segments_total', target=describe_path(path))
+    return segment_path
+
+def compact_segments(path, segments, append=True):
+    """Unisce i segmenti indicati nei dati definitivi e li rimuove; restituisce le righe compattate.
+
+    I segmenti vengono eliminati solo dopo il salvataggio: se il processo si interrompe a metà,
+    la compattazione successiva li riapplica (il merge per timestamp_ms la rende idempotente).
+    """
+    if not segments:
+        return 0
+    with metrics.timed('mehd_compaction_seconds', target=describe_path(path)):
+        tables = [pq.read_table(segment) for segment in segments]
+        staged = merge_tables(None, pa.concat_tables(tables, promote_options='permissive'))
+        save_parquet(staged, path, append=append)
+        for segment in segments:
+            os.remove(segment)
+    return staged.num_rows
+
+def discard_staging(path):
+    """Elimina i segmenti di un percorso (download in OVERWRITE)."""
+    staging_dir = get_staging_dir(path)
+    if os.path.isdir(staging_dir):
+        shutil.rmtree(staging_dir)
+
+def has_committed_data(path):
+    """True se esistono dati definitivi (la cartella del dataset può contenere solo _staging)."""
+    if is_dataset_path(path):
+        return bool(list_partitions(path))
+    return check_file_exists(path)
+
+def remove_orphan_tmp(path):
+    """Elimina i file .tmp di scritture atomiche interrotte (segmenti, partizioni o file singolo)."""
+    patterns = [os.path.join(get_staging_dir(path), '*.tmp')]
+    patterns.append(os.path.join(path, '*.tmp') if is_dataset_path(path) else f"{path}.tmp")
+    orphans = [tmp_path for pattern in patterns for tmp_path in glob.glob(pattern)]
+    for tmp_path in orphans:
+        os.remove(tmp_path)
+    if orphans:
+        logger.info(f"🧹 Eliminati {len(orphans)} file temporanei di una scrittura interrotta")
+    return len(orphans)
+
+def recover_staging(path, append):
+    """Gestisce i segmenti lasciati da una run interrotta prima di calcolare da dove riprendere.
+
+    I file .tmp di scritture a metà vengono eliminati (il rename atomico non è mai avvenuto).
+    In APPEND, o se i dati definitivi non esistono ancora, i segmenti vengono compattati;
+    in OVERWRITE di dati esistenti vengono scartati insieme ai dati che verranno sostituiti.
+    """
+    remove_orphan_tmp(path)
+    segments = list_segments(path)
+    if not segments:
+        return 0
+    if append or not has_committed_data(path):
+        rows = compact_segments(path, segments, append=True)
+        logger.info(f"♻️ Recuperate {rows} candele da {len(segments)} segmenti di staging")
+        return rows
+    discard_staging(path)
+    return 0
+
+class StagingWriter:
+    """Write-ahead su segmenti con compattazione in un thread separato.
+
+    write() è pensato come write_fn di un BackgroundWriter: scrive un segmento per pagina e avvia la
+    compattazione quando i segmenti accumulati superano compact_rows righe (una compattazione alla volta).
+    """
+
+    def __init__(self, path, append=False, compact_rows=STAGING_COMPACT_ROWS):
+        self.path = path
+        self.append = append
+        self.compact_rows = compact_rows
+        self.pending_rows = 0
+        self.compactor = None
+        self.error = None
+
+    def _compact(self, segments):
+        try:
+            compact_segments(self.path, segments, append=self.append)
+            self.append = True  # Dopo la prima compattazione si aggiunge sempre
+        except Exception as e:
+            self.error = e
+
+    def write(self, batch, append=None):
+        """Scrive un segmento (append è gestito dalla compattazione, non dal singolo segmento)."""
+        if self.error is not None:
+            raise self.error
+        write_segment(batch, self.path)
+        self.pending_rows += batch.num_rows
+        if self.pending_rows >= self.compact_rows and (self.compactor is None or not self.compactor.is_alive()):
+            self.pending_rows = 0
+            self.compactor = threading.Thread(target=self._compact, args=(list_segments(self.path),),
+                                              name='mehd-compactor', daemon=True)
+            self.compactor.start()
+
+    def close(self):
+        """Attende la compattazione in corso e compatta i segmenti rimanenti."""
+        if self.compactor is not None:
+            self.compactor.join()
+        if self.error is not None:
+            raise self.error
+        self._compact(list_segments(self.path))
+        if self.error is not None:
+            raise self.error